@@ -1,9 +1,23 @@
 """
 Warmup python exercises
 """
+import concurrent.futures
+import functools
 import random
 import time
 
+import numpy as np
+
+# 366 days to account for leap years
+DAYS_IN_YEAR = 366
+
+# random numbers drawn at once by a simulation, bounding its memory
+CHUNK_DRAWS = 1 << 22
+
+# trials with their own random stream, handed to a process each. The same seed gives
+# the same result however many processes there are
+BLOCK_TRIALS = 1 << 22
+
 
 def surface_area_pyramid(base, height):
     # calculate and return the surface area
@@ -50,42 +64,83 @@ def status_quo(units, prices):
     return output, sum(output)
 
 
-def birthday_sharing_probability(num_people, num_trials):
-    # we need to run some simulations
-    num_matches = 0
+def birthday_sharing_probability(num_people, num_trials, seed=None, processes=None):
+    # we need to run some simulations, a chunk of them at a time with numpy.
+    # processes: None to run them here, otherwise the number of processes to share them
+    return simulate(functools.partial(count_birthday_matches, num_people), num_trials,
+                    seed, processes)
 
-    # num_trials number of simulations
-    for i in range(num_trials):
-        matches = {}
 
-        # 1 simulation
-        i = 0
-        while i < num_people:
-            # 366 days to account for leap years
-            birthdate = random.randint(1, 366)
+def count_birthday_matches(num_people, num_trials, seed):
+    # number of simulations in which two people share a birthday
+    if num_people > DAYS_IN_YEAR:
+        return num_trials
+    if num_people < 2:
+        return 0
 
-            if birthdate not in matches:
-                matches[birthdate] = 0
-            else:
-                num_matches += 1
-                break
+    rng = np.random.default_rng(seed)
+    chunk = max(1, CHUNK_DRAWS // num_people)
+    num_matches = 0
 
-            i += 1
+    for start in range(0, num_trials, chunk):
+        # one row of birthdates per simulation
+        birthdates = rng.integers(1, DAYS_IN_YEAR + 1,
+                                  (min(chunk, num_trials - start), num_people),
+                                  dtype=np.int16)
 
-    return num_matches / num_trials
+        # once sorted, a shared birthdate sits next to its twin
+        birthdates.sort(axis=1)
+        shared = np.count_nonzero(birthdates[:, 1:] == birthdates[:, :-1], axis=1)
+        num_matches += np.count_nonzero(shared)
 
+    return num_matches
 
-def monty_hall_strategy(num_doors, switch, num_trials):
+
+def monty_hall_strategy(num_doors, switch, num_trials, seed=None, processes=None):
     # we need to run some simulations. let switch be boolean
+    return simulate(functools.partial(count_monty_hall_wins, num_doors, switch),
+                    num_trials, seed, processes)
+
+
+def count_monty_hall_wins(num_doors, switch, num_trials, seed):
+    # number of simulations won, as monty_hall_simulation plays them
+    rng = np.random.default_rng(seed)
+    chunk = CHUNK_DRAWS // 2
     wins = 0
 
-    for i in range(num_trials):
-        wins += monty_hall_simulation(num_doors, switch, num_trials)
+    for start in range(0, num_trials, chunk):
+        size = min(chunk, num_trials - start)
+        win = rng.integers(1, num_doors + 1, size, dtype=np.int32)
+        choice = rng.integers(1, num_doors + 1, size, dtype=np.int32)
+
+        # the host keeps the car closed if the contestant chose a goat, so switching
+        # wins exactly when staying loses
+        if switch:
+            wins += np.count_nonzero(win != choice)
+        else:
+            wins += np.count_nonzero(win == choice)
 
-    return wins/num_trials
+    return wins
 
 
-def monty_hall_simulation(num_doors, switch, num_trials):
+def simulate(count, num_trials, seed=None, processes=None):
+    # split the simulations in blocks, each with its own random stream spawned from
+    # seed, count them here or over a pool of processes, and return the share counted
+    sizes = [BLOCK_TRIALS] * (num_trials // BLOCK_TRIALS)
+    if num_trials % BLOCK_TRIALS:
+        sizes.append(num_trials % BLOCK_TRIALS)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    if processes is None:
+        counted = sum(map(count, sizes, seeds))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+            counted = sum(pool.map(count, sizes, seeds))
+
+    return counted / num_trials
+
+
+def monty_hall_simulation(num_doors, switch):
     # 1 simulation
     win = random.randint(1, num_doors)
     choice = random.randint(1, num_doors)
@@ -241,5 +296,9 @@ if __name__ == '__main__':
     print("\n# 6 - Monty Hall")
     print("With No Switch" , monty_hall_strategy(100, False, 1000000), "%")
     print("With Switch", monty_hall_strategy(100, True, 1000000), "%")
+
+    # 10^8 simulations, over 4 processes
+    print(birthday_sharing_probability(23, 10 ** 8, seed=0, processes=4))
+    print(monty_hall_strategy(100, True, 10 ** 8, seed=0, processes=4))
     '''
 
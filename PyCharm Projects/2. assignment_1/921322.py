@@ -11,6 +11,31 @@ Notes:
         This is done as profit margins can just be increased to offset this
     4. One action is performed per update received, to account for time delays and efficiency
     5. Assumes bot won't be paused midway, but can be closed and reopened.
+    6. With track_latency, the time from an order update to the strategy and to
+        send_order, and from send_order to the acknowledgement, is reported
+        at every session update. Switch it at runtime with bot.latency.enabled
+    7. With queued_logging, inform only queues its message and a background thread
+        formats and writes it, so order handling doesn't wait on the log file.
+        Trade messages, and those repeated while short of cash or widgets, can be
+        sampled with log_sample={"trade": N, "funds": M}
+    8. An OrderManager follows every order sent. The public and private markets
+        each take new orders while fewer than max_in_flight of their orders are
+        waiting on the server, and an order not acknowledged within order_timeout
+        seconds stops holding its market up.
+    9. Cash and widgets are reserved in a Ledger as soon as an order is sent, and
+        released when it is rejected, cancelled or settled, so the checks before
+        each order see what is left rather than the last holdings update.
+    10. Every manager order resting is worked at once, from a ManagerQueue ranked by
+        the margin each leaves against the public book. Public orders are sent for the
+        best request not yet covered, and widgets traded publicly go to the manager as
+        soon as they trade, while cash and widgets are left to complete every leg.
+    11. The private order for the manager is built when the public order is sent, and
+        sent from the update that says the public order traded, before the strategy
+        runs. Its latency is reported as the HEDGE strategy.
+    12. With batch_settlement, widgets traded publicly wait while the rest of their
+        manager order can still be traded in the public market, and go to the manager
+        in one order for all of its units. Fewer private orders, but widgets are held
+        until the manager order is covered, or no cash or widgets are left to cover it.
 
 What to do better next time:
     1. Track my own orders in a dict while they are active
@@ -25,10 +50,22 @@ What to do better next time:
     8. There is some noticeable overhead, orders are sometimes late to the party, try to optimise
 """
 import copy
+import os
+import sys
 from enum import Enum
 from fmclient import Agent, OrderSide, Order, OrderType, Session, Market
 from typing import List
 
+# shared modules live in the PyCharm Projects directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.order_book import OrderBook
+from common.latency import LatencyTracker
+from common.async_log import QueuedLogging
+from common.order_manager import OrderManager, OrderState, MAX_IN_FLIGHT, \
+    ORDER_TIMEOUT
+from common.ledger import Ledger
+from common.manager_queue import ManagerQueue
+
 # Student details
 SUBMISSION = {"number": "921322", "name": "Sidakpreet Mann"}
 
@@ -50,9 +87,12 @@ class BotType(Enum):
     REACTIVE = 1
 
 
-class DSBot(Agent):
+class DSBot(QueuedLogging, Agent):
     # ------ Add an extra argument bot_type to the constructor -----
-    def __init__(self, account, email, password, marketplace_id, bot_type):
+    def __init__(self, account, email, password, marketplace_id, bot_type,
+                 track_latency=False, queued_logging=False, log_sample=None,
+                 max_in_flight=MAX_IN_FLIGHT, order_timeout=ORDER_TIMEOUT,
+                 batch_settlement=False):
 
         super().__init__(account, email, password, marketplace_id, name="DSBot")
         self._public_market_id = 0
@@ -62,115 +102,241 @@ class DSBot(Agent):
         # ------ Add new class variable _bot_type to store the type of the bot
         self._bot_type = bot_type
 
-        # async order management
-        self._waiting_for_server = False
+        # async order management, reserving cash and widgets as orders are sent
+        self._ledger = Ledger()
+        self._orders = OrderManager(max_in_flight, order_timeout,
+                                    on_timeout=self._order_timed_out,
+                                    ledger=self._ledger,
+                                    on_fill=self._order_filled,
+                                    on_release=self._order_released)
         self._tradeID = 0
-        self._last_accepted_public_order_id = 0
-        self._units_to_trade = 0
 
         # holdings trackers
-        self._cash_available = 0
         self._cash = 0
         self._assets = {}
-        self._private_widgets_available = 0
-        self._public_widgets_available = 0
 
-        self._priv_orders = {}
         self._cant_respond_orders = {}
+        self._order_book = OrderBook()
+
+        # manager orders resting, and the orders sent to work them
+        self._managers = ManagerQueue()
+
+        # private order built ahead for each side, sent when a public order trades
+        self._hedge_orders = {True: None, False: None}
+        self._batch_settlement = batch_settlement
 
         # market state trackers
         self._session_is_open = False
         self._price_tick = 1
 
+        self._latency = LatencyTracker(enabled=track_latency)
+        if queued_logging:
+            self.start_log_queue(sample=log_sample)
+
+    @property
+    def latency(self):
+        """
+        LatencyTracker of this bot, set its enabled attribute to switch
+        tracking on or off
+        """
+        return self._latency
+
     # MARKET MAKER FUNCTIONALITY ##########################################################
     def _make_market(self):
 
         # get order book state summary
-        num_private_orders, num_my_public_orders, my_stale_priv_order, \
-            manager_order = self._get_order_book_state()
-
-        # reset order tracking when no private left - IDLE state
-        if num_private_orders == 0:
-            self._units_to_trade = 0
-            self._priv_orders = {}
+        num_private_orders, num_my_public_orders, my_stale_public_order = \
+            self._get_order_book_state()
 
         # CANCELLING STALE ORDERS =========================================================
-        if num_my_public_orders > 0 and self._units_to_trade < 1 and \
-                not self._waiting_for_server:
-            self._waiting_for_server = True
-            self._cancel_order(my_stale_priv_order)
-            self._last_accepted_public_order_id = 0
-            self._priv_orders = {}  # reset private order tracking
+        if self._cancel_stale_order(num_my_public_orders, my_stale_public_order):
             return
 
         # PRIVATE ORDER CREATION ==========================================================
-        # need to confirm that the last sent order traded, and manager order > 0
-
-        if (self._last_accepted_public_order_id not in Order.current()) \
-                and (self._units_to_trade > 0) and (not self._last_accepted_public_order_id == 0) \
-                and (num_my_public_orders == 0):
-
-            # determine order attributes
-            is_private = True
-            price = manager_order.price
-            units = 1
-            order_side = None
-
-            if self.role() == Role.BUYER:
-                order_side = OrderSide.SELL
-            elif self.role() == Role.SELLER:
-                order_side = OrderSide.BUY
-
-            order_type = OrderType.LIMIT
-            ref = f"Private order - {self._tradeID}"
-
-            if not self._waiting_for_server:
-                self._last_accepted_public_order_id = 0
-                self._units_to_trade -= 1
-                self._create_new_order(price, units, order_side, order_type, ref, is_private)
-                return
-        # END PRIVATE ORDER CREATION ======================================================
+        # widgets traded in the public market go to the manager straight away
+        self._hedge_traded_units()
 
         # PUBLIC ORDER CREATION ===========================================================
-        # no order of mine in the public market, but there is a private request
-
-        if self._units_to_trade > 0 and num_my_public_orders == 0 and \
-                not self._waiting_for_server:
-            # self._waiting_for_server = True
-            # self.inform("Creating public order.")
-            # determine order attributes
-            is_private = False
-
-            if self.role() == Role.BUYER:
-                order_side = OrderSide.BUY
-                price = manager_order.price - PROFIT_MARGIN
-            else:
-                order_side = OrderSide.SELL
-                price = manager_order.price + PROFIT_MARGIN
-
-            units = 1
-            order_type = OrderType.LIMIT
-            ref = f"Public order - {self._tradeID}"
-            if self.role() == Role.BUYER:
-                if self._cash_available >= price:
-                    self._waiting_for_server = True
-                    self._create_new_order(price, units, order_side, order_type, ref, is_private)
-                else:
-                    self.inform(f"Not enough cash to trade.")
-            else:
-                if self.role() == Role.SELLER:
-                    if self._public_widgets_available > 0:
-                        self._waiting_for_server = True
-                        self._create_new_order(price, units, order_side, order_type, ref, is_private)
-                    else:
-                        self.inform(f"Not enough widgets to trade.")
-            return
+        # quote for the best requests no public order was sent for yet
+        best_bid, best_ask, _, _ = self._get_best_bid_ask()
+        for side in self._ranked_sides(best_bid, best_ask):
+            while self._orders.can_send(self._public_market_id) and \
+                    self._quote(side):
+                pass
         # END PUBLIC ORDER CREATION =======================================================
+
+    def _quote(self, side):
+        """
+        Rests a public order for the marginal request of a side, PROFIT_MARGIN
+        better than the manager's price
+        :param side: ManagerSide to quote for
+        :return: True if an order was sent
+        """
+        request, units = side.marginal()
+        if request is None:
+            return False
+
+        if side.is_buy:
+            price = request.price - PROFIT_MARGIN
+        else:
+            price = request.price + PROFIT_MARGIN
+
+        units = self._affordable_units(side, price, units)
+        if units < 1:
+            if side.is_buy:
+                self.inform("Not enough cash or private widgets to trade.", category="funds")
+            else:
+                self.inform("Not enough widgets or cash to trade.", category="funds")
+            return False
+
+        self._send_public_leg(side, price, units, f"Public order - {self._tradeID}")
+        return True
+
     # SHARED FUNCTIONALITY ################################################################
 
     def role(self):
         return self._role
 
+    def _widgets_available(self, market_id):
+        """
+        :return: widgets held in the market and not reserved for a sell
+        """
+        return int(self._ledger.units_available[self._ledger.index(market_id)])
+
+    def _ranked_sides(self, best_bid, best_ask):
+        """
+        Sides of the manager queue with units to send public orders for, the one
+        whose marginal request leaves the most margin against the book first
+        :param best_bid: best buy price in the public market
+        :param best_ask: best sell price in the public market
+        :return: list of ManagerSide
+        """
+        ranked = []
+        for is_buy in (True, False):
+            side = self._managers.side(is_buy)
+            request, _ = side.marginal()
+            if request is None:
+                continue
+            margin = request.price - best_ask if is_buy else best_bid - request.price
+            ranked.append((-margin, not is_buy, side))
+        return [side for _, _, side in sorted(ranked, key=lambda item: item[:2])]
+
+    def _affordable_units(self, side, price, units):
+        """
+        Units of a public order that can be traded, and then traded with the manager,
+        with the cash and widgets not committed to other orders
+        :param side: ManagerSide the order is for
+        :param price: price of the public order
+        :param units: units wanted
+        :return: units that can be sent, 0 if none
+        """
+        # cash the manager's sell requests will take for the widgets sold for them
+        sells = self._managers.side(False)
+        cash = self._ledger.cash_available - sells.value(sells.hedging, sells.committed)
+
+        if side.is_buy:
+            # cash for the public buy, and private widgets to sell to the manager
+            units = min(units, cash // max(price, 1),
+                        self._widgets_available(self._private_market_id) - side.committed)
+        else:
+            # public widgets to sell, and cash to buy them back from the manager
+            units = min(units, self._widgets_available(self._public_market_id))
+            while units > 0 and side.value(side.claimed, units) > cash:
+                units -= 1
+        return max(units, 0)
+
+    def _send_public_leg(self, side, price, units, ref):
+        """
+        Sends a public order for a side of the manager queue
+        """
+        self._role = Role.BUYER if side.is_buy else Role.SELLER
+        order_side = OrderSide.BUY if side.is_buy else OrderSide.SELL
+
+        # the leg is ranked by the price the exchange gets
+        price = self._public_price(price)
+        self._managers.sent(ref, side.is_buy, False, price, units)
+        self._create_new_order(price, units, order_side, OrderType.LIMIT, ref, False)
+
+        # ready for when it trades
+        if self._hedge_orders[side.is_buy] is None:
+            self._hedge_orders[side.is_buy] = self._new_order(
+                OrderSide.SELL if side.is_buy else OrderSide.BUY, OrderType.LIMIT, True)
+
+    def _hedge_traded_units(self):
+        """
+        Trades the widgets bought or sold in the public market with the manager, for
+        those the update that traded them couldn't
+        """
+        for is_buy in (True, False):
+            self._hedge(self._managers.side(is_buy))
+
+    def _hedge(self, side):
+        """
+        Trades the widgets bought or sold in the public market for a side with the
+        manager, at the price of the best request not already being traded with
+        :param side: ManagerSide of the widgets
+        """
+        if side.to_hedge < 1 or not self._orders.can_send(self._private_market_id):
+            return
+        request, units = side.hedge_target()
+        if request is None:
+            # the requests went, the widgets stay with us
+            return
+        if self._batch_settlement and side.to_hedge < units and \
+                (side.working > 0 or self._affordable_units(side, request.price, 1) > 0):
+            # the rest of the request is still to be traded publicly, settle it at once
+            return
+        units = min(units, side.to_hedge)
+
+        # if we are a buyer, we sell in private market. Ensure have enough priv widgets
+        # if we are a seller, we buy in private market. Ensure have enough cash
+        if (side.is_buy and self._widgets_available(self._private_market_id) < units) or \
+                (not side.is_buy and self._ledger.cash_available < request.price * units):
+            self.inform("Not enough assets to trade. Please check widget and cash balance.",
+                        category="funds")
+            return
+
+        # the order built when the public order was sent, if still unused
+        new_order = self._hedge_orders[side.is_buy]
+        self._hedge_orders[side.is_buy] = None
+        if new_order is None:
+            new_order = self._new_order(OrderSide.SELL if side.is_buy else OrderSide.BUY,
+                                        OrderType.LIMIT, True)
+        new_order.price = request.price
+        new_order.units = units
+        new_order.ref = f"Private order - {self._tradeID}"
+
+        self._managers.sent(new_order.ref, side.is_buy, True, request.price, units)
+        self._send(new_order)
+
+    def _cancel_stale_order(self, num_my_public_orders, my_stale_public_order):
+        """
+        Cancels a public order of mine no manager order needs any more: any, when no
+        manager order is left, otherwise the worst priced one of a side whose requests
+        shrank below what its orders claim
+        :return: True if a cancel was sent
+        """
+        if num_my_public_orders == 0 or not self._orders.can_send(self._public_market_id):
+            return False
+
+        stale = None
+        if not self._managers:
+            stale = my_stale_public_order
+        else:
+            for is_buy in (True, False):
+                side = self._managers.side(is_buy)
+                if side.open >= 0 or side.working < 1:
+                    continue
+                managed = self._orders.get(self._managers.worst_leg(is_buy))
+                stale = managed and self._order_book.get(managed.fm_id)
+                if stale is not None:
+                    break
+
+        if stale is None:
+            return False
+        self._cancel_order(stale)
+        return True
+
     def pre_start_tasks(self):
         pass
 
@@ -181,17 +347,12 @@ class DSBot(Agent):
         """
         # track cash assets
         self._cash = holdings.cash
-        self._cash_available = holdings.cash_available
 
         # dict to track units of widgets and private widgets
         self._assets = holdings.assets
 
-        # track available public and private units
-        for key in self._assets:
-            if key.fm_id == self._public_market_id:
-                self._public_widgets_available = self._assets[key].units_available
-            elif key.fm_id == self._private_market_id:
-                self._private_widgets_available = self._assets[key].units_available
+        # available cash and public and private units, less reservations
+        self._ledger.update_holdings(holdings)
 
     def initialised(self):
         """
@@ -212,27 +373,58 @@ class DSBot(Agent):
 
         # track public market price tick
         self._price_tick = Market(self._public_market_id).price_tick
+        self._ledger.set_markets([self._public_market_id, self._private_market_id])
 
     def order_accepted(self, order: Order):
         """
         Notifies last order being accepted
-        Async - no longer waiting for the server
         :param order: previous accepted order
         """
-        self._waiting_for_server = False
-
-        # track my last accepted public order by fm_id
-        if not order.is_private and (not order.order_type == OrderType.CANCEL):
-            self._last_accepted_public_order_id = order.fm_id
+        self._latency.acknowledged(order.ref)
+        self._orders.accepted(order)
 
     def order_rejected(self, info, order: Order):
         """
         Notifies last order being rejected
-        Async - no longer waiting for the server
         :param info: details of rejected order
         :param order: previous rejected order
         """
-        self._waiting_for_server = False
+        self._latency.acknowledged(order.ref, accepted=False)
+        self._orders.rejected(order)
+
+    def _order_timed_out(self, managed):
+        """
+        Warns of an order not acknowledged in time, its market takes orders again
+        :param managed: ManagedOrder of the order
+        """
+        self.warning("Order timed out: %s", managed)
+
+    def _order_filled(self, managed, units):
+        """
+        Units of an order traded, a public one's go to the manager from this same
+        update, before the strategy runs
+        :param managed: ManagedOrder of the order
+        """
+        side = self._managers.filled(managed.ref, units)
+        if side is None or not self._session_is_open:
+            return
+        self._latency.enter("HEDGE")
+        self._hedge(side)
+        self._latency.exit()
+
+    def _order_released(self, managed):
+        """
+        An order was rejected, cancelled, timed out or lost, its units are free
+        again, a timed out private leg's once it is lost
+        :param managed: ManagedOrder of the order
+        """
+        self._managers.released(managed.ref,
+                                timed_out=managed.state == OrderState.TIMED_OUT)
+
+    def _on_orders_update(self, order_json):
+        # the moment an update is delivered, before fmclient parses it
+        self._latency.tick()
+        super()._on_orders_update(order_json)
 
     def received_orders(self, orders: List[Order]):
         """
@@ -240,17 +432,33 @@ class DSBot(Agent):
         Notifies new updates in the market
         :param orders: list of order objects (updates)
         """
+        self._order_book.update(orders)
+        self._orders.update(orders)
+
+        # manager orders filed or gone with this update, the balance of a partly
+        # traded one comes after it and keeps its request
+        gone = []
+        for order in orders:
+            if self._order_book.is_manager_order(order.fm_id):
+                self._managers.update(order)
+            elif order.is_private and not getattr(order, "mine", False):
+                gone.append(order)
+        for order in gone:
+            self._managers.remove(order)
+
         # only call strategies if current session is open
         if not self._session_is_open:
             return
 
         # call appropriate strategy based on bot type
+        self._latency.enter(self._bot_type.name)
         if self._bot_type == BotType.REACTIVE:
             self._react_to_market()
         elif self._bot_type == BotType.MARKET_MAKER:
             self._make_market()
+        self._latency.exit()
 
-    def  Go_create_new_order(self,
+    def _create_new_order(self,
                           price: int,
                           units: int,
                           order_side: OrderSide,
@@ -259,7 +467,7 @@ class DSBot(Agent):
                           is_private: bool):
         """
         Creates a new order given the parameters
-        :param price: determined price
+        :param price: determined price, on the tick for a public order
         :param units: # of units to be submitted, fixed to 1
         :param order_side: buy or sell
         :param order_type: limit or market, fixed to limit
@@ -267,34 +475,54 @@ class DSBot(Agent):
         :return:
         """
 
-        new_order = Order.create_new()
+        new_order = self._new_order(order_side, order_type, is_private)
+        new_order.price = price
+        new_order.units = units
+        new_order.ref = ref
+        self._send(new_order)
 
-        # derive order attributes
+    def _public_price(self, price):
+        """
+        :param price: determined price
+        :return: the price rounded to the public market's tick, within its bounds
+        """
+        # make sure price is rounded in the public market
+        price -= price % self._price_tick
+
+        # in case price goes less than the tick, or more than ten
+        # set prices to the bounds
+        if price < self._price_tick:
+            price = self._price_tick
+        elif price > MAX_PRICE:
+            price = MAX_PRICE
+        return price
+
+    def _new_order(self, order_side, order_type, is_private):
+        """
+        Creates an order with what doesn't change from one order to the next, price,
+        units and ref are set before it is sent
+        :param order_side: buy or sell
+        :param order_type: limit or market, fixed to limit
+        :param is_private: True for an order to the manager
+        :return: the new order
+        """
+        new_order = Order.create_new()
         if is_private:
-            market = self._private_market_id
+            new_order.market = Market(self._private_market_id)
             new_order.owner_or_target = MANAGER_ID
         else:
-            market = self._public_market_id
-
-            # make sure price is rounded in the public market
-            price -= price % self._price_tick
-
-            # in case price goes less than the tick, or more than ten
-            # set prices to the bounds
-            if price < self._price_tick:
-                price = self._price_tick
-            elif price > MAX_PRICE:
-                price = MAX_PRICE
-
-        new_order.market = Market(market)
-        new_order.price = price
-        new_order.units = units
+            new_order.market = Market(self._public_market_id)
         new_order.order_side = order_side
         new_order.order_type = order_type
-        new_order.ref = ref
+        return new_order
 
-        # send order through
-        self._waiting_for_server = True
+    def _send(self, new_order):
+        """
+        Sends an order through, following it in the order manager
+        :param new_order: order with every attribute set
+        """
+        self._orders.sent(new_order)
+        self._latency.sent(new_order.ref)
         self.send_order(new_order)
 
         self._tradeID += 1
@@ -304,13 +532,12 @@ class DSBot(Agent):
         Helper function to cancel given order
         :param order: order to be cancelled
         """
-
-        self._waiting_for_server = True
-
         cancel_order = copy.copy(order)
         cancel_order.order_type = OrderType.CANCEL
         cancel_order.ref = f"SM - Cancel - {order.ref}"
 
+        self._orders.sent(cancel_order)
+        self._latency.sent(cancel_order.ref)
         self.send_order(cancel_order)
 
     def received_completed_orders(self, orders, market_id=None):
@@ -318,15 +545,20 @@ class DSBot(Agent):
 
     def received_session_info(self, session: Session):
 
+        self._order_book.reset(Order.current().values())
+        self._managers.reset(self._order_book.manager_orders())
+
+        for line in self._latency.report():
+            self.inform("Latency: %s", line)
+        self._latency.reset()
+
         # when bot is running and session is reset, reset appropriate variables
         if session.is_open:
-            self._waiting_for_server = False
+            self._orders.reset()
+            self._hedge_orders = {True: None, False: None}
             self._tradeID = 0
-            self._last_accepted_public_order_id = 0
 
             self._assets = {}
-            self._units_to_trade = 0
-            self._priv_orders = {}
             self._session_is_open = True
 
         else:
@@ -344,75 +576,33 @@ class DSBot(Agent):
         best_bid, best_ask, best_bid_order, best_ask_order = self._get_best_bid_ask()
 
         # track state of order book
-        num_private_orders, num_my_public_orders, my_stale_priv_order, \
-            manager_order = self._get_order_book_state()
+        num_private_orders, num_my_public_orders, my_stale_public_order = \
+            self._get_order_book_state()
 
         # reset order tracking when no private left - IDLE state
         if num_private_orders == 0:
-            self._units_to_trade = 0
-            self._priv_orders = {}
             self._cant_respond_orders = {}
 
         # CANCELLING STALE ORDERS =========================================================
-        if num_my_public_orders > 0 and self._units_to_trade < 1 and \
-                not self._waiting_for_server:
-
-            self._waiting_for_server = True
-            self._cancel_order(my_stale_priv_order)
-            self._last_accepted_public_order_id = 0
+        self._cancel_stale_order(num_my_public_orders, my_stale_public_order)
 
         # PRIVATE ORDER CREATION ==============================================================
-        # only create private order if public order traded successfully, and there exists
-        # a corresponding manager order
-        if (self._last_accepted_public_order_id not in Order.current()) \
-                and (self._units_to_trade > 0) and (not self._last_accepted_public_order_id == 0) \
-                and (num_my_public_orders == 0):
-
-            self._last_accepted_public_order_id = 0
-            self.inform("Last public order traded, creating private order.")
-
-            # determine order attributes
-            is_private = True
-            price = manager_order.price
-            units = 1
-            if self.role() == Role.BUYER:
-                order_side = OrderSide.SELL
-            else:
-                order_side = OrderSide.BUY
-            order_type = OrderType.LIMIT
-            ref = f"Private order - {self._tradeID}"
-
-            # if we are a buyer, we sell in private market. Ensure have enough priv widgets
-            # if we are a seller, we buy in private market. Ensure have enough cash
-            if (self.role() == Role.BUYER and self._private_widgets_available > 0) or \
-                    (self.role() == Role.SELLER and self._cash_available >= price):
-
-                # self.inform(f"Units left to trade = {self._units_to_trade}")
-                if not self._waiting_for_server:
-                    self._units_to_trade -= 1
-                    self._create_new_order(price, units, order_side, order_type, ref, is_private)
-            else:
-                self.inform("Not enough assets to trade. Please check widget and cash balance.")
+        # widgets traded in the public market go to the manager straight away, while
+        # public orders for other requests are still out
+        self._hedge_traded_units()
 
         # END PRIVATE ORDER CREATION ==========================================================
 
-        # self.inform(f"{num_my_public_orders}, {num_private_orders}, remaining trades => {self._units_to_trade}")
-
         # PUBLIC ORDER CREATION ===============================================================
-        # stale orders should be cleared at this stage; there exists a private order
-        # create an order based on best bid / ask
+        # respond to the best bid / ask for the requests with the most margin first
 
-        if self._units_to_trade > 0 and num_my_public_orders == 0 and \
-                not self._waiting_for_server:
-
-            is_private = False
-            self._create_profitable_order(best_ask, best_bid, manager_order, is_private,
-                                          best_bid_order, best_ask_order)
+        for side in self._ranked_sides(best_bid, best_ask):
+            if self._orders.can_send(self._public_market_id):
+                self._create_profitable_order(side, best_bid_order, best_ask_order)
 
         # END PUBLIC ORDER CREATION ===========================================================
 
-    @staticmethod
-    def _get_best_bid_ask():
+    def _get_best_bid_ask(self):
         """
         Determine and return best active bid and asks in the order book
         :return: best_bid: best buy price
@@ -424,18 +614,18 @@ class DSBot(Agent):
         # initial bid and asks unrealistic / out of bound
         best_bid = 0
         best_ask = 999999
-        best_ask_order = None
-        best_bid_order = None
-
-        # run through the order book, determine best bid and asks
-        for fm_id, order in Order.current().items():
-            if not order.is_consumed and not order.is_private:
-                if order.order_side == OrderSide.BUY and order.price > best_bid:
-                    best_bid = order.price
-                    best_bid_order = order
-                elif order.order_side == OrderSide.SELL and order.price < best_ask:
-                    best_ask = order.price
-                    best_ask_order = order
+
+        # the order book index only holds public, active orders. Mine are left out,
+        # with both sides worked at once they could trade with each other
+        best_bid_order = self._order_book.best_bid(self._public_market_id,
+                                                   include_mine=False)
+        best_ask_order = self._order_book.best_ask(self._public_market_id,
+                                                   include_mine=False)
+
+        if best_bid_order is not None:
+            best_bid = best_bid_order.price
+        if best_ask_order is not None:
+            best_ask = best_ask_order.price
 
         return best_bid, best_ask, best_bid_order, best_ask_order
 
@@ -445,109 +635,74 @@ class DSBot(Agent):
         :param other_order: order that's profitable given the profit margin
         :return:
         """
-        self.inform(f"I am a {self.role()} with profitable order {other_order}")
+        self.inform("I am a %s with profitable order %s", self.role(), other_order)
 
     def _get_order_book_state(self):
         """
-        Ascertain how many active orders are mine, or from the manager to me,
-            and if I have a stale order in the markets
+        Ascertain how many active orders are from the manager to me, how many public
+            ones are mine and which of those was placed last, read from the order book
+            as it is kept rather than by walking it
         :return: num_private_orders : number of active private orders
                  num_my_public_orders : number of my non-trade public orders
-                 my_stale_priv_order : which order of mine is stale
-                 manager_order : order object created by the manager
-        """
-        num_private_orders = 0
-        manager_order = None
-        num_my_public_orders = 0
-        my_stale_priv_order = None
-
-        for fm_id, order in Order.current().items():
-            # if there is a private order not created by me
-            if order.is_private and not order.mine:
-                num_private_orders += 1
-                manager_order = order
-                if manager_order.fm_id not in self._priv_orders and \
-                        manager_order.original_id not in self._priv_orders:
-                    self._units_to_trade = manager_order.units
-                    self._priv_orders[order.fm_id] = order.units
-
-                # figure out our role based on private order
-                if manager_order.order_side == OrderSide.BUY:
-                    self._role = Role.BUYER
-                else:
-                    self._role = Role.SELLER
-
-            # if i created a public order that DID NOT EXECUTE IMMEDIATELY
-            elif not order.is_private and order.mine:
-                num_my_public_orders += 1
-                my_stale_priv_order = order
-
-        return num_private_orders, num_my_public_orders, my_stale_priv_order, manager_order
-
-    def _create_profitable_order(self, best_ask, best_bid, manager_order, is_private,
-                                 best_bid_order, best_ask_order):
+                 my_stale_public_order : my public order filed last
+        """
+        num_private_orders = self._order_book.num_manager_orders()
+        num_my_public_orders = self._order_book.num_my_public_orders()
+        my_stale_public_order = self._order_book.last_my_public_order()
+
+        return num_private_orders, num_my_public_orders, my_stale_public_order
+
+    def _create_profitable_order(self, side, best_bid_order, best_ask_order):
         """
         For Reactive bot only
-        Handle the creation of profitable orders in the public market
-        :param best_ask: best asking price
-        :param best_bid: best bidding price
-        :param manager_order: manager's order object
-        :param is_private: if order to be created is private or not
+        Handle the creation of profitable orders in the public market, for the
+        marginal request of a side of the manager queue
+        :param side: ManagerSide to trade for
         :param best_bid_order: order object of best bidder
         :param best_ask_order: order object of best seller
         """
-
-        if self._units_to_trade == 0:
+        request, units = side.marginal()
+        if request is None:
             return
 
         # if buyer
-        if self.role() == Role.BUYER:
+        if side.is_buy:
             # if the best selling price is less than
             # or equal to the price we want to buy at, submit order
-            if best_ask <= manager_order.price - PROFIT_MARGIN:
-
-                # determine order attributes
-                price = best_ask
-                units = 1
-                order_side = OrderSide.BUY
-                order_type = OrderType.LIMIT
-                ref = f"SM - {order_side}-{self._tradeID}"
-
-                # if we have enough cash available, make the order
-                if self._cash_available >= price:
-                    self._create_new_order(price, units, order_side, order_type, ref, is_private)
-                    self.inform("Responding to profitable order")
-                    self._print_trade_opportunity(best_ask_order)
-
-                else:
-                    if not self._waiting_for_server:
-                        if best_ask_order.fm_id not in self._cant_respond_orders:
-                            self.inform(f"Not enough cash, but want to respond to: {best_ask_order}")
-                            self._cant_respond_orders[best_ask_order.fm_id] = 1
+            other_order = best_ask_order
+            if other_order is None or \
+                    other_order.price > request.price - PROFIT_MARGIN:
+                return
+            order_side = OrderSide.BUY
+            missing = "cash"
 
         # if we are sellers
         else:
-            # if the best asking price is more than
+            # if the best bidding price is more than
             # or equal to the price we want to sell at, submit order
-            if best_bid >= manager_order.price + PROFIT_MARGIN:
-                price = best_bid
-                units = 1
-                order_side = OrderSide.SELL
-                order_type = OrderType.LIMIT
-                ref = f"SM - {order_side}-{self._tradeID}"
-
-                # only sell if have any public widgets available
-                if self._public_widgets_available > 0:
-                    self.inform("Creating public order.")
-                    self._create_new_order(price, units, order_side, order_type, ref, is_private)
-                    self.inform("Responding to profitable order.")
-                    self._print_trade_opportunity(best_bid_order)
-
-                else:
-                    if not self._waiting_for_server:
-                        if best_bid_order.fm_id not in self._cant_respond_orders:
-                            self.inform(f"Not enough widgets, but want to respond to: {best_bid_order}")
-                            self._cant_respond_orders[best_bid_order.fm_id] = 1
+            other_order = best_bid_order
+            if other_order is None or \
+                    other_order.price < request.price + PROFIT_MARGIN:
+                return
+            order_side = OrderSide.SELL
+            missing = "widgets"
+
+        # determine order attributes, as many units as the order and the request have
+        price = other_order.price
+        units = self._affordable_units(side, price, min(units, other_order.units))
+        ref = f"SM - {order_side}-{self._tradeID}"
+
+        # if we have enough cash / public widgets available, make the order
+        if units > 0:
+            sampled = self.log_sampled("trade")
+            self._send_public_leg(side, price, units, ref)
+            if sampled:
+                self.inform("Responding to profitable order")
+                self._print_trade_opportunity(other_order)
+
+        elif other_order.fm_id not in self._cant_respond_orders:
+            self.inform("Not enough %s, but want to respond to: %s", missing, other_order)
+            self._cant_respond_orders[other_order.fm_id] = 1
 
 
 if __name__ == "__main__":
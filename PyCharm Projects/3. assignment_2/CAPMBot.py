@@ -15,24 +15,74 @@ PLEASE READ:
         better than the  current performance for those trades to go through,
         this can be custom set when instantiating the bot. Increasing this param
         makes multi-unit orders more probable)
+       With depth_aware (default), the full order book ladder of every market
+        is searched for the multi-unit trades that maximise performance,
+        instead of one unit at the best bid / ask of each market.
+       With event_driven, a new best price from another trader, one of our
+        quotes being hit or a change in units / settled cash also runs a
+        strategy pass within milliseconds. Bursts of updates inside the
+        debounce window are coalesced into one pass.
     2. EVERY 6 SECONDS: Notes sold if cash drops below arbitrary threshold.
     3. EVERY 1 SECOND:
-        3.1 Clear all current orders
-        3.2 If portfolio not optimal, execute reactive strategy
-        3.3 If portfolio is optimal, execute market maker strategy
-            3.3.1 With MM strategy, send orders, then wait 1.25 seconds before
-            3.3.2 proceeding. Rationale is that portfolio is currently optimal
-            3.3.3 any trades that go through past now would be favourable.
+        3.1 If portfolio not optimal, execute reactive strategy and clear
+            all current orders, they were priced for the old holdings
+        3.2 If portfolio is optimal, execute market maker strategy
+            3.2.1 With MM strategy, send orders, then wait 1.25 seconds before
+            3.2.2 proceeding. Rationale is that portfolio is currently optimal
+            3.2.3 any trades that go through past now would be favourable.
+            3.2.4 The wait is scheduled on the event loop, so updates keep
+            3.2.5 being processed, and it ends early when a quote is hit.
+            3.2.6 Quotes are a ladder of quote_levels units per side, each
+            3.2.7 priced from a reservation price table that is only rebuilt
+            3.2.8 when units or cash change.
+            3.2.9 Resting quotes that still match are kept, only the cancels
+            3.2.10 and new orders that differ are sent.
+    4. With track_latency, the time from an order update to each strategy
+        and to send_order, and from send_order to the acknowledgement, is
+        kept per strategy and reported at every session update. It can be
+        switched at runtime through bot.latency.enabled.
+    5. With queued_logging, inform only queues its message, a background
+        thread formats and writes it. The status lines of every cycle can be
+        sampled with log_sample={"status": N}, keeping 1 cycle in N.
+    6. Every order sent is followed by an OrderManager. A market takes new
+        orders while fewer than max_in_flight of its orders are waiting on
+        FlexeMarkets, counting each order and cancel of a batch, so the other
+        markets keep trading, and an order that isn't acknowledged within
+        order_timeout seconds stops holding its market up. A reactive trade
+        sends one order per market.
+    7. The cash and units of every order are reserved in a Ledger when it is
+        sent, and released when it is rejected, cancelled or settled, so
+        the pre-trade checks of back-to-back orders don't spend the same
+        cash twice before received_holdings catches up.
+    8. Our fills move a shadow portfolio as soon as they are echoed, and the
+        variance, expected return and performance are updated from it, so
+        no decision waits on received_holdings. The holdings are reconciled
+        with the fills they account for, whichever of the two arrives
+        first, each fill is applied once however often it is echoed, and
+        any drift is logged.
 """
-import copy
 import logging
-import itertools
-import time
+import os
+import sys
 from enum import Enum
 from typing import List
 import numpy as np
-from fmclient import Agent, Session, Market
+from fmclient import Agent, Session
 from fmclient import Order, OrderSide, OrderType
+from portfolio import VarianceEngine, order_set_choices, choice_unit_deltas
+from portfolio import ShadowPortfolio
+from portfolio import SELL_TO_BID, BUY_FROM_ASK
+from optimiser import Fill, optimise_fills
+from markets import MarketRegistry
+
+# shared modules live in the PyCharm Projects directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.order_book import OrderBook
+from common.quote_manager import QuoteManager
+from common.latency import LatencyTracker
+from common.async_log import QueuedLogging
+from common.order_manager import OrderManager, MAX_IN_FLIGHT, ORDER_TIMEOUT
+from common.ledger import Ledger
 
 # Submission details
 SUBMISSION = {"number": "921322", "name": "Sidakpreet Mann"}
@@ -45,6 +95,10 @@ MIN_CASH_THRESHOLD = 500
 NOTE_SELLING_PRICE = 495
 MM_STALL_TIME = 1.25
 PROFIT_MARGIN = 50
+MM_QUOTE_LEVELS = 3
+OPTIMISER_TIME_BUDGET = 0.005
+MAX_ORDER_SET_SECURITIES = 8
+EVENT_DEBOUNCE_TIME = 0.05
 
 
 # Bot type enum
@@ -53,10 +107,14 @@ class BotType(Enum):
     REACTIVE = 1
 
 
-class CAPMBot(Agent):
+class CAPMBot(QueuedLogging, Agent):
 
     def __init__(self, account, email, password, marketplace_id,
-            risk_penalty=0.007, session_time=20, aggressiveness_param=0.00):
+            risk_penalty=0.007, session_time=20, aggressiveness_param=0.00,
+            depth_aware=True, event_driven=False,
+            debounce=EVENT_DEBOUNCE_TIME, quote_levels=MM_QUOTE_LEVELS,
+            track_latency=False, queued_logging=False, log_sample=None,
+            max_in_flight=MAX_IN_FLIGHT, order_timeout=ORDER_TIMEOUT):
         """
         Constructor for the Bot
         :param account: Account name
@@ -64,36 +122,81 @@ class CAPMBot(Agent):
         :param password: password
         :param marketplace_id: id of the marketplace
         :param risk_penalty: Penalty for risk
-        :param session_time: Total trading time for one session
+        :param session_time: Total trading time for one session, not used
+        :param depth_aware: Reactive strategy trades multiple units against
+                            the whole order book, not 1 unit at best bid/ask
+        :param event_driven: Relevant market events also trigger a
+                            strategy pass, not only the 1 second timer
+        :param debounce: Shortest time in seconds between event passes,
+                         events in between are coalesced
+        :param quote_levels: Units quoted on each side of each market by the
+                             market maker, each at its own reservation price
+        :param track_latency: Keep tick to trade latency histograms from
+                              the start, see the latency property
+        :param queued_logging: Log through a background thread, see
+                               common.async_log
+        :param log_sample: With queued_logging, dictionary of category to N,
+                           only 1 in N of its records is logged
+        :param max_in_flight: Orders a market may have waiting on
+                              FlexeMarkets before it takes no new ones
+        :param order_timeout: Seconds before an order that isn't acknowledged
+                              no longer counts as in flight
         """
         super().__init__(account, email, password, marketplace_id,
                          name="CAPM Bot")
 
-        self._payoffs = {}
+        self._registry = None
+        self._variance_engine = None
+        self._shadow = None
         self._risk_penalty = risk_penalty
-        self._session_time = session_time
-        self._market_ids = {}
-        self._short_units_allowed = {}
+        self._order_book = OrderBook()
+        self._quotes = QuoteManager(self._order_book)
 
-        self._asset_units = {}
-        self._cash_available = 0
+        # units held, indexed like the registry
+        self._asset_units = None
         self._cash_settled = 0
+
+        # cash and units available, less what sent orders have reserved
+        self._ledger = Ledger()
         self._current_port_variance = 0
         self._current_exp_return = 0
         self._current_performance = 0
 
         self._aggressiveness_param = aggressiveness_param + 1
-        self._waiting = False
+        self._depth_aware = depth_aware
+        self._event_driven = event_driven
+        self._debounce = debounce
+        self._pending_pass = None
+        self._last_pass_time = float("-inf")
+        self._orders = OrderManager(max_in_flight, order_timeout,
+                                    on_timeout=self._order_timed_out,
+                                    ledger=self._ledger)
         self._bot_type = BotType.REACTIVE
         self._order_id = 0
 
         # reactive bot
         self._reactive_orders = []
-        self._num_orders_sent = 0
+        self._order_set_choices = None
+        self._order_set_deltas = None
+        self._order_set_sizes = None
 
         # market maker bot
         self._mm_orders = {}
-        self._num_active_mm_orders = 0
+        self._mm_dwell = None
+        self._quote_levels = quote_levels
+        self._reservation_prices = None
+
+        self._latency = LatencyTracker(enabled=track_latency)
+        if queued_logging:
+            self.start_log_queue(sample=log_sample)
+
+    @property
+    def latency(self):
+        """
+        :return: the bot's LatencyTracker, set its enabled attribute to
+                    switch tracking on or off
+        """
+        return self._latency
 
     @staticmethod
     def _initialise_custom_log():
@@ -109,14 +212,25 @@ class CAPMBot(Agent):
         instance attributes
         :return:
         """
-        # Extract payoff distribution for each security
-        for market_id, market_info in self.markets.items():
-            # store market id for each item
-            self._market_ids[market_info.item] = market_id
-
-            security = market_info.item
-            description = market_info.description
-            self._payoffs[security] = [int(a) for a in description.split(",")]
+        # index every security and extract its payoff distribution
+        self._registry = MarketRegistry(self.markets)
+        self._ledger.set_markets([market.fm_id
+                                  for market in self._registry.markets])
+
+        # payoff table and covariance matrix never change, build them once
+        self._variance_engine = VarianceEngine(
+            self._registry.payoffs / CENTS_IN_DOLLAR)
+        self._shadow = ShadowPortfolio(self._variance_engine)
+
+        # every reactive order set, encoded once as rows of unit deltas.
+        # There are 3^n of them, so with many securities the top of book
+        # is searched by the optimiser instead
+        if len(self._registry) <= MAX_ORDER_SET_SECURITIES:
+            self._order_set_choices = order_set_choices(len(self._registry))
+            self._order_set_deltas = choice_unit_deltas(
+                self._order_set_choices)
+            self._order_set_sizes = np.count_nonzero(self._order_set_choices,
+                                                     axis=1)
 
         # every second, determine which strategy to trade with
         self.execute_periodically(
@@ -130,8 +244,9 @@ class CAPMBot(Agent):
             WAIT_6_SECONDS
         )
 
-        self.inform(f"Market IDs: {self._market_ids}")
-        self.inform(f"Payoffs   : {self._payoffs}")
+        self.inform(f"Securities: {self._registry}")
+        self.inform(f"Payoffs   : "
+                    f"{self._registry.payoffs.astype(int).tolist()}")
         self._bot_type = BotType.REACTIVE
 
         return
@@ -142,212 +257,172 @@ class CAPMBot(Agent):
         Controller function - Execute this control flow every second
         ===================
 
-        1. Start with clean slate - delete my outstanding orders in the market
-        2. Check if portfolio is optimal and implement reactive strat
-            concurrently. This is more efficient.
-        3. If Reactive can be implemented, portfolio is not optimal
-        4. Once reactive is implemented, clear out all of our sent orders
+        1. Check if portfolio is optimal and implement reactive strat
+            concurrently. This is more efficient. Our own resting quotes
+            are ignored
+        2. If Reactive can be implemented, portfolio is not optimal
+        3. Once reactive is implemented, clear out all of our resting orders
             as they are stale
-        5. If Reactive can't be implemented, portfolio is optimal
-            and hence can implement market maker .Once market maker is
+        4. If Reactive can't be implemented, portfolio is optimal
+            and hence can implement market maker, moving our resting quotes
+            onto the new ones. Once market maker is
             implemented, wait 1.25 seconds so there is some time for the sent
-            orders to be executed
+            orders to be executed. The wait is a continuation scheduled on
+            the event loop, ticks that arrive during it are skipped
 
         :return:
         """
-        if self._current_performance == 0:
+        if self._current_performance == 0 or self._mm_dwell is not None:
             return
 
-        self.inform(f"=============================")
-        self.inform(f"Portfolio var: {self._current_port_variance}")
-        self.inform(f"Exp return   : {self._current_exp_return}")
-        self.inform(f"Performance  : {self._current_performance}")
-        self.inform(f"=============================")
+        if self.log_sampled("status"):
+            self.inform("=============================")
+            self.inform("Portfolio var: %s", self._current_port_variance)
+            self.inform("Exp return   : %s", self._current_exp_return)
+            self.inform("Performance  : %s", self._current_performance)
+            self.inform("=============================")
 
         # if bot is market maker, stall for 1.25 seconds (check notes)
+        # without blocking the event loop, then carry on with the cycle
         if self._bot_type == BotType.MARKET_MAKER:
-            time.sleep(MM_STALL_TIME)
+            self._mm_dwell = self._loop.call_later(MM_STALL_TIME,
+                                                   self._end_mm_dwell)
+            return
+
+        self._run_strategy_cycle()
 
-        # cancel all current orders
-        self._cancel_my_orders()
+    def _end_mm_dwell(self):
+        """
+        Continuation once market maker quotes have rested in the book for
+        MM_STALL_TIME, or straight away when one of them is hit
+        """
+        if self._mm_dwell is None:
+            return
+        self._mm_dwell.cancel()
+        self._mm_dwell = None
 
+        self._safely_call_method(self._run_strategy_cycle)
+
+    def _run_strategy_cycle(self):
+        """
+        Runs the strategies for one cycle, see _execute_appropriate_strategy
+        """
         self._bot_type = BotType.REACTIVE
+        self._latency.enter(BotType.REACTIVE.name)
         # run reactive strategy - (determines if portfolio is optimal)
         is_optimal = self._reactive_strategy()
         if not is_optimal:
-            self.inform("Reactive strategy")
+            self.inform("Reactive strategy", category="strategy")
 
-        else:
-            self.inform("Market Maker strategy")
-            self.inform("Waiting 1. 25 seconds")
+            # quotes were priced for holdings that are about to change
+            self._cancel_my_orders()
 
-        # any orders that didn't immediately trade are stale
-        # cancel stale orders
-        self._cancel_my_orders()
+        else:
+            if self.log_sampled("strategy"):
+                self.inform("Market Maker strategy")
+                self.inform("Waiting 1. 25 seconds")
+        self._latency.exit()
 
-        # market make only if we are at an optimal state
+        # market make only if we are at an optimal state, quotes that are
+        # still wanted stay in the book
         if is_optimal:
             self._bot_type = BotType.MARKET_MAKER
+            self._latency.enter(BotType.MARKET_MAKER.name)
             self._market_making_strategy()
-
-    # conditions for periodic orders, for some reason only works properly
-    # with function pointers
-    def _is_bot_reactive(self):
-        return self._bot_type == BotType.REACTIVE
-
-    def _is_bot_mm(self):
-        return self._bot_type == BotType.MARKET_MAKER
+            self._latency.exit()
 
     def _market_making_strategy(self):
         """
         MARKET MAKER STRATEGY
         =====================
-        Simulate acquiring/disposing off one unit of each security to calculate
-        the change in performance because of this balancing.
-
-        This change in performance is determined to be the price the security
-        should by bought/sold for (accounts for changing variance and
-        changing expected return)
+        Reads the price each of the next quote_levels units of each security
+        should be bought/sold for from the reservation price table (accounts
+        for changing variance and changing expected return of every extra
+        unit)
 
-        That price is then adjusted by a PROFIT MARGIN, and submitted to the
-        market
+        Those prices are then adjusted by a PROFIT MARGIN, and submitted to
+        the market as a ladder of 1 unit quotes
         """
-        # do nothing if sending through orders
-        if self._waiting or (len(self._asset_units.keys()) == 0):
+        if self._asset_units is None:
             return
 
-        self._mm_orders = {}
-
-        # acquire list of all securities
-        securities = list(self._payoffs.keys())
-
-        # for each security, determine the prices of valid buys and sells that
-        # can be created in the market
-        order = Order.create_new()
-        order.price = 0
-
-        for security in securities:
-
-            order.market = Market(self._market_ids[security])
-
-            # create quasi buy order
-            order.order_side = OrderSide.BUY
-            self.is_portfolio_optimal([order])
-
-            # create quasi sell order
-            order.order_side = OrderSide.SELL
-            self.is_portfolio_optimal([order])
+        buy_prices, sell_prices = self._get_reservation_prices()
+        bids = (CENTS_IN_DOLLAR * buy_prices).astype(int) - PROFIT_MARGIN
+        asks = (CENTS_IN_DOLLAR * sell_prices).astype(int) + PROFIT_MARGIN
 
         # filter out orders from potential orders that can't be executed
         # due to not enough cash / units
-        self._remove_invalid_mm_orders()
+        valid_bids, valid_asks = self._valid_mm_orders(bids, asks)
 
-        # # send valid market maker orders in the market
-        if not self._waiting:
-            self._waiting = True
-            self._send_valid_mm_orders()
+        # key - (security index, side WE take, level), value - price in cents
+        self._mm_orders = {}
+        for index in range(len(self._registry)):
+            for level in range(self._quote_levels):
+                if valid_bids[index, level]:
+                    self._mm_orders[(index, OrderSide.BUY, level)] = \
+                        int(bids[index, level])
+                if valid_asks[index, level]:
+                    self._mm_orders[(index, OrderSide.SELL, level)] = \
+                        int(asks[index, level])
+
+        # send valid market maker orders in the markets that take them
+        self._send_valid_mm_orders()
+
+    def _get_reservation_prices(self):
+        """
+        Reservation price table for the current holdings, built on first use
+        after received_holdings changes units or cash
+        :return: (buy prices, sell prices) in dollars, one row per security
+                    and one column per unit 1..quote_levels
+        """
+        if self._reservation_prices is None:
+            self._reservation_prices = \
+                self._variance_engine.reservation_prices(self._risk_penalty,
+                                                         self._quote_levels)
+        return self._reservation_prices
 
     def _send_valid_mm_orders(self):
         """
-        Executes list of valid market maker orders
-        :return: List[Order] of valid orders
-        """
-        for key in self._mm_orders:
-
-            order = Order.create_new()
-            order.market = Market(self._market_ids[key[0]])
-            price_tick = order.market.price_tick
-
-            price = self._mm_orders[key] - \
-                          (self._mm_orders[key] % price_tick)
-
-            if price <= order.market.min_price:
-                price = order.market.min_price
-            elif price >= order.market.max_price:
-                price = order.market.max_price
-
-            order.price = price
-
-            order.order_side = key[-1]
-            order.order_type = OrderType.LIMIT
-            order.units = 1
-
-            if order.market.min_price <= order.price <= order.market.max_price:
-                self._order_id += 1
-                self._num_orders_sent += 1
-                self._num_active_mm_orders += 1
-                self.send_order(order)
-        return
-
-    def _remove_invalid_mm_orders(self):
-        """
-        Removes invalid market maker orders from list of potential orders
-        Records the price adjusted by the profit margin of the orders
+        Moves our resting orders onto the valid market maker orders, sending
+        only the cancels and new orders that differ
+        :return: number of new orders sent
         """
-        cash_avail = self._cash_available
-
-        # track invalid order keys
-        to_del = []
-
-        # set price for order = change in ($) performance * 100 cents
-        for key in self._mm_orders.keys():
-            self._mm_orders[key] = \
-                int(100*abs(self._current_performance - self._mm_orders[key]))
-
-            # if we need to create a buy order
-            if key[-1] == OrderSide.BUY:
-                self._mm_orders[key] -= PROFIT_MARGIN
-
-                # if have to spend more than available cash, delete that order
-                if self._mm_orders[key] > cash_avail:
-                    to_del.append(key)
-
-                # otherwise adjust cash available
-                else:
-                    cash_avail -= self._mm_orders[key]
+        quotes = {}
+        for (index, side, _), price in self._mm_orders.items():
+            market = self._registry.markets[index]
+            price -= price % market.price_tick
 
-            # if we need to create a sell order
-            else:
-                self._mm_orders[key] += PROFIT_MARGIN
+            if market.min_price <= price <= market.max_price:
+                key = (market, side, price)
+                quotes[key] = quotes.get(key, 0) + 1
 
-        for key in to_del:
-            del self._mm_orders[key]
+        return self._quotes.converge(quotes, self._send_order,
+                                     self._market_room())
 
-    def get_potential_performance(self, orders: List[Order]):
+    def _valid_mm_orders(self, bids, asks):
         """
-        Returns the portfolio performance if the given list of orders is
-        executed. The performance as per the following formula: Performance
-        = ExpectedPayoff - b * PayoffVariance, where b is the penalty for
-        risk.
-        :param orders      : list of orders to be simulated on portfolio
-        :return performance: percentage increase in portfolio performance
+        Checks every potential market maker order at once. Invalid are quotes
+        outside the market's price range, buys once the available cash is
+        spent, best levels first, and sells past the units left to sell
+        :param bids: buy prices in cents, one row per security and one column
+                     per level
+        :param asks: sell prices in cents, shaped like bids
+        :return    : boolean arrays of the valid bids and valid asks
         """
+        min_prices = self._registry.min_prices[:, np.newaxis]
+        max_prices = self._registry.max_prices[:, np.newaxis]
+        valid_bids = (min_prices <= bids) & (bids <= max_prices)
+        valid_asks = (min_prices <= asks) & (asks <= max_prices)
 
-        cash = self._cash_settled
-        units = self._asset_units.copy()
+        # cash spent by the bids up to each one, level by level
+        spent = np.cumsum(np.where(valid_bids, bids, 0).T).reshape(
+            bids.shape[::-1]).T
+        valid_bids &= spent <= self._ledger.cash_available
 
-        # simulate list of orders executing
-        for order in orders:
-            # for a buy order that exists in the market, we sell to it
-            if order.order_side == OrderSide.BUY:
-                cash += order.price
-                units[order.market.item] -= 1
-
-            # for a sell order, we buy from it
-            else:
-                cash -= order.price
-                units[order.market.item] += 1
-
-        x = list(units.values())
-
-        variance = self._get_portfolio_variance(x)
-
-        performance = self._portfolio_performance(
-            self._get_expected_return(x, cash),
-            self._risk_penalty,
-            variance)
-
-        return performance
+        # the sell at each level needs one more unit left to sell
+        levels = np.arange(asks.shape[1])
+        valid_asks &= levels < self._ledger.sellable[:, np.newaxis]
+        return valid_bids, valid_asks
 
     def _sell_notes(self):
         """
@@ -356,23 +431,23 @@ class CAPMBot(Agent):
         :return:
         """
         # stop if initialising OR if have enough cash
-        if len(self._asset_units.keys()) == 0 or \
-                self._cash_available > MIN_CASH_THRESHOLD:
+        if self._asset_units is None or \
+                self._ledger.cash_available > MIN_CASH_THRESHOLD:
             return
 
-        # find the note key
-        note_key = ""
-        for asset in self._asset_units:
-            if asset.lower() == "note":
-                note_key = asset
+        # the note is the security with a certain payoff
+        note_index = self._registry.risk_free_index
+        if note_index is None:
+            return
 
         # check if have notes available to short
-        if self._asset_units[note_key] > self._short_units_allowed[note_key]:
-            self.inform(f"Cash avail: {self._cash_available}")
-            self.inform(f"Selling notes+++++++++++++++++++++++++++")
+        market = self._registry.markets[note_index]
+        if self._ledger.sellable[note_index] > 0 and \
+                self._orders.can_send(market.fm_id):
+            self.inform("Cash avail: %s", self._ledger.cash_available)
+            self.inform("Selling notes+++++++++++++++++++++++++++")
 
             # create note sell orders for some price to obtain quick cash
-            market = Market(self._market_ids[note_key])
             price_tick = market.price_tick
             new_order = Order.create_new()
             new_order.price = NOTE_SELLING_PRICE - \
@@ -384,25 +459,27 @@ class CAPMBot(Agent):
 
             new_order.ref = "Order need_cash - SM"
 
-            self._waiting = True
             self._order_id += 1
-            self._num_orders_sent += 1
-            self.send_order(new_order)
+            self._send_order(new_order)
 
     def _cancel_my_orders(self):
         """
-        Cancels all of my orders in the market
+        Cancels all of my orders in the markets that take new orders, other
+        than those a cancel has already been sent for
         """
-        for _, order in Order.current().items():
+        self._quotes.converge({}, self._send_order, self._market_room())
 
-            # if I have an active order, cancel it UNLESS
-            if order.mine and not self._waiting:
-                self._waiting = True
-                cancel_order = copy.copy(order)
-                cancel_order.order_type = OrderType.CANCEL
-                cancel_order.ref = f"Cancel - {order.ref} - SM"
-                self.send_order(cancel_order)
-                self._waiting = False
+    def _market_room(self):
+        """
+        :return: dictionary of every market with room for more orders in
+                    flight to the number of orders it may still take
+        """
+        room = {}
+        for market in self._registry.markets:
+            free = self._orders.room(market.fm_id)
+            if free > 0:
+                room[market] = free
+        return room
 
     @staticmethod
     def _portfolio_performance(exp_return, risk_penalty, variance):
@@ -423,59 +500,41 @@ class CAPMBot(Agent):
         :param cash : available cash
         :return     : exp. return of portfolio based on diff. state payoffs
         """
-        x = list(self._payoffs.values())
+        return np.dot(self._variance_engine.expected_payoffs, units) + \
+            cash / CENTS_IN_DOLLAR
 
-        return (sum(np.dot(np.dot(1 / (len(x)),
-                                  units), x)) + cash) / CENTS_IN_DOLLAR
-
-    def _get_portfolio_variance(self, units):
+    def _get_order_ladders(self):
+        """
+        Collects every price level of other traders' orders in each market
+        :return: bid and ask ladders, per security a list of (price, units)
+                    with the best price first
         """
-        Calculates variance (scalar) of portfolio given units vector and stored
-        payoff values
+        bids = []
+        asks = []
 
-        Portfolio variance = W . Covar Matrix . Wt
-        Where W is vector of units, Wt is W transpose
+        for market in self._registry.markets:
+            market_id = market.fm_id
+            bids.append(self._order_book.ladder(market_id, OrderSide.BUY,
+                                                include_mine=False))
+            asks.append(self._order_book.ladder(market_id, OrderSide.SELL,
+                                                include_mine=False))
 
-        :param units: vector of weights of portfolio
-        :return     : scalar variance of the portfolio
-        """
-        weights = np.array(units)
-        covar_matrix = np.dot(1 / (CENTS_IN_DOLLAR ** 2),
-                              np.cov(list(self._payoffs.values()), bias=True))
-        return np.dot(np.dot(weights, covar_matrix),
-                      weights.transpose())
+        return bids, asks
 
-    @staticmethod
-    def _get_best_bid_ask():
+    def _get_best_bid_ask(self):
         """
-        Walks the order book and determines what the best bid and asks are
-        for each market
-        :return     : dictionaries of best bid and ask orders for each
-                        market
+        Looks up the best bid and ask for each market in the order book
+        :return     : lists of best bid and ask orders, one per security
+                        and None when that side of the book is empty
         """
-        VERY_HIGH_ASK = 999999
-        VERY_LOW_BID = -1
-
-        # track best bid_ask prices and orders
-        # key - market, value - [best price, best price order]
-        best_bids = {'a': [VERY_LOW_BID, None], 'b': [VERY_LOW_BID, None],
-                     'c': [VERY_LOW_BID, None], 'note': [VERY_LOW_BID, None]}
-        best_asks = {'a': [VERY_HIGH_ASK, None], 'b': [VERY_HIGH_ASK, None],
-                     'c': [VERY_HIGH_ASK, None], 'note': [VERY_HIGH_ASK, None]}
+        best_bids = []
+        best_asks = []
 
-        # track current best bids and asks
-        for order_id, order in Order.current().items():
-
-            dict_key = order.market.item.lower()
-
-            if order.order_side == OrderSide.BUY:
-                if order.price > best_bids[dict_key][0]:
-                    best_bids[dict_key][0] = order.price
-                    best_bids[dict_key][1] = order
-            else:
-                if order.price < best_asks[dict_key][0]:
-                    best_asks[dict_key][0] = order.price
-                    best_asks[dict_key][1] = order
+        for market in self._registry.markets:
+            best_bids.append(self._order_book.best_bid(market.fm_id,
+                                                       include_mine=False))
+            best_asks.append(self._order_book.best_ask(market.fm_id,
+                                                       include_mine=False))
 
         return best_bids, best_asks
 
@@ -483,188 +542,219 @@ class CAPMBot(Agent):
         """
         REACTIVE STRATEGY
         =================
-        Generates combinations of profitable orders currently in the order book
-        Called every 3 seconds periodically
+        Evaluates every set of the best bids and asks currently in the order
+        book (at most one order per market) in one batch
+        Called every second periodically
         sets reactive_orders attribute to a list of orders to be executed
 
         :return: Returns True if portfolio is currently optimal & no reactive
                     orders were executed
         """
 
-        portfolio_currently_optimal = True
-
-        # do nothing if sending through orders
-        if self._waiting:
-            return
-
-        bids, asks = self._get_best_bid_ask()
-
-        # filter out when there is NO order in the bid side / ask side
-        bids = [x[1] for x in list(bids.values()) if x[1] is not None]
-        asks = [x[1] for x in list(asks.values()) if x[1] is not None]
-
-        orders = bids + asks
-
-        # initially no valid orders
-        self._reactive_orders = None
-
-        # generate combinations of possible orders to be executed
-        # when first order that is good enough is found, stop looking
-        for i in range(1, len(orders) + 1):
-
-            combs = list(itertools.combinations(orders, i))
-            new_set = filter(self._duplicates_in_list, combs)
-
-            if not self.is_portfolio_optimal(new_set):
-                portfolio_currently_optimal = False
-                break
-
-        # if there are profitable orders, send them through
-        if not portfolio_currently_optimal and not self._waiting:
-            self._waiting = True
-            self._send_orders(self._reactive_orders)
-            self._num_orders_sent += len(self._reactive_orders)
+        if self._depth_aware:
+            self._reactive_orders = self._find_profitable_fills()
+        else:
+            self._reactive_orders = self._find_profitable_top_of_book()
+
+        portfolio_currently_optimal = self._reactive_orders is None
+
+        # if there are profitable orders, send them through once every
+        # market they trade in takes new orders, they were chosen together.
+        # Each market gets one order
+        if not portfolio_currently_optimal:
+            if all(self._orders.can_send(
+                    self._registry.markets[fill.index].fm_id)
+                   for fill in self._reactive_orders):
+                self._send_fills(self._reactive_orders)
             self._reactive_orders = None
 
         return portfolio_currently_optimal
 
-    def is_portfolio_optimal(self, new_set):
-        """
-        Returns true if the current holdings are optimal (as per the
-        performance formula), false otherwise.
-        :new_set: a set of orders to be tested
-
-        :return: Returns true if given set(orders) will not improve performance
-        """
-        # for each order in this set, test if profitable
-        for order_set in new_set:
-
-            if self._is_bot_reactive():
-                list_orders = list(order_set)
-            else:
-                list_orders = [order_set]
-
-            # self.inform(f"Order set: {list_orders}")
-            # check if have enough cash/units for order_set
-            if self.check_if_enough_assets(list_orders):
-
-                # check if performance of order_set > current performance
-                performance = self.get_potential_performance(list_orders)
-
-                # market maker bot
-                if self._is_bot_mm():
-
-                    # change order side to the action WE will be taking
-                    if list_orders[0].order_side == OrderSide.BUY:
-                        os = OrderSide.SELL
-                    else:
-                        os = OrderSide.BUY
-
-                    key = (list_orders[0].market.item,
-                           os)
-                    self._mm_orders[key] = performance
-
-                # reactive bot
-                else:
-                    if performance > self._aggressiveness_param * \
-                            self._current_performance:
+    def _find_profitable_fills(self):
+        """
+        Searches the whole order book ladder of every market for the
+        multi-unit trades that maximise performance, within a fixed time
+        budget so it can run on every book update
+        :return: list of Fill to trade, None if performance can't be
+                    improved enough
+        """
+        bids, asks = self._get_order_ladders()
+        return self._optimise_fills(bids, asks)
+
+    def _optimise_fills(self, bids, asks):
+        """
+        Runs the optimiser over the given price levels
+        :param bids: per security, list of (price, units), best first
+        :param asks: per security, list of (price, units), best first
+        :return    : list of Fill to trade, None if performance can't be
+                        improved enough
+        """
+        # units reserved for sells lower how far each security can go short
+        fills, gain = optimise_fills(
+            self._variance_engine, bids, asks, self._ledger.cash_available,
+            self._ledger.sellable, self._risk_penalty, OPTIMISER_TIME_BUDGET)
+
+        if not fills or self._current_performance + gain <= \
+                self._aggressiveness_param * self._current_performance:
+            return None
+        return fills
+
+    def _find_profitable_top_of_book(self):
+        """
+        Looks for the best set of 1 unit trades at the best bid and ask of
+        each market
+        :return: list of Fill to trade, None if performance can't be
+                    improved enough
+        """
+        bid_orders, ask_orders = self._get_best_bid_ask()
+
+        # too many securities to enumerate every order set, let the
+        # optimiser search one unit at each best price instead
+        if self._order_set_choices is None:
+            bids = [[(order.price, 1)] if order is not None else []
+                    for order in bid_orders]
+            asks = [[(order.price, 1)] if order is not None else []
+                    for order in ask_orders]
+            return self._optimise_fills(bids, asks)
+
+        order_set = self._find_profitable_order_set(bid_orders, ask_orders)
+        if order_set is None:
+            return None
+
+        return [Fill(self._registry.index(order.market),
+                     SELL_TO_BID if order.order_side == OrderSide.BUY
+                     else BUY_FROM_ASK,
+                     order.price, 1)
+                for order in order_set]
+
+    def _find_profitable_order_set(self, bid_orders, ask_orders):
+        """
+        Batch evaluates every order set, each encoded as a row of unit deltas
+        and a cash delta, with one set of numpy operations
+        Sets with the fewest orders are preferred, and among those the one
+        with the best performance is picked
+
+        :param bid_orders: best bid order per security, or None
+        :param ask_orders: best ask order per security, or None
+        :return          : list of orders in the market to trade with, None
+                            if no set improves performance enough
+        """
+        has_bid = np.array([order is not None for order in bid_orders])
+        has_ask = np.array([order is not None for order in ask_orders])
+        bid_prices = np.array([order.price if order is not None else 0
+                               for order in bid_orders])
+        ask_prices = np.array([order.price if order is not None else 0
+                               for order in ask_orders])
+
+        # only sets that use sides of the book which have an order
+        choices = self._order_set_choices
+        in_book = np.all((choices != SELL_TO_BID) | has_bid, axis=1) & \
+            np.all((choices != BUY_FROM_ASK) | has_ask, axis=1)
+
+        choices = choices[in_book]
+        deltas = self._order_set_deltas[in_book]
+        sizes = self._order_set_sizes[in_book]
+        sells = deltas < 0
+        buys = deltas > 0
+
+        # whether the ledger has the cash and units of every set
+        to_spend = buys.dot(ask_prices)
+        at_short_limit = self._ledger.sellable <= 0
+        enough_assets = (to_spend <= self._ledger.cash_available) & \
+            ~np.any(sells & at_short_limit, axis=1)
+
+        # performance after trading every set
+        cash_deltas = sells.dot(bid_prices) - to_spend
+        exp_returns = self._current_exp_return + \
+            deltas.dot(self._variance_engine.expected_payoffs) + \
+            cash_deltas / CENTS_IN_DOLLAR
+        performances = self._portfolio_performance(
+            exp_returns,
+            self._risk_penalty,
+            self._variance_engine.trade_variances(deltas))
 
-                        # when the first profitable order set found, stop
-                        self._reactive_orders = list_orders
+        profitable = enough_assets & (
+            performances > self._aggressiveness_param *
+            self._current_performance)
+        if not profitable.any():
+            return None
 
-                        return False
+        fewest_orders = np.flatnonzero(
+            profitable & (sizes == sizes[profitable].min()))
+        best = fewest_orders[np.argmax(performances[fewest_orders])]
 
-        return True
+        return [bid_orders[i] if choice == SELL_TO_BID else ask_orders[i]
+                for i, choice in enumerate(choices[best]) if choice]
 
-    def check_if_enough_assets(self, orders: List[Order]):
+    def _send_fills(self, fills):
         """
-        Received orders are the orders in the market! so for a buy order,
-        we sell to it, and for a sell order, we buy from it
-        :param orders: Order set received
-        :return      : True if there are enough assets to execute each order
-                        in the order set received
+        Creates the orders that trade against the given fills of the
+        order book, one per market so the batch takes one place in flight in
+        each. The order of a fill across several levels is priced at the last
+        one, and trades through the better ones first at their own prices
+        :param fills: list of Fill, favourable trades with the order book,
+                      best level first
         """
-        to_spend = 0
 
-        # orders are the PRESENT orders in the market
-        for order in orders:
+        if not self.is_session_active():
+            return
 
-            if order.order_side == OrderSide.SELL:
-                to_spend += order.price
+        # REACTIVE ORDERS, by security index
+        orders = {}
+        for fill in fills:
 
-            else:
+            market = self._registry.markets[fill.index]
+            price_tick = market.price_tick
 
-                # if reached the shorting quota, then invalid order set
-                if self._asset_units[order.market.item] == \
-                        self._short_units_allowed[order.market.item]:
-                    return False
+            new_order = orders.get(fill.index)
+            if new_order is None:
+                new_order = Order.create_new()
+                new_order.market = market
+                new_order.units = 0
 
-        # if not enough cash to buy, then invalid order set
-        if to_spend > self._cash_available:
-            return False
+                if fill.side == SELL_TO_BID:
+                    new_order.order_side = OrderSide.SELL
+                else:
+                    new_order.order_side = OrderSide.BUY
 
-        return True
+                new_order.order_type = OrderType.LIMIT
+                orders[fill.index] = new_order
 
-    def _send_orders(self, orders):
-        """
-        Creates *corresponding* orders to the list of orders received
-        :param orders: list of favourable orders
-        """
+            new_order.price = fill.price - (fill.price % price_tick)
+            new_order.units += fill.units
 
-        if not self.is_session_active():
+        # don't send invalid orders, kill switch for edge cases
+        if not self._ledger.fits(
+                list(orders),
+                [order.order_side == OrderSide.BUY
+                 for order in orders.values()],
+                [order.price for order in orders.values()],
+                [order.units for order in orders.values()]):
             return
 
-        # REACTIVE ORDERS
-        for order in orders:
-
-            price_tick = order.market.price_tick
-
-            new_order = Order.create_new()
-            new_order.price = order.price - (order.price % price_tick)
-            new_order.market = order.market
-            new_order.units = 1
-
-            if order.order_side == OrderSide.BUY:
-                new_order.order_side = OrderSide.SELL
-            else:
-                new_order.order_side = OrderSide.BUY
-
-                # don't send invalid orders, kill switch for edge cases
-                if new_order.price > self._cash_available:
-                    return
-
-            new_order.order_type = OrderType.LIMIT
+        for new_order in orders.values():
             new_order.ref = f"Order {self._order_id} - SM"
             self._order_id += 1
-            self.send_order(new_order)
+            self._send_order(new_order)
 
-    @staticmethod
-    def _duplicates_in_list(list_of_orders):
+    def _send_order(self, order):
         """
-        Receives a list of orders and determines if those orders exist in the
-        same market
-        :param list_of_orders: list of 8 best bid and asks from the 4 markets
-        :return              : True if orders list contains order in the same
-                                market.
+        Sends an order, following it in the order manager and timing it from
+        here to its acknowledgement
+        :param order: order to send
         """
-        list_of_orders = [x.market for x in list_of_orders]
-
-        return len(set(list_of_orders)) == len(list_of_orders)
+        self._orders.sent(order)
+        self._latency.sent(order.ref)
+        self.send_order(order)
 
     def order_accepted(self, order):
         """
         If sent order accepted by server, inform user of the reason and order
-        Tracks number of orders sent to server not yet accepted/rejected
         :param order: The accepted order
         :return:
         """
-        # make sure that all orders are accepted, till then keep
-        # waiting for server
-        if not order.order_type == OrderType.CANCEL:
-            self._num_orders_sent -= 1
-
-        if self._num_orders_sent == 0:
-            self._waiting = False
+        self._latency.acknowledged(order.ref)
+        self._orders.accepted(order)
 
     def order_rejected(self, info, order):
         """
@@ -672,10 +762,113 @@ class CAPMBot(Agent):
         :param info: Info object sent by FM regarding rejection reason
         :param order: The rejected order
         """
-        pass
+        self._latency.acknowledged(order.ref, accepted=False)
+        self._orders.rejected(order)
+        self._quotes.rejected(order)
+
+    def _order_timed_out(self, managed):
+        """
+        An order wasn't acknowledged in time, its market takes orders again
+        and a quote it was for is sent again if still wanted
+        :param managed: ManagedOrder of the order
+        """
+        self.warning("Order timed out: %s", managed)
+        self._quotes.released(managed.ref)
+
+    def _on_orders_update(self, order_json):
+        # the moment an update is delivered, before fmclient parses it
+        self._latency.tick()
+        super()._on_orders_update(order_json)
 
     def received_orders(self, orders: List[Order]):
-        pass
+        """
+        Keeps the order book index up to date with the received order deltas
+        and ends the market maker dwell early if one of our quotes traded.
+        When event driven, a new best price set by another trader or a hit
+        quote triggers a strategy pass
+        :param orders: list of order objects (updates)
+        """
+        # our own quotes and cancels moving the best price aren't events
+        markets = {order.market.fm_id for order in orders if not order.mine}
+        best_before = {market_id: self._best_prices(market_id)
+                       for market_id in markets}
+
+        self._order_book.update(orders)
+        self._quotes.update(orders)
+        self._orders.update(orders)
+
+        # our fills count now, not when the holdings arrive
+        fills = [order for order in orders if order.mine and order.has_traded]
+        for order in fills:
+            self._apply_fill(order)
+
+        # a market maker quote was hit, no need to wait out the dwell
+        quote_hit = bool(fills)
+        if self._mm_dwell is not None and quote_hit:
+            self._mm_dwell.cancel()
+            self._mm_dwell = self._loop.call_soon(self._end_mm_dwell)
+
+        if self._event_driven and (quote_hit or any(
+                self._best_prices(market_id) != best_before[market_id]
+                for market_id in markets)):
+            self._trigger_strategy_pass()
+
+    def _apply_fill(self, order):
+        """
+        Moves the shadow portfolio, and the performance numbers with it, by
+        one of our orders that traded
+        :param order: our consumed order, priced at what it traded at
+        """
+        index = self._registry.index(order.market)
+        if index is None or self._asset_units is None:
+            return
+
+        units = order.units if order.order_side == OrderSide.BUY \
+            else -order.units
+        if not self._shadow.apply_fill(order.fm_id, index, units,
+                                       order.price):
+            return
+        self._reservation_prices = None
+        self._refresh_performance()
+
+    def _best_prices(self, market_id):
+        """
+        :return: best bid and best ask price of a market, None if no order
+        """
+        best_bid = self._order_book.best_bid(market_id)
+        best_ask = self._order_book.best_ask(market_id)
+        return (best_bid and best_bid.price), (best_ask and best_ask.price)
+
+    def _trigger_strategy_pass(self):
+        """
+        Schedules an event driven strategy pass. It runs straight away unless
+        a pass ran within the debounce window, in which case it runs at the
+        end of the window; triggers while one is pending are coalesced
+        """
+        if self._pending_pass is not None:
+            return
+
+        delay = max(0.0, self._last_pass_time + self._debounce -
+                    self._loop.time())
+        self._pending_pass = self._loop.call_later(delay,
+                                                   self._event_strategy_pass)
+
+    def _event_strategy_pass(self):
+        """
+        Runs a strategy cycle in response to a market event, cutting any
+        market maker dwell short as the quotes may now be stale
+        """
+        self._pending_pass = None
+        self._last_pass_time = self._loop.time()
+
+        if self._current_performance == 0:
+            return
+
+        if self._mm_dwell is not None:
+            self._mm_dwell.cancel()
+            self._mm_dwell = None
+
+        self._safely_call_method(self._run_strategy_cycle)
 
     def received_session_info(self, session: Session):
         """
@@ -683,47 +876,48 @@ class CAPMBot(Agent):
         :param session: Session object sent by FlexeMarkets
         :return:
         """
+        if self._quotes.messages_sent:
+            self.inform("Quote messages sent: %d, saved: %d",
+                        self._quotes.messages_sent,
+                        self._quotes.messages_saved)
+        for line in self._latency.report():
+            self.inform("Latency: %s", line)
+        if self._orders.summary():
+            self.inform("Orders: %s", self._orders.summary())
+        if self._shadow is not None and self._shadow.num_fills:
+            self.inform("Shadow portfolio: %s", self._shadow.summary())
+
         # at every session update, reset valid instance vars
+        self._order_book.reset(Order.current().values())
+        self._quotes.reset()
+        self._latency.reset()
+        self._orders.reset()
         self._reactive_orders = None
-        self._waiting = False
         self._order_id = 0
-        self._num_orders_sent = 0
 
         self._mm_orders = {}
-        self._num_active_mm_orders = 0
+        if self._mm_dwell is not None:
+            self._mm_dwell.cancel()
+            self._mm_dwell = None
+        if self._pending_pass is not None:
+            self._pending_pass.cancel()
+            self._pending_pass = None
 
     def pre_start_tasks(self):
         pass
 
-    def received_holdings(self, holdings):
+    def _refresh_performance(self):
         """
-        Called when holdings update
-        Tracks current bot's expected payoff, variance and current
-        performance
-        :param holdings: Holdings object sent by FlexeMarkets
+        Tracks variance, expected return and performance of the shadow
+        portfolio
         """
-        # have to assume here that assets are arranged here in the same
-        # order as the order in which payoffs were received
-        self._cash_available = holdings.cash_available
-        self._cash_settled = holdings.cash
-
-        self._asset_units = {}
-        for market in holdings.assets:
-            key = market.item
-            self._asset_units[key] = holdings.assets[market].units
-            self._short_units_allowed[key] = \
-                -1 * holdings.assets[market].units_granted_short
-
-        # update portfolio variance - don't need to update everytime
-        # but doing it in case "new info" arrives
-        self._current_port_variance = self._get_portfolio_variance(
-            list(self._asset_units.values()))
+        self._cash_settled = self._shadow.cash
+        self._current_port_variance = self._variance_engine.variance
 
         # update portfolio return
         # return is based on SETTLED cash, and not on cash available
-        self._current_exp_return = \
-            self._get_expected_return(list(self._asset_units.values()),
-                                      self._cash_settled)
+        self._current_exp_return = self._get_expected_return(
+            self._variance_engine.units, self._cash_settled)
 
         # update current performance
         self._current_performance = self._portfolio_performance(
@@ -731,6 +925,45 @@ class CAPMBot(Agent):
             self._risk_penalty,
             self._current_port_variance)
 
+    def received_holdings(self, holdings):
+        """
+        Called when holdings update
+        Reconciles the shadow portfolio with the holdings, and tracks current
+        bot's expected payoff, variance and current performance. When event
+        driven, a change in units or settled cash that our fills didn't
+        already account for (i.e. not just cash reserved for orders)
+        triggers a strategy pass
+        :param holdings: Holdings object sent by FlexeMarkets
+        """
+        # units are ordered the same as the payoff table rows, and trades
+        # are evaluated as a change from these holdings
+        units = np.zeros(len(self._registry))
+        for market, asset in holdings.assets.items():
+            index = self._registry.index(market)
+            if index is None:
+                continue
+            units[index] = asset.units
+
+        first = self._asset_units is None
+        num_drifted = self._shadow.num_drifted
+        unit_move, cash_move = self._shadow.reconcile(units, holdings.cash)
+        holdings_changed = first or cash_move != 0 or np.any(unit_move)
+        if self._shadow.num_drifted > num_drifted:
+            unit_drift, cash_drift = self._shadow.last_drift
+            self.inform("Holdings drifted from shadow portfolio: units %s, "
+                        "cash %s", unit_drift.astype(int).tolist(),
+                        cash_drift, category="drift")
+
+        self._ledger.update_holdings(holdings)
+        self._asset_units = units
+
+        if holdings_changed:
+            self._reservation_prices = None
+        self._refresh_performance()
+
+        if self._event_driven and holdings_changed:
+            self._trigger_strategy_pass()
+
 
 if __name__ == "__main__":
     FM_ACCOUNT = "ardent-founder"
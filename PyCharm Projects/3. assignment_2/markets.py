@@ -0,0 +1,106 @@
+"""
+Registry of the securities traded by the CAPM bot
+
+Built once from the marketplace's markets and their payoff descriptions, it
+gives every security a dense integer index so holdings, the order book and
+the payoff table can all be numpy arrays lined up on the same rows, for any
+number of securities and whatever the items are called.
+"""
+import numpy as np
+
+
+class MarketRegistry:
+
+    def __init__(self, markets):
+        """
+        :param markets: dictionary of market id to Market, e.g. Agent.markets
+        """
+        self._markets = []
+        self._index_by_id = {}
+        payoffs = []
+
+        # a market is a security if its description is its payoff per state
+        for market_id in sorted(markets):
+            market = markets[market_id]
+            payoff = self._parse_payoffs(market)
+            if payoff is None:
+                continue
+
+            self._index_by_id[market_id] = len(self._markets)
+            self._markets.append(market)
+            payoffs.append(payoff)
+
+        self._payoffs = np.array(payoffs, dtype=float)
+        self._min_prices = np.array([market.min_price
+                                     for market in self._markets], dtype=int)
+        self._max_prices = np.array([market.max_price
+                                     for market in self._markets], dtype=int)
+
+        # the risk free security (the note) pays the same in every state
+        self._risk_free_index = None
+        for index, payoff in enumerate(self._payoffs):
+            if len(payoff) and np.all(payoff == payoff[0]):
+                self._risk_free_index = index
+                break
+
+    @staticmethod
+    def _parse_payoffs(market):
+        """
+        :return: list of payoffs per state, None if the market isn't a
+                    security with a payoff description
+        """
+        if market.private_market:
+            return None
+        try:
+            return [int(a) for a in market.description.split(",")]
+        except (AttributeError, ValueError):
+            return None
+
+    def __len__(self):
+        return len(self._markets)
+
+    def __str__(self):
+        return ", ".join(f"{i}:{market.item}(M-{market.fm_id})"
+                         for i, market in enumerate(self._markets))
+
+    @property
+    def markets(self):
+        """
+        :return: list of Market, position is the security's index
+        """
+        return self._markets
+
+    @property
+    def payoffs(self):
+        """
+        :return: 2D array of payoffs in cents, one row per security
+        """
+        return self._payoffs
+
+    @property
+    def min_prices(self):
+        """
+        :return: array of the lowest price in cents of each security
+        """
+        return self._min_prices
+
+    @property
+    def max_prices(self):
+        """
+        :return: array of the highest price in cents of each security
+        """
+        return self._max_prices
+
+    @property
+    def risk_free_index(self):
+        """
+        :return: index of the security with a certain payoff, or None
+        """
+        return self._risk_free_index
+
+    def index(self, market):
+        """
+        :param market: Market of a security
+        :return      : index of the security, None if it isn't one
+        """
+        return self._index_by_id.get(market.fm_id)
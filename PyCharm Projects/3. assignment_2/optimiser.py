@@ -0,0 +1,184 @@
+"""
+Depth aware, multi-unit order set optimiser for the CAPM bot
+
+Performance = mu . (x + d) + cash / 100 - b * Var(x + d) is quadratic in the
+change in units d, and the cash paid walking up an ask ladder (or received
+walking down a bid ladder) is piecewise linear. So the change in performance
+of trading one more unit, or one more unit in each of two securities, only
+needs the cached C . x, the running C . d and the next price on the ladder.
+
+The optimiser climbs greedily one unit (or one pair of units) at a time while
+performance improves, and stops early when its time budget runs out.
+"""
+import time
+from typing import List, NamedTuple
+
+import numpy as np
+
+from portfolio import SELL_TO_BID, BUY_FROM_ASK
+
+CENTS_IN_DOLLAR = 100
+
+
+class Fill(NamedTuple):
+    index: int
+    side: int
+    price: int
+    units: int
+
+
+class _Ladder:
+
+    def __init__(self, bids, asks, max_buys, max_sells):
+        """
+        Per unit prices of one security's book, capped at the number of
+        units that could ever be traded
+        :param bids     : list of (price, units) levels, best first
+        :param asks     : list of (price, units) levels, best first
+        :param max_buys : most units that could be bought
+        :param max_sells: most units that could be sold
+        """
+        self.bids = self._unit_prices(bids, max_sells)
+        self.asks = self._unit_prices(asks, max_buys)
+
+    @staticmethod
+    def _unit_prices(levels, cap):
+        prices = []
+        for price, units in levels:
+            if len(prices) >= cap:
+                break
+            prices += [price] * min(units, cap - len(prices))
+        return prices
+
+
+def optimise_fills(engine, bids, asks, cash_available, sellable,
+                   risk_penalty, time_budget):
+    """
+    Finds the units to trade in each security against the current book that
+    maximise performance, within cash and shorting limits
+    :param engine        : VarianceEngine holding the current units
+    :param bids          : per security, list of (price, units), best first
+    :param asks          : per security, list of (price, units), best first
+    :param cash_available: cash that can be spent on buys
+    :param sellable      : per security, the units that may still be sold,
+                           short selling included
+    :param risk_penalty  : penalty for risk
+    :param time_budget   : seconds the search may run for
+    :return              : (list of Fill, change in performance)
+    """
+    deadline = time.perf_counter() + time_budget
+
+    units = engine.units
+    num_securities = len(units)
+    covar = engine.covar_matrix
+    covar_diag = np.diag(covar)
+    expected = engine.expected_payoffs
+
+    cheapest_ask = min([levels[0][0] for levels in asks if levels] or [1])
+    max_buys = int(cash_available // max(cheapest_ask, 1))
+    ladders = [_Ladder(bids[i], asks[i], max_buys,
+                       max(int(sellable[i]), 0))
+               for i in range(num_securities)]
+
+    delta = np.zeros(num_securities, dtype=int)
+    covar_delta = np.zeros(num_securities)
+    spent = 0
+    gain = 0.0
+
+    # cash flow of one more (+1) or one less (-1) unit in each security, and
+    # the cash available it uses up; nan where the move is not possible
+    buy_cash = np.full(num_securities, np.nan)
+    buy_spend = np.zeros(num_securities)
+    sell_cash = np.full(num_securities, np.nan)
+    sell_spend = np.zeros(num_securities)
+
+    def update_moves(i):
+        d = delta[i]
+        ladder = ladders[i]
+
+        # +1 either buys from the next ask or undoes the last sell
+        if d >= 0:
+            price = ladder.asks[d] if d < len(ladder.asks) else np.nan
+            buy_cash[i], buy_spend[i] = -price, price
+        else:
+            buy_cash[i], buy_spend[i] = -ladder.bids[-d - 1], 0
+
+        # -1 either sells to the next bid or undoes the last buy
+        if d <= 0:
+            sell_cash[i] = ladder.bids[-d] if -d < len(ladder.bids) \
+                else np.nan
+            sell_spend[i] = 0
+        else:
+            price = ladder.asks[d - 1]
+            sell_cash[i], sell_spend[i] = price, -price
+
+    for i in range(num_securities):
+        update_moves(i)
+
+    move_index = np.concatenate([np.arange(num_securities)] * 2)
+    move_sign = np.concatenate([np.ones(num_securities),
+                                -np.ones(num_securities)])
+    pair_covar = move_sign[:, None] * move_sign[None, :] * \
+        covar[np.ix_(move_index, move_index)]
+    same_security = move_index[:, None] == move_index[None, :]
+
+    while time.perf_counter() < deadline:
+        covar_units = engine.covar_units + covar_delta
+
+        # change in performance of each single unit move
+        move_cash = np.concatenate([buy_cash, sell_cash])
+        move_spend = np.concatenate([buy_spend, sell_spend])
+        move_gain = move_sign * expected[move_index] + \
+            move_cash / CENTS_IN_DOLLAR - risk_penalty * (
+                2 * move_sign * covar_units[move_index] +
+                covar_diag[move_index])
+        move_gain[np.isnan(move_gain) |
+                  (spent + move_spend > cash_available)] = -np.inf
+
+        best = int(np.argmax(move_gain))
+        moves = [best]
+        step_gain = move_gain[best]
+
+        # no single unit helps, a pair may (e.g. swapping correlated units)
+        if step_gain <= 0:
+            pair_gain = move_gain[:, None] + move_gain[None, :] - \
+                2 * risk_penalty * pair_covar
+            pair_gain[same_security |
+                      (spent + move_spend[:, None] + move_spend[None, :] >
+                       cash_available)] = -np.inf
+            best = int(np.argmax(pair_gain))
+            moves = list(divmod(best, len(move_gain)))
+            step_gain = pair_gain[moves[0], moves[1]]
+
+        if not step_gain > 0:
+            break
+
+        for move in moves:
+            i = move_index[move]
+            sign = int(move_sign[move])
+            spent += move_spend[move]
+            delta[i] += sign
+            covar_delta += sign * covar[:, i]
+            update_moves(i)
+        gain += step_gain
+
+    return _to_fills(delta, bids, asks), gain
+
+
+def _to_fills(delta, bids, asks) -> List[Fill]:
+    """
+    Splits the change in units of each security across the book levels it
+    trades with
+    """
+    fills = []
+    for i, d in enumerate(delta):
+        side, levels = (BUY_FROM_ASK, asks[i]) if d > 0 else \
+            (SELL_TO_BID, bids[i])
+        remaining = abs(int(d))
+        for price, units in levels:
+            if remaining == 0:
+                break
+            traded = min(units, remaining)
+            fills.append(Fill(i, side, price, traded))
+            remaining -= traded
+    return fills
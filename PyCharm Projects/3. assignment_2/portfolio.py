@@ -0,0 +1,328 @@
+"""
+Portfolio maths shared by the CAPM bot
+
+The payoff table and its covariance matrix never change during a session, so
+they are built once and the variance of a potential trade is found as a
+change from the current holdings instead of a full quadratic form.
+"""
+import numpy as np
+
+# order set choices for each security
+NO_TRADE = 0
+SELL_TO_BID = 1
+BUY_FROM_ASK = 2
+
+
+class VarianceEngine:
+
+    def __init__(self, payoffs):
+        """
+        Caches the payoff table, expected payoffs and covariance matrix
+        :param payoffs: 2D array, one row of state payoffs per security
+        """
+        self._payoffs = np.asarray(payoffs, dtype=float)
+        self._expected_payoffs = self._payoffs.mean(axis=1)
+        self._covar_matrix = np.atleast_2d(np.cov(self._payoffs, bias=True))
+
+        # current holdings and the cached product covar matrix . holdings
+        self._units = np.zeros(len(self._payoffs))
+        self._covar_units = np.zeros(len(self._payoffs))
+        self._variance = 0.0
+
+    @property
+    def expected_payoffs(self):
+        return self._expected_payoffs
+
+    @property
+    def covar_matrix(self):
+        return self._covar_matrix
+
+    @property
+    def covar_units(self):
+        """
+        :return: covar matrix . current holdings
+        """
+        return self._covar_units
+
+    @property
+    def units(self):
+        return self._units
+
+    @property
+    def variance(self):
+        """
+        :return: variance of the current holdings
+        """
+        return self._variance
+
+    def set_holdings(self, units):
+        """
+        Stores the current holdings, called whenever holdings update
+        :param units: vector of units held, one per security
+        """
+        self._units = np.asarray(units, dtype=float)
+        self._covar_units = self._covar_matrix.dot(self._units)
+        self._variance = float(self._units.dot(self._covar_units))
+
+    def apply_trade(self, index, units):
+        """
+        Moves the current holdings by a trade in a single security, updating
+        C . x with one column of the covar matrix instead of a full product
+        :param index: row of the security in the payoff table
+        :param units: signed units traded, positive for a buy
+        """
+        self._variance = self.unit_trade_variance(index, units)
+        self._covar_units = self._covar_units + \
+            units * self._covar_matrix[:, index]
+        self._units = self._units.copy()
+        self._units[index] += units
+
+    def portfolio_variance(self, units):
+        """
+        Full quadratic form W . Covar Matrix . Wt for any vector of units
+        :param units: vector of units in some portfolio
+        :return     : scalar variance of that portfolio
+        """
+        weights = np.asarray(units, dtype=float)
+        return float(weights.dot(self._covar_matrix).dot(weights))
+
+    def trade_variance(self, delta):
+        """
+        Variance of the current holdings after a trade, as a delta:
+            Var(x + d) = Var(x) + 2 d . C . x + d . C . d
+        C . x is cached, so this is one matrix-vector and one dot product
+        :param delta: vector of change in units, one per security
+        :return     : scalar variance after the trade
+        """
+        delta = np.asarray(delta, dtype=float)
+        return self._variance + float(
+            delta.dot(2 * self._covar_units + self._covar_matrix.dot(delta)))
+
+    def trade_variances(self, deltas):
+        """
+        Batch version of trade_variance
+        :param deltas: 2D array, one row of change in units per trade
+        :return      : vector of variances after each trade
+        """
+        return self._variance + deltas.dot(2 * self._covar_units) + \
+            np.einsum("ij,ij->i", deltas.dot(self._covar_matrix), deltas)
+
+    def unit_trade_variance(self, index, units=1):
+        """
+        Variance after trading in a single security, a few scalar operations
+        :param index: row of the security in the payoff table
+        :param units: signed units traded, positive for a buy
+        :return     : scalar variance after the trade
+        """
+        return self._variance + \
+            2 * units * self._covar_units[index] + \
+            units * units * self._covar_matrix[index, index]
+
+    def reservation_prices(self, risk_penalty, max_units):
+        """
+        Marginal value of each of the next units bought or sold in each
+        security on its own, i.e. the most worth paying for the k-th unit
+        bought and the least worth accepting for the k-th unit sold:
+            buy  = mu - b * (2 (C . x) + (2k - 1) C_ii)
+            sell = mu - b * (2 (C . x) - (2k - 1) C_ii)
+        :param risk_penalty: penalty for risk
+        :param max_units   : number of units k = 1..max_units to price
+        :return            : (buy prices, sell prices), 2D arrays with one
+                                row per security and one column per unit
+        """
+        steps = 2 * np.arange(1, max_units + 1) - 1
+        base = self._expected_payoffs - 2 * risk_penalty * self._covar_units
+        spread = risk_penalty * np.outer(np.diag(self._covar_matrix), steps)
+        return base[:, None] - spread, base[:, None] + spread
+
+
+class ShadowPortfolio:
+    """
+    Units and settled cash of the CAPM bot, moved by its own fills as soon as
+    they are echoed instead of when received_holdings next arrives
+
+    The holdings stay the authority. Fills applied since the last holdings
+    are kept in order, by the fm_id of the consumed order so an echo sent
+    again is only applied once, and new holdings are matched against the
+    last holdings plus the first k of them, for the largest k that fits:
+    those fills are in the holdings, the rest are applied on top.
+
+    Holdings can also arrive before the echoes of the trades they show.
+    Holdings that match no k replace the shadow as they are, and what they
+    show beyond every fill applied is taken to be trades still to be echoed:
+    those echoes are not applied again. Whatever of it no echo has explained
+    by the time the holdings change again drifted.
+    """
+
+    def __init__(self, engine):
+        """
+        :param engine: VarianceEngine whose holdings are the shadow's units
+        """
+        self._engine = engine
+        self._cash = 0
+
+        # last holdings, and fm_id -> (index, units, price) of each fill since
+        self._holdings_units = None
+        self._holdings_cash = 0
+        self._pending = {}
+        self._fill_ids = set()
+
+        # units and cash of trades the holdings showed before their echoes
+        self._ahead_units = None
+        self._ahead_cash = 0
+
+        self.num_fills = 0
+        self.num_reconciled = 0
+        self.num_drifted = 0
+        self.max_drift = 0
+        self.last_drift = None
+
+    @property
+    def units(self):
+        """
+        :return: vector of units, one per security, None before holdings
+        """
+        if self._holdings_units is None:
+            return None
+        return self._engine.units
+
+    @property
+    def cash(self):
+        """
+        :return: settled cash in cents
+        """
+        return self._cash
+
+    def apply_fill(self, fill_id, index, units, price):
+        """
+        :param fill_id: fm_id of the consumed order, a fill is applied once
+        :param index  : row of the security in the payoff table
+        :param units  : signed units traded, positive for a buy
+        :param price  : price in cents the units traded at
+        :return       : True if the shadow moved
+        """
+        if self._holdings_units is None or fill_id in self._fill_ids:
+            return False
+        self._fill_ids.add(fill_id)
+        self.num_fills += 1
+
+        # the part of it the holdings already show
+        ahead = self._ahead_units[index]
+        shown = min(units, ahead) if units > 0 else max(units, ahead)
+        if shown * units > 0:
+            self._ahead_units[index] -= shown
+            self._ahead_cash += shown * price
+            units -= shown
+            if units == 0:
+                return False
+
+        self._engine.apply_trade(index, units)
+        self._cash -= units * price
+        self._pending[fill_id] = (index, units, price)
+        return True
+
+    def reconcile(self, units, cash):
+        """
+        Catches up with the holdings received from FlexeMarkets
+        :param units: vector of units held, one per security
+        :param cash : settled cash in cents
+        :return     : (vector of units, cash) the shadow had to move by
+                        that the fills applied didn't explain, zero when it
+                        was right
+        """
+        units = np.array(units, dtype=float)
+        first = self._holdings_units is None
+        before_units = self._engine.units
+        before_cash = self._cash
+
+        # the most fills these holdings account for
+        matched = None
+        if first:
+            self._ahead_units = np.zeros(len(units))
+        else:
+            changed = cash != self._holdings_cash or \
+                not np.array_equal(units, self._holdings_units)
+            if changed and (self._ahead_cash or np.any(self._ahead_units)):
+                # shown by the last holdings, and never echoed
+                self._drifted(self._ahead_units.copy(), self._ahead_cash)
+                self._ahead_units[:] = 0
+                self._ahead_cash = 0
+
+            expected_units = self._holdings_units.copy()
+            expected_cash = self._holdings_cash
+            if expected_cash == cash and np.array_equal(expected_units, units):
+                matched = 0
+            for k, (index, traded, price) in enumerate(
+                    self._pending.values(), 1):
+                expected_units[index] += traded
+                expected_cash -= traded * price
+                if expected_cash == cash and \
+                        np.array_equal(expected_units, units):
+                    matched = k
+
+            if matched is None:
+                # trades whose echoes haven't arrived yet
+                self._ahead_units += units - expected_units
+                self._ahead_cash += cash - expected_cash
+
+        if matched is None:
+            self._pending = {}
+        else:
+            self._pending = dict(list(self._pending.items())[matched:])
+        self._holdings_units = units
+        self._holdings_cash = cash
+
+        # the fills the holdings don't show yet stay applied
+        after_units = units.copy()
+        after_cash = cash
+        for index, traded, price in self._pending.values():
+            after_units[index] += traded
+            after_cash -= traded * price
+        self._engine.set_holdings(after_units)
+        self._cash = after_cash
+
+        self.num_reconciled += 1
+        if matched is None and not first:
+            return after_units - before_units, after_cash - before_cash
+        return np.zeros(len(after_units)), 0
+
+    def _drifted(self, units, cash):
+        self.num_drifted += 1
+        self.max_drift = max(self.max_drift, int(np.abs(units).max()))
+        self.last_drift = (units, cash)
+
+    def summary(self):
+        """
+        :return: dictionary of fills applied, holdings reconciled, holdings
+                    that drifted and the most units one of them drifted by
+        """
+        return {"fills": self.num_fills, "holdings": self.num_reconciled,
+                "drifted": self.num_drifted, "max_drift": self.max_drift}
+
+
+def order_set_choices(num_securities):
+    """
+    Every set of orders that trades at most one unit in each security, one
+    row per set with one column per security holding NO_TRADE, SELL_TO_BID or
+    BUY_FROM_ASK. The empty set is left out and rows are sorted by the number
+    of securities traded.
+    Only depends on the number of securities, so it is built once
+    :param num_securities: number of securities in the marketplace
+    :return              : 2D int array of choices
+    """
+    choices = np.indices((3,) * num_securities, dtype=np.int8)
+    choices = choices.reshape(num_securities, -1).T[1:]
+
+    sizes = np.count_nonzero(choices, axis=1)
+    return choices[np.argsort(sizes, kind="stable")]
+
+
+def choice_unit_deltas(choices):
+    """
+    Change in units for each row of order set choices, selling to a bid
+    is -1 unit and buying from an ask is +1 unit
+    :param choices: 2D array from order_set_choices
+    :return       : 2D float array of unit deltas
+    """
+    return (choices == BUY_FROM_ASK).astype(float) - \
+        (choices == SELL_TO_BID).astype(float)
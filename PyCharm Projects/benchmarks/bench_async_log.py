@@ -0,0 +1,149 @@
+"""
+Cost of a bot's inform on the event loop, written synchronously against
+queued for the logging thread
+
+The bot's logger is pointed at a file handler with fmclient's log format, in
+a temporary directory, and each run logs NUM_CYCLES cycles of the five
+status lines CAPMBot writes every second.
+
+1. Synchronous: every inform formats its message and writes the file
+2. Queued: every inform only queues a record, then the time the logging
+   thread takes to write them all. The file must hold the same lines, in
+   order
+3. Sampled: log_sample={"status": SAMPLE}, only 1 cycle in SAMPLE is written
+4. A queue of DROP_QUEUE_SIZE records sent DROP_QUEUE_SIZE * 2, the rest are
+   dropped and counted, and one warning says how many
+
+Run from this directory: python bench_async_log.py
+"""
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from synthetic import load_dsbot
+from common.async_log import QueuedLog
+
+NUM_CYCLES = 20000
+LINES_PER_CYCLE = 5
+SAMPLE = 10
+DROP_QUEUE_SIZE = 1000
+LOG_FORMAT = "[%(asctime)s:%(name)20s]: %(levelname)8s - %(message)s"
+
+
+def file_logger(path):
+    logger = logging.getLogger(f"bench.{os.path.basename(path)}")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    handler = logging.FileHandler(path)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    logger.addHandler(handler)
+    return logger
+
+
+def close(logger):
+    for handler in list(logger.handlers):
+        handler.close()
+        logger.removeHandler(handler)
+
+
+def make_bot(path, queued, sample=None):
+    """
+    :return: DSBot logging to the file only
+    """
+    dsbot = load_dsbot()
+    bot = dsbot.DSBot("bench", "bench@local", "", 1, dsbot.BotType.REACTIVE)
+    # after the bot, fmclient's logging config disables existing loggers
+    bot._logger = file_logger(path)
+    # there is no websocket offline
+    bot._enable_ws_comm = False
+    if queued:
+        # room for every record, they are queued faster than any file is
+        # written
+        bot.start_log_queue(queue_size=NUM_CYCLES * LINES_PER_CYCLE,
+                            sample=sample)
+    return bot
+
+
+def log_cycles(bot):
+    """
+    :return: seconds spent in inform
+    """
+    start = time.perf_counter()
+    for cycle in range(NUM_CYCLES):
+        if bot.log_sampled("status"):
+            bot.inform("=============================")
+            bot.inform("Portfolio var: %s", 0.125 + cycle)
+            bot.inform("Exp return   : %s", 412.5 + cycle)
+            bot.inform("Performance  : %s", 380.75 + cycle)
+            bot.inform("=============================")
+    return time.perf_counter() - start
+
+
+def messages(path):
+    with open(path) as log:
+        return [line.split(" - ", 1)[1] for line in log]
+
+
+def run(directory, name, queued, sample=None):
+    """
+    :return: seconds in inform, seconds until written, lines written
+    """
+    path = os.path.join(directory, name)
+    bot = make_bot(path, queued, sample)
+    start = time.perf_counter()
+    spent = log_cycles(bot)
+    bot.stop_log_queue()
+    written = time.perf_counter() - start
+    close(bot._logger)
+    return spent, written, messages(path)
+
+
+def drop_run(directory):
+    logger = file_logger(os.path.join(directory, "drop.log"))
+    # the thread won't wake on its own before everything is sent
+    log = QueuedLog(logger, queue_size=DROP_QUEUE_SIZE, interval=60)
+    for i in range(DROP_QUEUE_SIZE * 2):
+        log.log(logging.INFO, "Record %d", (i,), category="drop")
+    log.stop()
+    close(logger)
+    lines = messages(os.path.join(directory, "drop.log"))
+    assert log.num_dropped == DROP_QUEUE_SIZE
+    assert log.dropped == {"drop": DROP_QUEUE_SIZE}
+    assert len(lines) == DROP_QUEUE_SIZE + 1
+    assert lines[-1] == f"Log queue full, {DROP_QUEUE_SIZE} records dropped\n"
+    return log
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        num_calls = NUM_CYCLES * LINES_PER_CYCLE
+        sync_time, _, sync_lines = run(directory, "sync.log", False)
+        queued_time, written, queued_lines = run(directory, "queued.log",
+                                                 True)
+        assert queued_lines == sync_lines
+        sampled_time, _, sampled_lines = run(directory, "sampled.log", True,
+                                             {"status": SAMPLE})
+        # whole cycles are kept, the first of every SAMPLE
+        assert sampled_lines == [
+            line for i, line in enumerate(sync_lines)
+            if i // LINES_PER_CYCLE % SAMPLE == 0]
+        log = drop_run(directory)
+
+        print(f"inform, synchronous: {sync_time / num_calls * 1e6:>6.2f} us "
+              f"per call")
+        print(f"inform, queued     : {queued_time / num_calls * 1e6:>6.2f} us "
+              f"per call ({sync_time / queued_time:.1f}x less), all "
+              f"{len(queued_lines)} lines written after {written:.2f} s")
+        print(f"inform, sampled    : {sampled_time / num_calls * 1e6:>6.2f} us "
+              f"per call, 1 in {SAMPLE}: {len(sampled_lines)} lines")
+        print(f"queue full         : {log.num_dropped} of "
+              f"{DROP_QUEUE_SIZE * 2} dropped and reported")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
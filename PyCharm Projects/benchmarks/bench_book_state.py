@@ -0,0 +1,203 @@
+"""
+DSBot's order book state kept from the order deltas, checked against the
+full scan it replaces
+
+1. Every recorded DSBot run with both markets is replayed into a reactive
+   and a market making DSBot. On every call, _get_order_book_state must
+   return the same counts and order as the full scan it replaced, over every
+   current order. The manager queue must hold one request per manager order
+   the scan finds, with its side, price and units, and the request of the
+   last one on the side of the role the scan gave us
+2. Cost of one call with NUM_RESTING manager orders and public orders of
+   ours resting, full scan against incremental
+3. Two bids at one price, the earlier received again unchanged, then with
+   fewer units, must stay first at the level, with the level's units
+   following. Only a new price sends it behind the other
+
+Run from this directory: python bench_book_state.py
+"""
+import timeit
+
+from fmclient import Order, OrderSide
+
+from bench_replay import has_private_market, read_logs
+from synthetic import clear_markets, load_dsbot, make_book_order, \
+    make_holding, make_market
+from common.order_book import OrderBook
+from common.replay import LogReplay
+
+NUM_RESTING = (1, 10, 100, 1000)
+NUM_CALLS = 2000
+
+
+def full_scan_state(role_enum):
+    """
+    _get_order_book_state as it was, walking every current order on each
+    call: the manager's private orders, the last of them and the role it
+    gives us, and our public orders
+    :return: (num_private_orders, num_my_public_orders, my_stale_public_order,
+                manager orders, manager_order, role)
+    """
+    num_private_orders = 0
+    manager_orders = []
+    manager_order = None
+    role = None
+    num_my_public_orders = 0
+    my_stale_public_order = None
+
+    for fm_id, order in Order.current().items():
+        # if there is a private order not created by me
+        if order.is_private and not order.mine:
+            num_private_orders += 1
+            manager_orders.append(order)
+            manager_order = order
+
+            # figure out our role based on private order
+            if manager_order.order_side == OrderSide.BUY:
+                role = role_enum.BUYER
+            else:
+                role = role_enum.SELLER
+
+        # if i created a public order that DID NOT EXECUTE IMMEDIATELY
+        elif not order.is_private and order.mine:
+            num_my_public_orders += 1
+            my_stale_public_order = order
+
+    return num_private_orders, num_my_public_orders, my_stale_public_order, \
+        manager_orders, manager_order, role
+
+
+def full_scan_requests(manager_orders):
+    """
+    :return: the manager queue's requests as the full scan finds them
+    """
+    return sorted((order.original_id or order.fm_id,
+                   order.order_side == OrderSide.BUY, order.price, order.units)
+                  for order in manager_orders)
+
+
+def checked(bot, dsbot, counts):
+    """
+    Wraps the bot's _get_order_book_state to compare it, and the manager
+    queue, with the full scan
+    """
+    incremental = bot._get_order_book_state
+
+    def get_order_book_state():
+        state = incremental()
+        requests = sorted((request.key, request.is_buy, request.price,
+                           request.units)
+                          for request in bot._managers.requests())
+
+        *expected, manager_orders, manager_order, role = \
+            full_scan_state(dsbot.Role)
+        counts["calls"] += 1
+        if state != tuple(expected) or \
+                requests != full_scan_requests(manager_orders):
+            counts["mismatches"] += 1
+
+        # the request of the order the full scan took our role from, on
+        # that role's side
+        elif manager_order is not None:
+            key = manager_order.original_id or manager_order.fm_id
+            side = bot._managers.side(role == dsbot.Role.BUYER)
+            if key not in {request.key for request in side.requests()}:
+                counts["mismatches"] += 1
+        return state
+
+    bot._get_order_book_state = get_order_book_state
+
+
+def differential(dsbot):
+    """
+    :return: (runs replayed, calls checked, mismatches)
+    """
+    recordings, _ = read_logs()
+    recordings = [recording for recording in recordings
+                  if has_private_market(recording)]
+    counts = {"calls": 0, "mismatches": 0}
+    for recording in recordings:
+        for bot_type in (dsbot.BotType.REACTIVE, dsbot.BotType.MARKET_MAKER):
+            bot = dsbot.DSBot("bench", "bench@local", "", 1, bot_type)
+            bot._logger.setLevel("WARNING")
+            checked(bot, dsbot, counts)
+            log_replay = LogReplay(recording)
+            log_replay.connect(bot)
+            log_replay.run()
+    return len(recordings) * 2, counts["calls"], counts["mismatches"]
+
+
+def call_cost(dsbot, num_resting):
+    """
+    :return: (microseconds per full scan, per incremental call)
+    """
+    clear_markets()
+    Order.clear_all()
+    widget = make_market(1, "widget")
+    private = make_market(2, "private", private=True)
+    bot = dsbot.DSBot("bench", "bench@local", "", 1, dsbot.BotType.REACTIVE)
+    bot._logger.setLevel("WARNING")
+    bot.initialised()
+    bot.received_holdings(make_holding([widget, private],
+                                       {"widget": 5, "private": 5}, 10000))
+
+    book = []
+    for i in range(num_resting):
+        book.append(make_book_order(10 + 2 * i, private, OrderSide.BUY, 500,
+                                    owner_target="M000"))
+        book.append(make_book_order(11 + 2 * i, widget, OrderSide.BUY,
+                                    400 - 5 * (i % 50), mine=True))
+    bot.received_orders(book)
+
+    assert bot._get_order_book_state() == full_scan_state(dsbot.Role)[:3]
+    full = timeit.timeit(lambda: full_scan_state(dsbot.Role),
+                         number=NUM_CALLS)
+    incremental = timeit.timeit(bot._get_order_book_state, number=NUM_CALLS)
+    return full / NUM_CALLS * 1e6, incremental / NUM_CALLS * 1e6
+
+
+def time_priority():
+    """
+    :return: fm_id of the best bid and units at the best price after each
+                delta
+    """
+    clear_markets()
+    Order.clear_all()
+    widget = make_market(1, "widget")
+    book = OrderBook()
+    seen = []
+
+    def received(*orders):
+        book.update(orders)
+        seen.append((book.best_bid(widget.fm_id).fm_id,
+                     book.depth(widget.fm_id, OrderSide.BUY)[1]))
+
+    received(make_book_order(1, widget, OrderSide.BUY, 500, units=2),
+             make_book_order(2, widget, OrderSide.BUY, 500))
+    received(make_book_order(1, widget, OrderSide.BUY, 500, units=2))
+    received(make_book_order(1, widget, OrderSide.BUY, 500))
+    received(make_book_order(1, widget, OrderSide.BUY, 490))
+    received(make_book_order(1, widget, OrderSide.BUY, 500))
+    return seen
+
+
+def main():
+    dsbot = load_dsbot()
+
+    runs, calls, mismatches = differential(dsbot)
+    print(f"replayed runs : {runs}, {calls} calls checked against the full "
+          f"scan, {mismatches} mismatches")
+    assert calls > 0 and mismatches == 0
+
+    print(f"{'resting':>8} {'full scan (us)':>15} {'incremental (us)':>17}")
+    for num_resting in NUM_RESTING:
+        full, incremental = call_cost(dsbot, num_resting)
+        print(f"{num_resting:>8} {full:>15.2f} {incremental:>17.2f}")
+
+    seen = time_priority()
+    print(f"best bid (fm_id, units at its price) after each delta: {seen}")
+    assert seen == [(1, 3), (1, 3), (1, 2), (2, 1), (2, 2)]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Tick-to-decision latency of CAPMBot, polling every second against the event
+driven mode: a mispriced order arrives at a random time and we time how long
+until the bot sends the order that trades with it.
+
+Runs the bot's own periodic tasks on an asyncio loop, so the market maker
+dwell and the 1 second timer behave as they do live.
+
+Run from this directory: python bench_event_latency.py
+"""
+import asyncio
+import random
+import time
+
+import numpy as np
+from fmclient import Order
+
+from synthetic import make_capm_bot
+
+NUM_EVENTS = 15
+MIN_GAP, MAX_GAP = 0.3, 1.7
+BURST_SIZE = 20
+
+
+def run_session(event_driven, seed=0):
+    """
+    :return: (array of tick-to-decision latencies, strategy cycles run)
+    """
+    rng = random.Random(seed)
+    Order.clear_all()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    bot, markets = make_capm_bot(periodic=True)
+    bot._loop = loop
+    bot._event_driven = event_driven
+    bot.is_session_active = lambda: True
+
+    latencies = []
+    arrivals = {}
+    cycles = [0]
+    next_id = [1000]
+
+    def new_id():
+        next_id[0] += 1
+        return next_id[0]
+
+    def send_order(order):
+        # every order is accepted straight away, but never trades
+        loop.call_soon(bot.order_accepted, order)
+
+        # only the reactive response, not market maker quotes or cancels
+        if order.ref and order.ref.startswith("Order") and arrivals:
+            fm_id, arrived = arrivals.popitem()
+            latencies.append(time.perf_counter() - arrived)
+
+            # the mispriced order is gone
+            bot.received_orders([Order(fm_id, {"id": fm_id,
+                                               "consumer": new_id()})])
+
+    bot.send_order = send_order
+    run_strategy_cycle = bot._run_strategy_cycle
+
+    def counted_cycle():
+        cycles[0] += 1
+        run_strategy_cycle()
+
+    bot._run_strategy_cycle = counted_cycle
+
+    def order_json(fm_id, market, side, price):
+        return {"id": fm_id, "type": "LIMIT", "side": side, "units": 1,
+                "price": price, "marketId": market.fm_id, "mine": False,
+                "original": fm_id, "consumer": None}
+
+    def burst():
+        # a burst of uninteresting, far from the money orders
+        bot.received_orders([
+            Order(fm_id, order_json(fm_id, rng.choice(markets), "BUY", 5))
+            for fm_id in [new_id() for _ in range(BURST_SIZE)]])
+
+    def mispriced_bid():
+        burst()
+        fm_id = new_id()
+        order = Order(fm_id, order_json(fm_id, rng.choice(markets[:3]),
+                                        "BUY", 1000))
+        arrivals[fm_id] = time.perf_counter()
+        bot.received_orders([order])
+
+    at = 1.0
+    for _ in range(NUM_EVENTS):
+        at += rng.uniform(MIN_GAP, MAX_GAP)
+        loop.call_later(at, mispriced_bid)
+
+    async def session():
+        tasks = [loop.create_task(task) for task in bot._user_tasks]
+        await asyncio.sleep(at + 2.5)
+        bot._stop = True
+        await asyncio.gather(*tasks)
+
+    loop.run_until_complete(session())
+    loop.close()
+    return np.array(latencies), cycles[0]
+
+
+def main():
+    print(f"{'mode':>9} {'decisions':>9} {'cycles':>7} {'p50 (ms)':>9} "
+          f"{'p99 (ms)':>9} {'max (ms)':>9}")
+    for name, event_driven in (("polling", False), ("event", True)):
+        latencies, cycles = run_session(event_driven)
+        latencies *= 1e3
+        print(f"{name:>9} {len(latencies):>9} {cycles:>7} "
+              f"{np.percentile(latencies, 50):>9.2f} "
+              f"{np.percentile(latencies, 99):>9.2f} "
+              f"{latencies.max():>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Throughput and determinism of the local exchange
+
+1. Raw matching: scripted traders send random limit orders and cancels
+   around a mid price, with no bot connected
+2. The same flow with an unmodified CAPMBot connected, which receives every
+   order update, holdings update and session update through its Agent
+   handlers and trades against the flow
+3. The CAPMBot session is replayed under the same seed, and must produce
+   exactly the same trades, then under a different seed
+4. An unmodified reactive DSBot gets a private buy order from the manager,
+   buys a widget in the public market and sells it to the manager
+
+Run from this directory: python bench_exchange.py
+"""
+import time
+
+from fmclient import OrderSide
+
+from synthetic import CAPM_PAYOFFS, load_dsbot
+from CAPMBot import CAPMBot
+from common.exchange import LocalExchange, MANAGER_CODE
+
+NUM_TRADERS = 50
+NUM_ORDERS = 100000
+CANCEL_SHARE = 0.3
+BOT_SESSION_TIME = 120
+BOT_ORDER_RATE = 200
+
+
+def make_marketplace(seed):
+    """
+    :return: exchange, its markets and the scripted traders' codes
+    """
+    exchange = LocalExchange(seed=seed)
+    markets = [exchange.add_market(item, ",".join(str(p) for p in payoff),
+                                   min_price=5, price_tick=5)
+               for item, payoff in CAPM_PAYOFFS.items()]
+    traders = [exchange.add_account(cash=10 ** 9,
+                                    units={m.item: 10 ** 6 for m in markets})
+               for _ in range(NUM_TRADERS)]
+    return exchange, markets, traders
+
+
+def order_flow(exchange, markets, traders):
+    """
+    :return: function sending one random scripted order or cancel
+    """
+    rng = exchange.random
+    mids = {market: sum(CAPM_PAYOFFS[market.item]) // 4 // 5 * 5
+            for market in markets}
+    resting = []
+
+    def send():
+        trader = rng.choice(traders)
+        if resting and rng.random() < CANCEL_SHARE:
+            code, fm_id = resting.pop(rng.randrange(len(resting)))
+            exchange.cancel(code, fm_id)
+            return
+
+        market = rng.choice(markets)
+        side = rng.choice((OrderSide.BUY, OrderSide.SELL))
+        offset = 5 * rng.randint(-8, 8)
+        price = min(max(mids[market] + offset, 5), 1000)
+        fm_id = exchange.submit(trader, market, side, price,
+                                rng.randint(1, 3))
+        if fm_id is not None:
+            resting.append((trader, fm_id))
+
+    return send
+
+
+def raw_matching(seed=0):
+    exchange, markets, traders = make_marketplace(seed)
+    send = order_flow(exchange, markets, traders)
+    exchange.open_session()
+
+    start = time.perf_counter()
+    for _ in range(NUM_ORDERS):
+        send()
+    elapsed = time.perf_counter() - start
+    exchange.stop()
+    return exchange, elapsed
+
+
+def bot_session(seed=0):
+    exchange, markets, traders = make_marketplace(seed)
+    send = order_flow(exchange, markets, traders)
+
+    bot = CAPMBot("bench", "bench@local", "", 1)
+    bot._logger.setLevel("WARNING")
+    exchange.connect(bot, cash=20000, units={m.item: 5 for m in markets},
+                     short_units=5)
+
+    def flow():
+        send()
+        exchange.call_at(exchange.time + 1 / BOT_ORDER_RATE, flow)
+
+    exchange.call_at(0.5, flow)
+    exchange.start()
+
+    start = time.perf_counter()
+    exchange.run(BOT_SESSION_TIME)
+    elapsed = time.perf_counter() - start
+    exchange.stop()
+    return exchange, elapsed
+
+
+def dsbot_session():
+    dsbot = load_dsbot()
+    exchange = LocalExchange(seed=0)
+    widget = exchange.add_market("widget", max_price=1000)
+    private = exchange.add_market("private", private=True, max_price=1000)
+    seller = exchange.add_account(cash=10 ** 6, units={"widget": 100})
+
+    bot = dsbot.DSBot("bench", "bench@local", "", 1, dsbot.BotType.REACTIVE)
+    bot._logger.setLevel("WARNING")
+    code = exchange.connect(bot, cash=10000,
+                            units={"widget": 5, "private": 5})
+    exchange.start()
+
+    exchange.call_at(1, exchange.submit, MANAGER_CODE, private,
+                     OrderSide.BUY, 500, 1, None, code)
+    exchange.call_at(2, exchange.submit, seller, widget, OrderSide.SELL,
+                     400, 1)
+    exchange.run(10)
+    exchange.stop()
+    return exchange, code
+
+
+def main():
+    exchange, elapsed = raw_matching()
+    print(f"raw matching  : {NUM_ORDERS / elapsed:>9,.0f} orders/s, "
+          f"{exchange.num_events / elapsed:>9,.0f} order events/s, "
+          f"{len(exchange.trades)} trades")
+
+    exchange, elapsed = bot_session()
+    bot_trades = [trade for trade in exchange.trades
+                  if "T001" in trade[-2:]]
+    print(f"with CAPMBot  : {exchange.num_events / elapsed:>9,.0f} "
+          f"order events/s, {BOT_SESSION_TIME} s session in "
+          f"{elapsed:.2f} s, bot traded {len(bot_trades)} times")
+
+    replay, _ = bot_session()
+    other, _ = bot_session(seed=1)
+    assert replay.trades == exchange.trades
+    assert other.trades != exchange.trades
+    print("replay        : same seed, identical trades")
+
+    exchange, code = dsbot_session()
+    assert [trade[1:] for trade in exchange.trades] == [
+        (1, 400, 1, code, "T001"), (2, 500, 1, MANAGER_CODE, code)]
+    print("DSBot         : bought publicly at 400, sold to the manager at 500")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Time from one of DSBot's public orders trading to the private order that
+trades the widget with the manager
+
+A reactive and a market making DSBot trade on the local exchange, in a
+public market with random one unit orders around MID, while every
+REQUEST_INTERVAL seconds the manager sends it a private order of
+REQUEST_UNITS units, buys above MID and sells below it in turn. Each order
+update delivering a public trade of ours is timed from the moment it is
+delivered, and each unit traded is matched, oldest first, with the next
+private order the bot sends. Reported per unit:
+
+    wall   wall clock time from the update to send_order
+    held   exchange time the widget was held unhedged, non zero when the
+           private order waited for a later update
+
+Each session runs twice, with order_accepted sent before the order updates
+and, as FlexeMarkets sometimes does, after them.
+
+Run from this directory: python bench_hedge.py
+"""
+import time
+from collections import deque
+
+import numpy as np
+from fmclient import OrderSide
+
+from synthetic import load_dsbot
+from common.exchange import LocalExchange, MANAGER_CODE
+
+SESSION_TIME = 300
+MID = 500
+ORDER_RATE = 20
+REQUEST_INTERVAL = 5
+REQUEST_UNITS = 3
+CASH = 10 ** 6
+UNITS = 300
+
+
+def public_fills(jsons, market_id):
+    """
+    :return: units of our public orders the update says traded
+    """
+    cancels = {json["id"] for json in jsons if json["type"] == "CANCEL"}
+    return sum(json["units"] for json in jsons
+               if json["mine"] and json["marketId"] == market_id and
+               json["type"] == "LIMIT" and json["consumer"] and
+               json["consumer"] not in cancels)
+
+
+def session(dsbot, bot_type, echo_first):
+    """
+    :return: (array of wall clock microseconds, array of held milliseconds),
+                one per unit hedged
+    """
+    exchange = LocalExchange(seed=0, echo_first=echo_first)
+    widget = exchange.add_market("widget", min_price=5, max_price=1000,
+                                 price_tick=5)
+    private = exchange.add_market("private", private=True, min_price=5,
+                                  max_price=1000, price_tick=5)
+    traders = [exchange.add_account(cash=10 ** 9, units={"widget": 10 ** 6})
+               for _ in range(10)]
+
+    bot = dsbot.DSBot("bench", "bench@local", "", 1, bot_type)
+    bot._logger.setLevel("ERROR")
+    code = exchange.connect(bot, cash=CASH,
+                            units={"widget": UNITS, "private": UNITS})
+
+    # (wall clock, exchange time) of every unit traded and not hedged yet
+    unhedged = deque()
+    wall = []
+    held = []
+    on_orders_update = bot._on_orders_update
+
+    def timed_orders_update(jsons):
+        delivered = time.perf_counter_ns()
+        for _ in range(public_fills(jsons, widget.fm_id)):
+            unhedged.append((delivered, exchange.time))
+        on_orders_update(jsons)
+
+    bot._on_orders_update = timed_orders_update
+    send_order = bot.send_order
+
+    def timed_send_order(order):
+        if order.market.fm_id == private.fm_id:
+            now = time.perf_counter_ns()
+            for _ in range(min(order.units, len(unhedged))):
+                delivered, traded = unhedged.popleft()
+                wall.append((now - delivered) / 1000)
+                held.append((exchange.time - traded) * 1000)
+        send_order(order)
+
+    bot.send_order = timed_send_order
+
+    rng = exchange.random
+    num_requests = [0]
+
+    def flow():
+        exchange.submit(rng.choice(traders), widget,
+                        rng.choice((OrderSide.BUY, OrderSide.SELL)),
+                        MID + 5 * rng.randint(-10, 10), 1)
+        exchange.call_at(exchange.time + 1 / ORDER_RATE, flow)
+
+    def request():
+        # one side resting at a time, the manager's orders would trade
+        # with each other
+        if not exchange.resting_orders(MANAGER_CODE):
+            if num_requests[0] % 2 == 0:
+                side, price = OrderSide.BUY, MID + 5 * rng.randint(3, 8)
+            else:
+                side, price = OrderSide.SELL, MID - 5 * rng.randint(3, 8)
+            exchange.submit(MANAGER_CODE, private, side, price,
+                            REQUEST_UNITS, None, code)
+            num_requests[0] += 1
+        exchange.call_at(exchange.time + REQUEST_INTERVAL, request)
+
+    exchange.call_at(0.5, flow)
+    exchange.call_at(1, request)
+    exchange.start()
+    exchange.run(SESSION_TIME)
+    exchange.stop()
+    return np.array(wall), np.array(held)
+
+
+def main():
+    dsbot = load_dsbot()
+    for echo_first in (False, True):
+        print("order updates before order_accepted" if echo_first else
+              "order_accepted before order updates")
+        for bot_type in (dsbot.BotType.REACTIVE, dsbot.BotType.MARKET_MAKER):
+            wall, held = session(dsbot, bot_type, echo_first)
+            p50, p99 = np.percentile(wall, [50, 99])
+            print(f"  {bot_type.name:<12}: {len(wall)} units hedged, fill "
+                  f"to private send p50 {p50:>9.1f} us, p99 {p99:>9.1f} us, "
+                  f"held {held.mean():>5.1f} ms on average, "
+                  f"{np.count_nonzero(held)} units after a later update")
+
+
+if __name__ == "__main__":
+    main()
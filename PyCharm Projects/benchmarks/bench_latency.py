@@ -0,0 +1,154 @@
+"""
+Overhead of the tick to trade latency tracker, and the latencies it reports
+for the bots on the local exchange
+
+1. Cost per order of marking every point (tick, strategy entry and exit,
+   send and acknowledgement) with the tracker enabled and disabled
+2. An event driven CAPMBot and a reactive DSBot trade on the local exchange
+   with tracking on, and the report each bot logs is printed. Virtual time
+   passes instantly there, so the latencies are the CPU time the bot and
+   the exchange spend between the points
+3. Tracking is switched off halfway through a session, after which no
+   samples are added
+
+Run from this directory: python bench_latency.py
+"""
+import time
+
+from fmclient import OrderSide
+
+from synthetic import CAPM_PAYOFFS, load_dsbot
+from CAPMBot import CAPMBot
+from common.exchange import LocalExchange, MANAGER_CODE
+from common.latency import LatencyTracker
+
+NUM_MARKS = 200000
+SESSION_TIME = 60
+ORDER_RATE = 100
+
+
+def overhead(enabled):
+    """
+    :return: nanoseconds per order to mark all of its points
+    """
+    tracker = LatencyTracker(enabled=enabled, window=4096)
+    refs = [f"Order {i} - SM" for i in range(NUM_MARKS)]
+
+    start = time.perf_counter_ns()
+    for ref in refs:
+        tracker.tick()
+        tracker.enter("REACTIVE")
+        tracker.sent(ref)
+        tracker.exit()
+        tracker.acknowledged(ref)
+    return (time.perf_counter_ns() - start) / NUM_MARKS
+
+
+def baseline():
+    """
+    :return: nanoseconds per order of the same loop without a tracker
+    """
+    refs = [f"Order {i} - SM" for i in range(NUM_MARKS)]
+    start = time.perf_counter_ns()
+    for ref in refs:
+        pass
+    return (time.perf_counter_ns() - start) / NUM_MARKS
+
+
+def capm_session():
+    exchange = LocalExchange(seed=0)
+    markets = [exchange.add_market(item, ",".join(str(p) for p in payoff),
+                                   min_price=5, price_tick=5)
+               for item, payoff in CAPM_PAYOFFS.items()]
+    traders = [exchange.add_account(cash=10 ** 9,
+                                    units={m.item: 10 ** 6 for m in markets})
+               for _ in range(20)]
+
+    bot = CAPMBot("bench", "bench@local", "", 1, event_driven=True,
+                  track_latency=True)
+    bot._logger.setLevel("WARNING")
+    exchange.connect(bot, cash=20000, units={m.item: 5 for m in markets},
+                     short_units=5)
+
+    rng = exchange.random
+    mids = {market: sum(CAPM_PAYOFFS[market.item]) // 4 // 5 * 5
+            for market in markets}
+    resting = []
+
+    def flow():
+        if resting and rng.random() < 0.3:
+            exchange.cancel(*resting.pop(rng.randrange(len(resting))))
+        else:
+            trader = rng.choice(traders)
+            market = rng.choice(markets)
+            price = mids[market] + 5 * rng.randint(-8, 8)
+            fm_id = exchange.submit(trader, market,
+                                    rng.choice((OrderSide.BUY,
+                                                OrderSide.SELL)),
+                                    max(price, 5), 1)
+            if fm_id is not None:
+                resting.append((trader, fm_id))
+        exchange.call_at(exchange.time + 1 / ORDER_RATE, flow)
+
+    exchange.call_at(0.5, flow)
+    exchange.start()
+    exchange.run(SESSION_TIME / 2)
+    counts = total_samples(bot.latency)
+
+    # switched off at runtime, nothing more is recorded
+    bot.latency.enabled = False
+    exchange.run(SESSION_TIME / 2)
+    assert total_samples(bot.latency) == counts
+    exchange.stop()
+    return bot.latency
+
+
+def dsbot_session():
+    dsbot = load_dsbot()
+    exchange = LocalExchange(seed=0)
+    widget = exchange.add_market("widget", max_price=1000)
+    private = exchange.add_market("private", private=True, max_price=1000)
+    seller = exchange.add_account(cash=10 ** 6, units={"widget": 1000})
+
+    bot = dsbot.DSBot("bench", "bench@local", "", 1, dsbot.BotType.REACTIVE,
+                      track_latency=True)
+    bot._logger.setLevel("WARNING")
+    # private widgets for every widget the manager asks for, the bot doesn't
+    # buy one it has none left to sell to the manager for
+    code = exchange.connect(bot, cash=10 ** 6,
+                            units={"widget": 5, "private": SESSION_TIME})
+    exchange.start()
+
+    # the manager keeps asking to buy, and a seller keeps offering below
+    for second in range(1, SESSION_TIME, 2):
+        exchange.call_at(second, exchange.submit, MANAGER_CODE, private,
+                         OrderSide.BUY, 500, 1, None, code)
+        exchange.call_at(second + 1, exchange.submit, seller, widget,
+                         OrderSide.SELL, 400, 1)
+    exchange.run(SESSION_TIME)
+    exchange.stop()
+    return bot.latency
+
+
+def total_samples(tracker):
+    return sum(stats["count"] for stages in tracker.summary().values()
+               for stats in stages.values())
+
+
+def main():
+    base = baseline()
+    enabled = overhead(True) - base
+    disabled = overhead(False) - base
+    print(f"overhead per order : {enabled:>6.0f} ns enabled, "
+          f"{disabled:>4.0f} ns disabled (5 marks)")
+
+    for name, tracker in (("CAPMBot", capm_session()),
+                          ("DSBot", dsbot_session())):
+        print(f"\n{name}: {tracker.num_accepted} accepted, "
+              f"{tracker.num_rejected} rejected")
+        for line in tracker.report():
+            print(f"  {line}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Reserved cash and units ledger: cost of the pre-trade check, and orders the
+exchange rejects with and without it
+
+1. Ledger.fits on a batch of NUM_ORDERS orders over NUM_MARKETS markets,
+   against checking each order against each market in a loop
+2. An event driven CAPMBot trades on a local exchange that takes LATENCY
+   seconds to process each order, with MAX_IN_FLIGHT orders in flight per
+   market and little cash. Without reservations every check sees the last
+   holdings, and back-to-back orders spend the same cash and units; with
+   them the exchange should reject none for lack of cash or units
+3. The same session with an order timeout shorter than LATENCY, so every
+   order times out before it is acknowledged and is then accepted late.
+   It must stay reserved meanwhile
+
+Run from this directory: python bench_ledger.py
+"""
+import random
+import time
+
+import numpy as np
+from fmclient import OrderSide
+
+from synthetic import CAPM_PAYOFFS
+from CAPMBot import CAPMBot
+from common.exchange import LocalExchange
+from common.ledger import Ledger
+
+NUM_ORDERS = 64
+NUM_MARKETS = (4, 16, 64)
+NUM_CHECKS = 2000
+SESSION_TIME = 60
+LATENCY = 0.05
+MAX_IN_FLIGHT = 4
+LATE_TIMEOUT = LATENCY / 2
+ORDER_RATE = 100
+
+
+class _Holdings:
+    """
+    Stands in for fmclient's Holding, with what Ledger.update_holdings reads
+    """
+
+    class _Asset:
+        def __init__(self, units):
+            self.units = self.units_available = units
+            self.units_granted_short = 0
+
+    class _Market:
+        def __init__(self, fm_id):
+            self.fm_id = fm_id
+
+    def __init__(self, cash, num_markets, units):
+        self.cash = self.cash_available = cash
+        self.assets = {self._Market(i): self._Asset(units)
+                       for i in range(num_markets)}
+
+
+def loop_fits(orders, cash_available, units_available):
+    """
+    Checks every order against every market, one at a time
+    """
+    to_spend = 0
+    for index, is_buy, price, units in orders:
+        if is_buy:
+            to_spend += price * units
+    if to_spend > cash_available:
+        return False
+    for market in range(len(units_available)):
+        to_sell = 0
+        for index, is_buy, price, units in orders:
+            if not is_buy and index == market:
+                to_sell += units
+        if to_sell > units_available[market]:
+            return False
+    return True
+
+
+def check_cost(num_markets):
+    """
+    :return: (microseconds per batch with fits, with the loop)
+    """
+    rng = random.Random(num_markets)
+    ledger = Ledger(range(num_markets))
+    ledger.update_holdings(_Holdings(10 ** 9, num_markets, 10 ** 6))
+    orders = [(rng.randrange(num_markets), rng.random() < 0.5,
+               rng.randint(5, 1000), rng.randint(1, 5))
+              for _ in range(NUM_ORDERS)]
+    indices, is_buy, prices, units = (np.array(column)
+                                      for column in zip(*orders))
+    units_available = ledger.units_available.tolist()
+
+    assert ledger.fits(indices, is_buy, prices, units) == \
+        loop_fits(orders, ledger.cash_available, units_available)
+
+    start = time.perf_counter()
+    for _ in range(NUM_CHECKS):
+        ledger.fits(indices, is_buy, prices, units)
+    vectorised = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(NUM_CHECKS):
+        loop_fits(orders, ledger.cash_available, units_available)
+    looped = time.perf_counter() - start
+    return vectorised / NUM_CHECKS * 1e6, looped / NUM_CHECKS * 1e6
+
+
+def session(reserve, order_timeout=None):
+    """
+    :param order_timeout: seconds before an order times out, the bot's
+                          default if None
+    :return: (orders rejected for cash or units, orders sent, trades)
+    """
+    exchange = LocalExchange(seed=0, latency=LATENCY)
+    markets = [exchange.add_market(item, ",".join(str(p) for p in payoff),
+                                   min_price=5, price_tick=5)
+               for item, payoff in CAPM_PAYOFFS.items()]
+    traders = [exchange.add_account(cash=10 ** 9,
+                                    units={m.item: 10 ** 6 for m in markets})
+               for _ in range(20)]
+
+    kwargs = {} if order_timeout is None else {"order_timeout": order_timeout}
+    bot = CAPMBot("bench", "bench@local", "", 1, event_driven=True,
+                  max_in_flight=MAX_IN_FLIGHT, **kwargs)
+    bot._logger.setLevel("ERROR")
+    code = exchange.connect(bot, cash=2000, units={m.item: 2 for m in markets},
+                            short_units=2)
+    bot._orders._clock = lambda: exchange.time
+    if not reserve:
+        # the ledger then only holds what received_holdings says
+        bot._orders._ledger = None
+
+    rejected = []
+    order_rejected = bot.order_rejected
+
+    def count_rejected(info, order):
+        if "available" in str(info):
+            rejected.append(order)
+        order_rejected(info, order)
+
+    bot.order_rejected = count_rejected
+
+    rng = exchange.random
+    mids = {market: sum(CAPM_PAYOFFS[market.item]) // 4 // 5 * 5
+            for market in markets}
+
+    def flow():
+        market = rng.choice(markets)
+        exchange.submit(rng.choice(traders), market,
+                        rng.choice((OrderSide.BUY, OrderSide.SELL)),
+                        max(mids[market] + 5 * rng.randint(-8, 8), 5), 1)
+        exchange.call_at(exchange.time + 1 / ORDER_RATE, flow)
+
+    exchange.call_at(0.5, flow)
+    exchange.start()
+    exchange.run(SESSION_TIME)
+    sent = bot._orders.summary().get("SENT", 0)
+    exchange.stop()
+
+    trades = sum(1 for trade in exchange.trades if code in trade[4:])
+    return len(rejected), sent, trades
+
+
+def main():
+    for num_markets in NUM_MARKETS:
+        vectorised, looped = check_cost(num_markets)
+        print(f"check {NUM_ORDERS} orders, {num_markets:>2} markets: "
+              f"fits {vectorised:>6.1f} us, loop {looped:>7.1f} us")
+
+    for reserve in (False, True):
+        rejected, sent, trades = session(reserve)
+        label = "with reservations   " if reserve else "without reservations"
+        print(f"{label}: {rejected} of {sent} orders rejected for cash or "
+              f"units, bot traded {trades} times")
+        if reserve:
+            assert rejected == 0
+
+    rejected, sent, trades = session(True, LATE_TIMEOUT)
+    print(f"acknowledged late   : {rejected} of {sent} orders rejected for cash or "
+          f"units, bot traded {trades} times")
+    assert rejected == 0
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Querying a large bot log through the columnar store, against re-parsing its
+text every time
+
+A synthetic DSBot log of NUM_LINES lines is written in the -bot.log format,
+with order, asset and session lines among other messages, over NUM_RUNS runs
+of the bot.
+
+1. Baseline: every line is matched with the log regexes, and the orders of
+   one market in a QUERY_MINUTES window are kept
+2. The whole log is converted into a LogStore, once
+3. APPEND_LINES more lines are appended to the log and the store is brought
+   up to date, which must only read the new lines
+4. The same query through a freshly opened store, which memory maps the
+   columns and binary searches the time column. It must return the same
+   orders as the baseline
+5. APPEND_LINES more lines logged after the clock was set back SET_BACK.
+   The store must be rebuilt with every time column sorted, and a query
+   over the times logged twice return the orders the re-parse finds, in
+   time order
+
+Run from this directory: python bench_log_store.py
+"""
+import datetime
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import synthetic  # noqa: F401, puts the bots' directories on sys.path
+from common.log_store import LogStore, SIDES, convert_log
+from common.replay import LOG_LINE, ORDER_LINE
+
+NUM_LINES = 500000
+APPEND_LINES = 5000
+NUM_RUNS = 20
+MARKETS = (1570, 1571)
+QUERY_MINUTES = 10
+START = datetime.datetime(2020, 9, 4, 12, 0)
+SET_BACK = datetime.timedelta(hours=1)
+
+
+def log_lines(rng, count, first_id, start):
+    """
+    :return: list of lines, the next order id and the time after the last
+    """
+    lines = []
+    now = start
+    fm_id = first_id
+    for _ in range(count):
+        now += datetime.timedelta(milliseconds=rng.randint(0, 200))
+        stamp = now.strftime("%Y-%m-%d %H:%M:%S,") + \
+            f"{now.microsecond // 1000:03d}"
+        roll = rng.random()
+        if roll < 0.7:
+            fm_id += 1
+            message = (f"Order({fm_id},{rng.choice(('Mine', 'Others'))},"
+                       f"{rng.choice(SIDES)},{rng.randint(1, 5)}@"
+                       f"{rng.randint(1, 100) * 10},M-{rng.choice(MARKETS)},"
+                       f"LIMIT,REF:'Order {fm_id % 50}')")
+        elif roll < 0.8:
+            message = (f"Asset(Market({MARKETS[0]},widget,Widget,False),"
+                       f"{rng.randint(0, 20)},5,5,0,True,True)")
+        elif roll < 0.801:
+            message = "Session: SID:14438:SessionState.OPEN"
+        else:
+            message = f"Units left to trade = {rng.randint(0, 5)}"
+        lines.append(f"[{stamp}:         agent.DSBot]:     INFO - "
+                     f"{message}\n")
+    return lines, fm_id, now
+
+
+def write_log(path, rng):
+    start = START
+    fm_id = 10 ** 7
+    with open(path, "w") as log:
+        for _ in range(NUM_RUNS):
+            log.write(f"\n{'=' * 31} Log Started "
+                      f"[{start:%Y-%m-%d %H:%M:%S} AEST] {'=' * 31}\n")
+            lines, fm_id, start = log_lines(rng, NUM_LINES // NUM_RUNS,
+                                            fm_id, start)
+            log.writelines(lines)
+    return fm_id, start
+
+
+def parse_query(path, start, end, market_id):
+    """
+    :return: fm_ids of the orders of a market logged in [start, end)
+    """
+    first = start.strftime("%Y-%m-%d %H:%M:%S,000")
+    last = end.strftime("%Y-%m-%d %H:%M:%S,000")
+    fm_ids = []
+    with open(path) as log:
+        for line in log:
+            match = LOG_LINE.match(line.rstrip("\n"))
+            if match is None:
+                continue
+            found = ORDER_LINE.match(match.group(2))
+            if found and first <= match.group(1) < last and \
+                    int(found.group(6)) == market_id:
+                fm_ids.append(int(found.group(1)))
+    return fm_ids
+
+
+def main():
+    rng = random.Random(0)
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "bench-bot.log")
+        fm_id, end = write_log(path, rng)
+        size = os.path.getsize(path)
+        query_start = (START + (end - START) / 2).replace(microsecond=0)
+        query_end = query_start + datetime.timedelta(minutes=QUERY_MINUTES)
+
+        begin = time.perf_counter()
+        expected = parse_query(path, query_start, query_end, MARKETS[0])
+        parse_time = time.perf_counter() - begin
+
+        store_dir = os.path.join(directory, "store")
+        begin = time.perf_counter()
+        store = convert_log(path, store_dir)
+        convert_time = time.perf_counter() - begin
+
+        with open(path, "a") as log:
+            log.writelines(log_lines(rng, APPEND_LINES, fm_id, end)[0])
+        begin = time.perf_counter()
+        num_new = store.update(path)
+        append_time = time.perf_counter() - begin
+        assert num_new == APPEND_LINES
+
+        begin = time.perf_counter()
+        store = LogStore(store_dir)
+        orders = store.select("orders", query_start, query_end,
+                              market_id=MARKETS[0], columns=["fm_id"])
+        query_time = time.perf_counter() - begin
+        assert np.array_equal(orders["fm_id"], expected)
+
+        with open(path, "a") as log:
+            log.writelines(log_lines(rng, APPEND_LINES, fm_id + APPEND_LINES,
+                                     end - SET_BACK)[0])
+        begin = time.perf_counter()
+        num_read = store.update(path)
+        rebuild_time = time.perf_counter() - begin
+        assert num_read > NUM_LINES + APPEND_LINES
+        for table in ("orders", "assets", "sessions"):
+            times = store.column(table, "time")
+            assert np.all(times[1:] >= times[:-1])
+        set_back_start = (end - SET_BACK).replace(microsecond=0)
+        set_back_end = set_back_start + datetime.timedelta(minutes=1)
+        expected_back = parse_query(path, set_back_start, set_back_end,
+                                    MARKETS[0])
+        orders = LogStore(store_dir).select(
+            "orders", set_back_start, set_back_end, market_id=MARKETS[0],
+            columns=["time", "fm_id"])
+        assert sorted(orders["fm_id"]) == sorted(expected_back)
+        assert orders["fm_id"].tolist() != sorted(expected_back)
+        assert np.all(orders["time"][1:] >= orders["time"][:-1])
+
+        store_size = sum(os.path.getsize(os.path.join(store_dir, name))
+                         for name in os.listdir(store_dir))
+        print(f"log               : {NUM_LINES:,} lines, "
+              f"{size / 2 ** 20:.1f} MiB, {len(store):,} rows stored in "
+              f"{store_size / 2 ** 20:.1f} MiB")
+        print(f"query, re-parse   : {parse_time * 1000:>9.1f} ms, "
+              f"{len(expected)} orders")
+        print(f"query, store      : {query_time * 1000:>9.3f} ms "
+              f"({parse_time / query_time:,.0f}x faster)")
+        print(f"convert, full     : {convert_time * 1000:>9.1f} ms "
+              f"({NUM_LINES / convert_time:,.0f} lines/s)")
+        print(f"convert, {APPEND_LINES} new: {append_time * 1000:>9.1f} ms")
+        print(f"clock set back    : {rebuild_time * 1000:>9.1f} ms to "
+              f"rebuild, {len(expected_back)} orders logged twice in a "
+              f"minute, sorted by time")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+DSBot working several manager orders at once
+
+1. A reactive and a market making DSBot trade on the local exchange, in a
+   public market with random one unit orders around MID, while every
+   REQUEST_INTERVAL seconds the manager sends it CONCURRENT private orders of
+   REQUEST_UNITS units, all buys above MID or all sells below it, as the
+   manager's own orders would trade with each other. Units traded with the
+   manager per minute are reported, with the orders the exchange rejected and
+   the profit, cash and widgets valued at MID
+2. The reactive session with the manager buying, where the first private
+   order DSBot sends after LOSE_AT seconds never reaches the exchange. The
+   units of that leg are hedging until it times out and then is lost,
+   LOST_TIMEOUT seconds after it was sent, when they are to hedge again
+3. The market making session with the manager buying at prices off the
+   public market's tick. Each public leg must be ranked at the price it was
+   sent at, rounded to the tick
+4. Cost of one reactive strategy pass with NUM_REQUESTS manager orders
+   resting and a public book it can't profitably trade with
+
+Run from this directory: python bench_managers.py
+"""
+import timeit
+
+from fmclient import Order, OrderSide
+
+from synthetic import clear_markets, load_dsbot, make_book_order, \
+    make_holding, make_market
+from common.exchange import LocalExchange, MANAGER_CODE
+from common.order_manager import LOST_TIMEOUT, ORDER_TIMEOUT
+
+SESSION_TIME = 300
+MID = 500
+ORDER_RATE = 20
+REQUEST_INTERVAL = 15
+REQUEST_UNITS = 3
+CONCURRENT = (1, 4)
+CASH = 10 ** 6
+UNITS = 300
+NUM_REQUESTS = (1, 10, 100, 1000)
+LOSE_AT = 60
+NUM_CALLS = 2000
+
+
+def session(dsbot, bot_type, side, concurrent, lose=False, off_tick=0):
+    """
+    :param off_tick: cents added to every manager price
+    :return        : (units traded with the manager, units asked for, orders
+                        rejected, profit in cents, units lost, units of the
+                        side hedging once the lost leg timed out and once it
+                        was lost, public legs ranked at another price than
+                        they were sent at)
+    """
+    exchange = LocalExchange(seed=0)
+    widget = exchange.add_market("widget", min_price=5, max_price=1000,
+                                 price_tick=5)
+    private = exchange.add_market("private", private=True, min_price=5,
+                                  max_price=1000,
+                                  price_tick=1 if off_tick else 5)
+    traders = [exchange.add_account(cash=10 ** 9, units={"widget": 10 ** 6})
+               for _ in range(10)]
+
+    bot = dsbot.DSBot("bench", "bench@local", "", 1, bot_type)
+    bot._logger.setLevel("ERROR")
+    code = exchange.connect(bot, cash=CASH,
+                            units={"widget": UNITS, "private": UNITS})
+
+    rejected = []
+    order_rejected = bot.order_rejected
+
+    def count_rejected(info, order):
+        rejected.append(order)
+        order_rejected(info, order)
+
+    bot.order_rejected = count_rejected
+
+    hedging = []
+
+    def check_hedging():
+        # expiring as the bot's next check would
+        bot._orders.in_flight()
+        hedging.append(bot._managers.side(side == OrderSide.BUY).hedging)
+
+    bot._orders._clock = lambda: exchange.time
+    lost = []
+    leg_prices = {}
+    mispriced = []
+    send_order = bot.send_order
+    leg_sent = bot._managers.sent
+
+    def recorded_leg_sent(ref, is_buy, is_private, price, units):
+        if not is_private:
+            leg_prices[ref] = price
+        leg_sent(ref, is_buy, is_private, price, units)
+
+    bot._managers.sent = recorded_leg_sent
+
+    def lossy_send_order(order):
+        if leg_prices.get(order.ref, order.price) != order.price:
+            mispriced.append(order.ref)
+        if lose and not lost and exchange.time >= LOSE_AT and \
+                order.market.fm_id == private.fm_id:
+            lost.append(order.units)
+            for delay in (ORDER_TIMEOUT, LOST_TIMEOUT):
+                exchange.call_at(exchange.time + delay + 1, check_hedging)
+            return
+        send_order(order)
+
+    bot.send_order = lossy_send_order
+
+    rng = exchange.random
+    asked = [0]
+
+    def flow():
+        exchange.submit(rng.choice(traders), widget,
+                        rng.choice((OrderSide.BUY, OrderSide.SELL)),
+                        MID + 5 * rng.randint(-10, 10), 1)
+        exchange.call_at(exchange.time + 1 / ORDER_RATE, flow)
+
+    def requests():
+        for _ in range(concurrent):
+            if side == OrderSide.BUY:
+                price = MID + 5 * rng.randint(3, 8)
+            else:
+                price = MID - 5 * rng.randint(3, 8)
+            exchange.submit(MANAGER_CODE, private, side, price + off_tick,
+                            REQUEST_UNITS, None, code)
+            asked[0] += REQUEST_UNITS
+        exchange.call_at(exchange.time + REQUEST_INTERVAL, requests)
+
+    exchange.call_at(0.5, flow)
+    exchange.call_at(1, requests)
+    exchange.start()
+    exchange.run(SESSION_TIME)
+    exchange.stop()
+
+    traded = sum(units for _, market_id, _, units, buyer, seller
+                 in exchange.trades if market_id == private.fm_id)
+    cash = widgets = 0
+    for _, market_id, price, units, buyer, seller in exchange.trades:
+        if code not in (buyer, seller):
+            continue
+        sign = 1 if buyer == code else -1
+        cash -= sign * price * units
+        widgets += sign * units
+    return traded, asked[0], len(rejected), cash + widgets * MID, \
+        sum(lost), hedging, len(mispriced)
+
+
+def pass_cost(dsbot, num_requests):
+    """
+    :return: microseconds per reactive strategy pass
+    """
+    clear_markets()
+    Order.clear_all()
+    widget = make_market(1, "widget")
+    private = make_market(2, "private", private=True)
+    bot = dsbot.DSBot("bench", "bench@local", "", 1, dsbot.BotType.REACTIVE)
+    bot._logger.setLevel("WARNING")
+    bot.initialised()
+    bot.received_holdings(make_holding([widget, private],
+                                       {"widget": 5, "private": 5}, 10000))
+
+    def send_order(order):
+        raise AssertionError(f"Benchmark book is profitable: {order}")
+    bot.send_order = send_order
+
+    book = [make_book_order(1, widget, OrderSide.BUY, 400),
+            make_book_order(2, widget, OrderSide.SELL, 600)]
+    for i in range(num_requests):
+        side = OrderSide.BUY if i % 2 else OrderSide.SELL
+        price = 500 + (5 if i % 2 else -5) * (i % 10)
+        book.append(make_book_order(10 + i, private, side, price, units=2,
+                                    owner_target="M000"))
+    bot.received_orders(book)
+    bot._session_is_open = True
+    assert len(bot._managers) == num_requests
+
+    elapsed = timeit.timeit(bot._react_to_market, number=NUM_CALLS)
+    return elapsed / NUM_CALLS * 1e6
+
+
+def main():
+    dsbot = load_dsbot()
+    minutes = SESSION_TIME / 60
+    for bot_type in (dsbot.BotType.REACTIVE, dsbot.BotType.MARKET_MAKER):
+        for side in (OrderSide.BUY, OrderSide.SELL):
+            for concurrent in CONCURRENT:
+                traded, asked, rejected, profit, _, _, _ = session(
+                    dsbot, bot_type, side, concurrent)
+                print(f"{bot_type.name:<12} manager {side.name:<4} "
+                      f"{concurrent} at a time: {traded / minutes:>5.1f} "
+                      f"units/min ({traded:>3} of {asked} asked), "
+                      f"{rejected} rejected, profit {profit}")
+                assert rejected == 0
+
+    traded, asked, rejected, profit, lost, hedging, _ = session(
+        dsbot, dsbot.BotType.REACTIVE, OrderSide.BUY, 1, lose=True)
+    print(f"private leg of {lost} units lost at {LOSE_AT} s: "
+          f"{traded / minutes:>5.1f} units/min ({traded:>3} of {asked} "
+          f"asked), {hedging[0]} units hedging once it timed out, "
+          f"{hedging[1]} once it was lost")
+    assert lost > 0 and hedging == [lost, 0]
+
+    traded, asked, rejected, profit, _, _, mispriced = session(
+        dsbot, dsbot.BotType.MARKET_MAKER, OrderSide.BUY, 4, off_tick=2)
+    print(f"manager prices off the tick: {traded / minutes:>5.1f} units/min "
+          f"({traded:>3} of {asked} asked), {rejected} rejected, "
+          f"{mispriced} legs ranked at another price than sent")
+    assert rejected == 0 and mispriced == 0
+
+    for num_requests in NUM_REQUESTS:
+        print(f"{num_requests:>5} requests resting: "
+              f"{pass_cost(dsbot, num_requests):>6.1f} us per reactive pass")
+
+
+if __name__ == "__main__":
+    main()
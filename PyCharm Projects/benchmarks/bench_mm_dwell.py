@@ -0,0 +1,122 @@
+"""
+Measures how late order update callbacks are delivered while CAPMBot's
+market maker quotes dwell in the book, for the previous blocking
+time.sleep(MM_STALL_TIME) and the continuation scheduled on the event loop.
+Also checks the dwell ends as soon as one of our quotes is hit.
+
+Run from this directory: python bench_mm_dwell.py
+"""
+import asyncio
+import time
+
+import numpy as np
+from fmclient import Order
+
+from synthetic import make_capm_bot
+from CAPMBot import BotType, MM_STALL_TIME
+
+UPDATE_INTERVAL = 0.05
+RUN_TIME = MM_STALL_TIME + 0.5
+
+# non blocking dwell must deliver every update within this many seconds
+MAX_LATENESS = 0.05
+
+
+def legacy_tick(bot):
+    """
+    Market maker tick as it was, stalling inside the periodic callback
+    """
+    time.sleep(MM_STALL_TIME)
+    bot._run_strategy_cycle()
+
+
+def make_bot(loop):
+    bot, _ = make_capm_bot()
+    bot._loop = loop
+    bot.send_order = lambda order: None
+    bot.is_session_active = lambda: True
+    bot._bot_type = BotType.MARKET_MAKER
+
+    # remember when each strategy cycle runs
+    bot.cycle_times = []
+    run_strategy_cycle = bot._run_strategy_cycle
+
+    def timed_cycle():
+        bot.cycle_times.append(time.perf_counter())
+        run_strategy_cycle()
+
+    bot._run_strategy_cycle = timed_cycle
+    return bot
+
+
+def measure_lateness(tick):
+    """
+    Starts a market maker tick, and schedules order updates every
+    UPDATE_INTERVAL seconds that record how late they are delivered
+    :return: array of lateness in seconds
+    """
+    loop = asyncio.new_event_loop()
+    bot = make_bot(loop)
+    lateness = []
+    start = time.perf_counter()
+
+    def deliver(due):
+        lateness.append(time.perf_counter() - due)
+        bot.received_orders([])
+
+    loop.call_soon(tick, bot)
+    for i in range(1, int(RUN_TIME / UPDATE_INTERVAL)):
+        loop.call_at(loop.time() + i * UPDATE_INTERVAL, deliver,
+                     start + i * UPDATE_INTERVAL)
+
+    loop.run_until_complete(asyncio.sleep(RUN_TIME))
+    loop.close()
+    return np.array(lateness)
+
+
+def measure_hit_to_cycle(hit_after=0.3):
+    """
+    Hits one of our quotes part way through the dwell
+    :return: seconds from the hit to the next strategy cycle
+    """
+    loop = asyncio.new_event_loop()
+    bot = make_bot(loop)
+    market = bot._registry.markets[0]
+    hit_time = []
+
+    def hit_quote():
+        Order(900002, {"id": 900002, "type": "LIMIT", "consumer": 900001})
+        quote = Order(900001, {"id": 900001, "type": "LIMIT", "mine": True,
+                               "consumer": 900002, "side": "BUY",
+                               "units": 1, "price": 400,
+                               "marketId": market.fm_id})
+        hit_time.append(time.perf_counter())
+        bot.received_orders([quote])
+
+    loop.call_soon(bot._execute_appropriate_strategy)
+    loop.call_later(hit_after, hit_quote)
+    loop.run_until_complete(asyncio.sleep(hit_after + 0.1))
+    loop.close()
+    return bot.cycle_times[0] - hit_time[0]
+
+
+def main():
+    legacy = measure_lateness(legacy_tick)
+    scheduled = measure_lateness(
+        lambda bot: bot._execute_appropriate_strategy())
+
+    print(f"{'dwell':>10} {'updates':>8} {'p50 (ms)':>9} {'max (ms)':>9}")
+    for name, lateness in (("sleep", legacy), ("scheduled", scheduled)):
+        print(f"{name:>10} {len(lateness):>8} "
+              f"{np.percentile(lateness, 50) * 1e3:>9.2f} "
+              f"{lateness.max() * 1e3:>9.2f}")
+
+    hit_to_cycle = measure_hit_to_cycle()
+    print(f"quote hit to next cycle: {hit_to_cycle * 1e3:.2f} ms")
+
+    assert scheduled.max() < MAX_LATENESS
+    assert hit_to_cycle < MAX_LATENESS
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark of the depth aware reactive optimiser against an exhaustive search
+over every combination of units, on random multi-level books
+
+Reports how close the optimiser gets to the best possible performance and
+how long it takes per book.
+
+Run from this directory: python bench_optimiser.py
+"""
+import itertools
+import random
+import time
+
+import numpy as np
+
+from synthetic import make_capm_bot
+from optimiser import optimise_fills
+
+NUM_BOOKS = 200
+MAX_LEVELS = 3
+MAX_UNITS_PER_LEVEL = 2
+TIME_BUDGET = 0.005
+CENTS_IN_DOLLAR = 100
+
+
+def random_book(rng, fair_values):
+    """
+    A ladder of bids and asks around each security's expected payoff,
+    sometimes crossing it so there are profitable trades
+    """
+    bids, asks = [], []
+    for value in fair_values:
+        mid = int(value) + rng.randrange(-150, 151, 5)
+        bids.append([(mid - 5 * (level + 1), rng.randint(1, MAX_UNITS_PER_LEVEL))
+                     for level in range(rng.randint(0, MAX_LEVELS))])
+        asks.append([(mid + 5 * (level + 1), rng.randint(1, MAX_UNITS_PER_LEVEL))
+                     for level in range(rng.randint(0, MAX_LEVELS))])
+    return bids, asks
+
+
+def unit_prices(levels):
+    return [price for price, units in levels for _ in range(units)]
+
+
+def exhaustive_gain(bot, bids, asks):
+    """
+    Best change in performance over every possible change in units
+    """
+    engine = bot._variance_engine
+    ranges = []
+    for i in range(len(bids)):
+        max_sells = min(len(unit_prices(bids[i])),
+                        int(bot._ledger.sellable[i]))
+        ranges.append(range(-max(max_sells, 0),
+                            len(unit_prices(asks[i])) + 1))
+
+    best = 0.0
+    for delta in itertools.product(*ranges):
+        cash, spent = 0, 0
+        for i, d in enumerate(delta):
+            if d > 0:
+                spent += sum(unit_prices(asks[i])[:d])
+            else:
+                cash += sum(unit_prices(bids[i])[:-d])
+        if spent > bot._ledger.cash_available:
+            continue
+        delta = np.array(delta, dtype=float)
+        gain = delta.dot(engine.expected_payoffs) + \
+            (cash - spent) / CENTS_IN_DOLLAR - bot._risk_penalty * \
+            (engine.trade_variance(delta) - engine.variance)
+        best = max(best, gain)
+    return best
+
+
+def main():
+    rng = random.Random(0)
+    bot, _ = make_capm_bot(units={"a": 2, "b": 2, "c": 2, "note": 2},
+                           cash=3000)
+    fair_values = bot._variance_engine.expected_payoffs * CENTS_IN_DOLLAR
+
+    ratios, times = [], []
+    for _ in range(NUM_BOOKS):
+        bids, asks = random_book(rng, fair_values)
+
+        start = time.perf_counter()
+        fills, gain = optimise_fills(
+            bot._variance_engine, bids, asks, bot._ledger.cash_available,
+            bot._ledger.sellable,
+            bot._risk_penalty, TIME_BUDGET)
+        times.append(time.perf_counter() - start)
+
+        best = exhaustive_gain(bot, bids, asks)
+        assert gain <= best + 1e-9
+        ratios.append(1.0 if best <= 1e-9 else gain / best)
+
+    times = np.array(times) * 1e3
+    print(f"books                 : {NUM_BOOKS}")
+    print(f"optimal found         : {np.mean(np.isclose(ratios, 1)):.1%}")
+    print(f"mean share of optimum : {np.mean(ratios):.1%}")
+    print(f"worst share of optimum: {np.min(ratios):.1%}")
+    print(f"time per book (ms)    : mean {times.mean():.3f}, "
+          f"max {times.max():.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""
+Order manager overhead, and a CAPMBot that loses an order on the local
+exchange
+
+1. Cost per order of following it through the manager: sent, accepted,
+   echoed resting, then echoed filled
+2. An event driven CAPMBot trades on the local exchange for SESSION_TIME
+   seconds, and the first order it sends after LOSE_AT seconds never reaches
+   the exchange, as if the request was lost. With one flag for every order
+   in flight the bot would stop trading until the session is reset; with
+   the manager only that order's market waits, for ORDER_TIMEOUT seconds.
+   Its cash or units stay reserved until it is lost, LOST_TIMEOUT seconds
+   after it was sent, and not for the rest of the session. The manager runs
+   on the exchange's virtual clock here
+3. The same session with no order lost, and with more orders in flight
+   allowed per market
+4. Orders of ours cancelled by the exchange, not by a cancel we sent: each
+   must end CANCELLED with nothing filled, its reservation released and no
+   fill reported
+
+In every session no market may have more than max_in_flight orders in
+flight, cancels included, even within one batch.
+
+Run from this directory: python bench_order_manager.py
+"""
+import time
+
+from fmclient import Order, OrderSide, OrderType
+
+from synthetic import CAPM_PAYOFFS, make_market
+from CAPMBot import CAPMBot
+from common.exchange import LocalExchange
+from common.ledger import Ledger
+from common.order_manager import LOST_TIMEOUT, ORDER_TIMEOUT, OrderManager, \
+    OrderState
+
+NUM_ORDERS = 50000
+SESSION_TIME = 60
+LOSE_AT = 10
+ORDER_RATE = 100
+
+
+def overhead():
+    """
+    :return: nanoseconds per order followed through the manager
+    """
+    Order.clear_all()
+    market = make_market(1, "widget")
+    manager = OrderManager(max_in_flight=NUM_ORDERS)
+
+    sent = []
+    for i in range(NUM_ORDERS):
+        order = Order.create_new()
+        order.market = market
+        order.order_side = OrderSide.BUY
+        order.order_type = OrderType.LIMIT
+        order.price = 500
+        order.units = 1
+        order.ref = f"Order {i} - SM"
+        sent.append(order)
+
+    # as FlexeMarkets accepts and echoes them, then trades them with
+    # another trader's sell orders
+    def echo(fm_id, consumer=None, mine=True):
+        return Order(fm_id, {
+            "id": fm_id, "type": "LIMIT", "side": "BUY" if mine else "SELL",
+            "units": 1, "price": 500, "marketId": market.fm_id, "mine": mine,
+            "original": fm_id, "consumer": consumer,
+            "clientDescription": f"Order {fm_id - 1} - SM" if mine else None,
+            "ownerTarget": None})
+
+    fm_ids = range(1, NUM_ORDERS + 1)
+    resting = [echo(fm_id) for fm_id in fm_ids]
+    for fm_id in fm_ids:
+        echo(NUM_ORDERS + fm_id, consumer=fm_id, mine=False)
+
+    start = time.perf_counter_ns()
+    for order in sent:
+        manager.sent(order)
+    for order in resting:
+        manager.accepted(order)
+        manager.update([order])
+    elapsed = time.perf_counter_ns() - start
+
+    filled = [echo(fm_id, consumer=NUM_ORDERS + fm_id) for fm_id in fm_ids]
+    start = time.perf_counter_ns()
+    manager.update(filled)
+    elapsed += time.perf_counter_ns() - start
+
+    assert manager.summary()["FILLED"] == NUM_ORDERS
+
+    # the same trades echoed again, as when the session re-sends its orders
+    manager.update(filled)
+    assert all(manager.get(order.ref).filled_units == 1 for order in sent)
+    return elapsed / NUM_ORDERS
+
+
+def cancelled_by_others(num_orders=10):
+    """
+    :return: (summary of the order manager, units filled, fills reported,
+                reservations left)
+    """
+    Order.clear_all()
+    market = make_market(1, "widget")
+    ledger = Ledger([market.fm_id])
+    fills = []
+    manager = OrderManager(max_in_flight=num_orders, ledger=ledger,
+                           on_fill=lambda managed, units: fills.append(units))
+
+    def echo(fm_id, order_type="LIMIT", consumer=None, mine=True):
+        return Order(fm_id, {
+            "id": fm_id, "type": order_type, "side": "BUY", "units": 1,
+            "price": 500, "marketId": market.fm_id, "mine": mine,
+            "original": fm_id, "consumer": consumer,
+            "clientDescription": f"Order {fm_id} - SM" if mine else None,
+            "ownerTarget": None})
+
+    for fm_id in range(1, num_orders + 1):
+        order = Order.create_new()
+        order.market = market
+        order.order_side = OrderSide.BUY
+        order.order_type = OrderType.LIMIT
+        order.price = 500
+        order.units = 1
+        order.ref = f"Order {fm_id} - SM"
+        manager.sent(order)
+        resting = echo(fm_id)
+        manager.accepted(resting)
+        manager.update([resting])
+
+    # the exchange's cancels, e.g. as the session closes
+    cancels = [echo(num_orders + fm_id, "CANCEL", consumer=num_orders + fm_id,
+                    mine=False) for fm_id in range(1, num_orders + 1)]
+    cancelled = [echo(fm_id, consumer=num_orders + fm_id)
+                 for fm_id in range(1, num_orders + 1)]
+    manager.update(cancels + cancelled)
+
+    filled_units = sum(manager.get(f"Order {fm_id} - SM").filled_units
+                       for fm_id in range(1, num_orders + 1))
+    return manager.summary(), filled_units, len(fills), len(ledger)
+
+
+def session(lose=False, max_in_flight=1):
+    """
+    :return: (summary of the order manager, orders sent after LOSE_AT,
+                orders lost, trades, most orders a market had in flight,
+                True for each of a timeout and a loss later if the lost
+                order was still reserved)
+    """
+    exchange = LocalExchange(seed=0)
+    markets = [exchange.add_market(item, ",".join(str(p) for p in payoff),
+                                   min_price=5, price_tick=5)
+               for item, payoff in CAPM_PAYOFFS.items()]
+    traders = [exchange.add_account(cash=10 ** 9,
+                                    units={m.item: 10 ** 6 for m in markets})
+               for _ in range(20)]
+
+    bot = CAPMBot("bench", "bench@local", "", 1, event_driven=True,
+                  max_in_flight=max_in_flight)
+    bot._logger.setLevel("ERROR")
+    code = exchange.connect(bot, cash=20000, units={m.item: 5 for m in markets},
+                            short_units=5)
+    bot._orders._clock = lambda: exchange.time
+
+    counts = {"after": 0, "lost": 0, "in_flight": 0}
+    lost_refs = []
+    reserved = []
+    send_order = bot.send_order
+
+    def lossy_send_order(order):
+        # the manager has just been told of the order
+        counts["in_flight"] = max(counts["in_flight"],
+                                  bot._orders.in_flight(order.market.fm_id))
+        if exchange.time >= LOSE_AT:
+            if lose and counts["lost"] == 0:
+                counts["lost"] += 1
+                lost_refs.append(order.ref)
+                return
+            counts["after"] += 1
+        send_order(order)
+
+    bot.send_order = lossy_send_order
+
+    rng = exchange.random
+    mids = {market: sum(CAPM_PAYOFFS[market.item]) // 4 // 5 * 5
+            for market in markets}
+
+    def flow():
+        market = rng.choice(markets)
+        exchange.submit(rng.choice(traders), market,
+                        rng.choice((OrderSide.BUY, OrderSide.SELL)),
+                        max(mids[market] + 5 * rng.randint(-8, 8), 5), 1)
+        exchange.call_at(exchange.time + 1 / ORDER_RATE, flow)
+
+    def check_reserved():
+        # expiring as the bot's next check would
+        bot._orders.in_flight()
+        managed = lost_refs and bot._orders.get(lost_refs[0])
+        reserved.append(managed in bot._ledger._reservations)
+
+    exchange.call_at(0.5, flow)
+    for delay in (ORDER_TIMEOUT, LOST_TIMEOUT):
+        exchange.call_at(LOSE_AT + delay + 1, check_reserved)
+    exchange.start()
+    exchange.run(SESSION_TIME)
+    # before the session closes and the manager is reset
+    summary = bot._orders.summary()
+    exchange.stop()
+
+    trades = sum(1 for trade in exchange.trades if code in trade[4:])
+    assert counts["in_flight"] <= max_in_flight
+    return summary, counts["after"], counts["lost"], trades, \
+        counts["in_flight"], reserved
+
+
+def main():
+    print(f"overhead per order : {overhead():>6.0f} ns "
+          f"(sent, accepted, resting, filled)")
+
+    summary, after, lost, trades, _, reserved = session(lose=True)
+    assert lost == 1 and summary[OrderState.TIMED_OUT.name] == 1
+    assert summary[OrderState.LOST.name] == 1 and reserved == [True, False]
+    assert after > 0
+    print(f"order lost at {LOSE_AT} s  : timed out after {ORDER_TIMEOUT} s, "
+          f"{after} orders sent after it, bot traded {trades} times, "
+          f"reserved until lost after {LOST_TIMEOUT} s")
+
+    _, after, _, trades, in_flight, _ = session()
+    print(f"no order lost      : {after} orders sent after {LOSE_AT} s, "
+          f"bot traded {trades} times, at most {in_flight} in flight "
+          f"per market")
+
+    _, after, _, trades, in_flight, _ = session(max_in_flight=4)
+    print(f"4 in flight/market : {after} orders sent after {LOSE_AT} s, "
+          f"bot traded {trades} times, at most {in_flight} in flight "
+          f"per market")
+
+    summary, filled_units, fills, reserved = cancelled_by_others()
+    print(f"cancelled by others: {summary.get('CANCELLED', 0)} cancelled, "
+          f"{filled_units} units filled, {fills} fills reported, "
+          f"{reserved} reservations left")
+    assert summary.get(OrderState.FILLED.name, 0) == 0
+    assert filled_units == fills == reserved == 0
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Messages sent by the CAPMBot market maker with quote diffing, against
+cancelling every resting order and re-sending every quote each cycle
+
+Orders the bot sends are echoed back through received_orders once the cycle
+is over, as FlexeMarkets would, so they rest in the bot's order book. Every
+few cycles one of our quotes trades and holdings change, which moves the
+reservation prices. After every cycle the resting orders must match the
+quotes the market maker wants, once none of our orders is in flight.
+
+A second run loses the first new quote of cycle LOSE_AT, it is neither echoed
+nor acknowledged. Each cycle is a second on the order manager's clock, so
+the quote times out after ORDER_TIMEOUT cycles and must then be sent again.
+
+Run from this directory: python bench_quotes.py
+"""
+import random
+
+from fmclient import Order, OrderType
+
+from synthetic import make_capm_bot, make_holding
+from CAPMBot import MM_QUOTE_LEVELS
+from common.order_manager import ORDER_TIMEOUT
+
+NUM_CYCLES = 200
+TRADE_EVERY = 10
+LOSE_AT = 50
+
+# most orders a cycle sends in a market, a cancel and a new quote per level
+# on either side
+CYCLE_ORDERS = 4 * MM_QUOTE_LEVELS
+
+
+def desired_quotes(bot):
+    """
+    :return: dictionary of (market id, side, price) to units the market
+                maker wants to rest in the book
+    """
+    quotes = {}
+    for (index, side, _), price in bot._mm_orders.items():
+        market = bot._registry.markets[index]
+        key = (market.fm_id, side, price - price % market.price_tick)
+        quotes[key] = quotes.get(key, 0) + 1
+    return quotes
+
+
+def resting_quotes(bot):
+    """
+    :return: dictionary of (market id, side, price) to units resting
+    """
+    quotes = {}
+    for order in bot._order_book.my_orders():
+        key = (order.market.fm_id, order.order_side, order.price)
+        quotes[key] = quotes.get(key, 0) + order.units
+    return quotes
+
+
+def run(seed=0, lose_at=None):
+    """
+    :param lose_at: cycle whose first new quote is lost, None to lose none
+    :return: (QuoteManager, messages sent, share of quotes keeping their
+                place, cycles until the resting orders matched again)
+    """
+    rng = random.Random(seed)
+    Order.clear_all()
+
+    # every order of a cycle is acknowledged before the next, let them all
+    # be in flight together
+    bot, markets = make_capm_bot(max_in_flight=CYCLE_ORDERS)
+    bot._logger.setLevel("ERROR")
+    bot.is_session_active = lambda: True
+    clock = {"cycle": 0, "lost": None, "matched": None}
+    bot._orders._clock = lambda: clock["cycle"]
+
+    echoes = []
+    sent_orders = []
+    sent = {"orders": 0, "cancels": 0}
+    next_id = [0]
+
+    def new_id():
+        next_id[0] += 1
+        return next_id[0]
+
+    def send_order(order):
+        if clock["cycle"] == lose_at and clock["lost"] is None and \
+                order.order_type != OrderType.CANCEL:
+            clock["lost"] = order.ref
+            return
+
+        sent_orders.append(order)
+        if order.order_type == OrderType.CANCEL:
+            sent["cancels"] += 1
+            # consumed by the cancel, so it isn't taken for a trade
+            cancel_id = new_id()
+            Order(cancel_id, {"id": cancel_id, "type": "CANCEL"})
+            echoes.append(Order(order.fm_id, {"id": order.fm_id,
+                                              "consumer": cancel_id}))
+            return
+
+        sent["orders"] += 1
+        fm_id = new_id()
+        echoes.append(Order(fm_id, {
+            "id": fm_id, "type": "LIMIT", "side": order.order_side.name,
+            "units": order.units, "price": order.price,
+            "marketId": order.market.fm_id, "mine": True, "original": fm_id,
+            "consumer": None, "clientDescription": order.ref}))
+
+    bot.send_order = send_order
+    units = {market.item: 5 for market in markets}
+    kept = 0
+    quoted = 0
+
+    for cycle in range(NUM_CYCLES):
+        clock["cycle"] = cycle
+        if cycle and cycle % TRADE_EVERY == 0:
+            units[rng.choice(markets).item] += rng.choice((-1, 1))
+            bot.received_holdings(make_holding(markets, units, 20000))
+
+        before = {order.fm_id for order in bot._order_book.my_orders()}
+        bot._run_strategy_cycle()
+
+        bot.received_orders(echoes)
+        echoes.clear()
+        for order in sent_orders:
+            bot.order_accepted(order)
+        sent_orders.clear()
+        if bot._orders.in_flight() == 0:
+            assert resting_quotes(bot) == desired_quotes(bot)
+            if lose_at is not None and cycle > lose_at and \
+                    clock["matched"] is None:
+                clock["matched"] = cycle - lose_at
+
+        after = {order.fm_id for order in bot._order_book.my_orders()}
+        kept += len(before & after)
+        quoted += len(after)
+
+    return bot._quotes, sent, kept / max(quoted, 1), clock["matched"]
+
+
+def main():
+    quotes, sent, kept, _ = run()
+    replace_all = quotes.messages_sent + quotes.messages_saved
+
+    print(f"cycles                   : {NUM_CYCLES}")
+    print(f"messages, cancel-all     : {replace_all}")
+    print(f"messages, diffing        : {quotes.messages_sent} "
+          f"({sent['orders']} orders, {sent['cancels']} cancels)")
+    print(f"messages saved           : {quotes.messages_saved} "
+          f"({quotes.messages_saved / replace_all:.1%})")
+    print(f"quotes keeping priority  : {kept:.1%}")
+
+    _, _, _, matched = run(lose_at=LOSE_AT)
+    assert matched is not None
+    print(f"quote lost at cycle {LOSE_AT}   : resting orders match again "
+          f"{matched} cycles later (order timeout {ORDER_TIMEOUT} s)")
+
+
+if __name__ == "__main__":
+    main()
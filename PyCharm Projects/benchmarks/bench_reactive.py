@@ -0,0 +1,100 @@
+"""
+Benchmark of the reactive strategy's order set search: the previous per-set
+Python loop over itertools.combinations against the batch evaluator
+
+The book is priced so no set is profitable, which is the usual steady state
+and forces both paths to look at every set.
+
+Run from this directory: python bench_reactive.py
+"""
+import itertools
+import random
+import time
+
+from fmclient import Order, OrderSide, OrderType
+
+from legacy_capm import enough_assets, potential_performance
+from synthetic import make_capm_bot
+from CAPMBot import MAX_ORDER_SET_SECURITIES
+
+# beyond MAX_ORDER_SET_SECURITIES the bot no longer enumerates order sets
+NUM_SECURITIES = range(2, MAX_ORDER_SET_SECURITIES + 1, 2)
+MAX_LEGACY_SECURITIES = 8
+
+
+def legacy_search(bot, orders):
+    """
+    Order set search as it was before batch evaluation, one set at a time
+    :return: first profitable order set found, or None
+    """
+    for i in range(1, len(orders) + 1):
+        for order_set in itertools.combinations(orders, i):
+            if len({order.market for order in order_set}) != len(order_set):
+                continue
+            order_set = list(order_set)
+            if enough_assets(bot, order_set) and \
+                    potential_performance(bot, order_set) > \
+                    bot._aggressiveness_param * bot._current_performance:
+                return order_set
+    return None
+
+
+def make_order(market, side, price):
+    order = Order.create_new(market)
+    order.order_side = side
+    order.order_type = OrderType.LIMIT
+    order.price = price
+    order.units = 1
+    return order
+
+
+def time_call(func, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1e3
+
+
+def main():
+    rng = random.Random(0)
+
+    print(f"{'securities':>10} {'sets':>8} {'legacy (ms)':>12} "
+          f"{'batch (ms)':>11}")
+    for num_securities in NUM_SECURITIES:
+        payoffs = {f"s{i}": [rng.randrange(0, 1001, 50) for _ in range(4)]
+                   for i in range(num_securities)}
+        bot, markets = make_capm_bot(payoffs)
+
+        # bids far below and asks far above any sensible valuation
+        bids = [make_order(market, OrderSide.BUY, 5) for market in markets]
+        asks = [make_order(market, OrderSide.SELL, 1000)
+                for market in markets]
+
+        batch = time_call(lambda: bot._find_profitable_order_set(bids, asks))
+        assert bot._find_profitable_order_set(bids, asks) is None
+
+        if num_securities <= MAX_LEGACY_SECURITIES:
+            legacy = time_call(lambda: legacy_search(bot, bids + asks),
+                               repeat=1)
+            legacy = f"{legacy:>12.2f}"
+        else:
+            legacy = f"{'-':>12}"
+
+        num_sets = len(bot._order_set_choices)
+        print(f"{num_securities:>10} {num_sets:>8} {legacy} {batch:>11.3f}")
+
+    # with a mispriced book both paths trade, with the same number of orders
+    bot, markets = make_capm_bot()
+    bids = [make_order(market, OrderSide.BUY, 900) for market in markets]
+    asks = [make_order(market, OrderSide.SELL, 1000) for market in markets]
+    batch_set = bot._find_profitable_order_set(bids, asks)
+    legacy_set = legacy_search(bot, bids + asks)
+    assert len(batch_set) == len(legacy_set)
+    assert potential_performance(bot, batch_set) >= \
+        potential_performance(bot, legacy_set)
+
+
+if __name__ == "__main__":
+    main()
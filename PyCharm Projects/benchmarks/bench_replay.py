@@ -0,0 +1,107 @@
+"""
+Replays the recorded FirstBot and DSBot logs into an unmodified DSBot
+
+1. Parses every log in 1. firstBot/logs and 2. assignment_1/logs
+2. Replays every recorded run with both of the DSBot's markets into a
+   reactive and a market making DSBot as fast as possible, and reports the
+   messages per second the bot handled and how much faster than the
+   recordings the replay ran
+3. Replays the busiest run twice, which must send the same orders
+4. Replays a short run on the wall clock at REAL_TIME_SPEED times the
+   recorded speed, which must take about its duration / REAL_TIME_SPEED
+
+Run from this directory: python bench_replay.py
+"""
+import glob
+import os
+import time
+
+from synthetic import PROJECTS_DIR, load_dsbot
+from common.replay import LogReplay, read_log
+
+LOG_DIRS = ("1. firstBot", "2. assignment_1")
+CASH = 100000
+REAL_TIME_SPEED = 20
+
+
+def read_logs():
+    """
+    :return: every recording, and the number of log lines read
+    """
+    recordings = []
+    num_lines = 0
+    for directory in LOG_DIRS:
+        for path in sorted(glob.glob(os.path.join(PROJECTS_DIR, directory,
+                                                  "logs", "*.log"))):
+            with open(path, encoding="utf-8", errors="replace") as log:
+                num_lines += sum(1 for _ in log)
+            recordings += read_log(path, cash=CASH)
+    return recordings, num_lines
+
+
+def has_private_market(recording):
+    # the DSBot needs both of its markets, which early runs didn't print
+    return any(private for _, _, private in recording.markets.values())
+
+
+def replay(dsbot, recording, bot_type, speed=None):
+    """
+    :return: the finished LogReplay and the wall clock seconds it took
+    """
+    bot = dsbot.DSBot("bench", "bench@local", "", 1, bot_type)
+    bot._logger.setLevel("WARNING")
+    log_replay = LogReplay(recording, speed=speed)
+    log_replay.connect(bot)
+
+    start = time.perf_counter()
+    log_replay.run()
+    return log_replay, time.perf_counter() - start
+
+
+def main():
+    dsbot = load_dsbot()
+
+    start = time.perf_counter()
+    recordings, num_lines = read_logs()
+    elapsed = time.perf_counter() - start
+    print(f"parsed        : {num_lines} lines in {elapsed:.3f} s, "
+          f"{len(recordings)} runs, "
+          f"{sum(len(recording) for recording in recordings)} messages, "
+          f"{sum(r.num_orders for r in recordings)} orders")
+    recordings = [recording for recording in recordings
+                  if has_private_market(recording)]
+
+    for bot_type in (dsbot.BotType.REACTIVE, dsbot.BotType.MARKET_MAKER):
+        num_events = num_sent = 0
+        recorded = elapsed = 0.0
+        for recording in recordings:
+            log_replay, seconds = replay(dsbot, recording, bot_type)
+            num_events += log_replay.num_events
+            num_sent += len(log_replay.sent)
+            recorded += recording.duration
+            elapsed += seconds
+        print(f"{bot_type.name:<14}: {num_events / elapsed:>9,.0f} "
+              f"order/holding/session events/s, {recorded:,.0f} s "
+              f"recorded in {elapsed:.2f} s, {num_sent} orders sent")
+
+    busiest = max(recordings, key=lambda recording: recording.num_orders)
+    first, _ = replay(dsbot, busiest, dsbot.BotType.MARKET_MAKER)
+    second, _ = replay(dsbot, busiest, dsbot.BotType.MARKET_MAKER)
+    assert [(when, str(order)) for when, order in first.sent] == \
+        [(when, str(order)) for when, order in second.sent]
+    print(f"determinism   : {busiest} replayed twice, same "
+          f"{len(first.sent)} orders at the same times")
+
+    short = min((recording for recording in recordings
+                 if recording.duration > 5),
+                key=lambda recording: recording.duration)
+    _, elapsed = replay(dsbot, short, dsbot.BotType.REACTIVE,
+                        speed=REAL_TIME_SPEED)
+    expected = (short.duration + 1) / REAL_TIME_SPEED
+    assert abs(elapsed - expected) < 0.2 * expected
+    print(f"real time x{REAL_TIME_SPEED:<3}: {short} replayed in "
+          f"{elapsed:.2f} s, expected {expected:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Market maker quote pricing: the previous path, which simulated a quasi order
+through potential_performance for every security and side, against the
+reservation price table that is built once per holdings change
+
+Also checks that every level of the table is the change in performance of
+trading one more unit, as found with the full performance formula.
+
+Run from this directory: python bench_reservation.py
+"""
+import random
+import timeit
+
+import numpy as np
+from fmclient import Order, OrderSide
+
+from legacy_capm import potential_performance
+from synthetic import make_capm_bot
+
+NUM_SECURITIES = (4, 16, 64)
+NUM_STATES = 4
+NUM_CALLS = 200
+
+
+def legacy_quote_prices(bot):
+    """
+    One unit quote prices as the market maker found them before the table
+    :return: dictionary of (security index, side WE take) to price in cents
+    """
+    prices = {}
+    order = Order.create_new()
+    order.price = 0
+    for index, market in enumerate(bot._registry.markets):
+        order.market = market
+        for side, our_side in ((OrderSide.BUY, OrderSide.SELL),
+                               (OrderSide.SELL, OrderSide.BUY)):
+            order.order_side = side
+            performance = potential_performance(bot, [order])
+            prices[(index, our_side)] = int(
+                100 * abs(bot._current_performance - performance))
+    return prices
+
+
+def check_levels(bot, levels):
+    """
+    The k-th buy (sell) price is the performance gained (lost) by the k-th
+    unit bought (sold) for nothing
+    """
+    engine = bot._variance_engine
+    buys, sells = engine.reservation_prices(bot._risk_penalty, levels)
+
+    def performance(units):
+        return engine.expected_payoffs.dot(units) - \
+            bot._risk_penalty * engine.portfolio_variance(units)
+
+    for index in range(len(bot._registry)):
+        for k in range(1, levels + 1):
+            step = np.zeros(len(bot._registry))
+            step[index] = 1
+            bought = performance(engine.units + k * step) - \
+                performance(engine.units + (k - 1) * step)
+            sold = performance(engine.units - (k - 1) * step) - \
+                performance(engine.units - k * step)
+            assert abs(bought - buys[index, k - 1]) < 1e-9
+            assert abs(sold - sells[index, k - 1]) < 1e-9
+
+
+def main():
+    rng = random.Random(0)
+
+    print(f"{'securities':>10} {'legacy (us)':>12} {'build (us)':>11} "
+          f"{'lookup (us)':>12}")
+    for num_securities in NUM_SECURITIES:
+        payoffs = {f"s{i}": [rng.randrange(0, 1001, 50)
+                             for _ in range(NUM_STATES)]
+                   for i in range(num_securities)}
+        bot, markets = make_capm_bot(payoffs)
+        bot._logger.setLevel("WARNING")
+
+        check_levels(bot, bot._quote_levels)
+
+        # level 1 of the table is the price the market maker used to quote
+        legacy = legacy_quote_prices(bot)
+        buys, sells = bot._get_reservation_prices()
+        for index in range(num_securities):
+            assert abs(legacy[(index, OrderSide.BUY)] -
+                       int(100 * buys[index, 0])) <= 1
+            assert abs(legacy[(index, OrderSide.SELL)] -
+                       int(100 * sells[index, 0])) <= 1
+
+        legacy = timeit.timeit(lambda: legacy_quote_prices(bot),
+                               number=NUM_CALLS) / NUM_CALLS * 1e6
+
+        def build():
+            bot._reservation_prices = None
+            return bot._get_reservation_prices()
+
+        built = timeit.timeit(build, number=NUM_CALLS) / NUM_CALLS * 1e6
+        lookup = timeit.timeit(bot._get_reservation_prices,
+                               number=NUM_CALLS) / NUM_CALLS * 1e6
+        print(f"{num_securities:>10} {legacy:>12.1f} {built:>11.1f} "
+              f"{lookup:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
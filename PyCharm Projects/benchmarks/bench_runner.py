@@ -0,0 +1,187 @@
+"""
+Memory and CPU per bot, NUM_BOTS DSBots run one per process, sharded over a
+few processes and all in one process with common.runner
+
+Every bot runs on the wall clock through fmclient's own order and message
+tasks, fed as FlexeMarkets would feed it: a public order every
+1 / ORDER_RATE seconds and a manager order every REQUEST_INTERVAL seconds
+arrive on its incoming message queue, and the orders it sends are accepted
+and echoed back to rest in the book, but never trade. Nothing goes over the
+network, the login and websockets are left out.
+
+Processes are spawned, so each imports fmclient and the bots itself, as a
+script per bot would. Reported per bot: proportional set size (memory shared
+between processes split among them) midway through the run, CPU used to
+start up, and CPU used while running as a share of one core.
+
+Run from this directory: python bench_runner.py
+"""
+import asyncio
+import itertools
+import os
+import resource
+import time
+
+from fmclient import Order, OrderSide
+from fmclient.fmio.net.fmapi.ws.client import IncomingMessageType
+
+from synthetic import load_dsbot, make_market
+from common.runner import BotRunner, BotSpec, start_shards
+
+NUM_BOTS = 8
+LAYOUTS = (NUM_BOTS, 2, 1)
+STARTUP = 5
+MEASURE = 10
+ORDER_RATE = 5
+REQUEST_INTERVAL = 5
+MID = 500
+CASH = 10 ** 6
+UNITS = 300
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def make_dsbot(bot_type):
+    """
+    Factory of the bots, importable by the spawned processes
+    """
+    dsbot = load_dsbot()
+    bot = dsbot.DSBot("bench", "bench@local", "", 1, dsbot.BotType[bot_type])
+    bot._logger.setLevel("ERROR")
+    return bot
+
+
+def holding_json(markets):
+    return {"cash": CASH, "availableCash": CASH, "initialCash": CASH,
+            "assets": [{"units": UNITS, "availableUnits": UNITS,
+                        "initialUnits": UNITS, "initialShortUnits": 0,
+                        "market": {"id": market.fm_id},
+                        "grant": {"canBuy": True, "canSell": True,
+                                  "units": 0, "shortUnits": 0}}
+                       for market in markets]}
+
+
+def order_json(fm_id, market, side, price, mine=False, target=None,
+               ref=None):
+    return {"id": fm_id, "type": "LIMIT", "side": side.name, "units": 1,
+            "price": price, "marketId": market.fm_id, "mine": mine,
+            "original": fm_id, "consumer": None, "clientDescription": ref,
+            "ownerTarget": target}
+
+
+class LocalFeedRunner(BotRunner):
+    """
+    BotRunner whose bots are fed locally instead of logging in
+    """
+
+    def _initialise(self, agent):
+        agent._loop = self.loop
+        agent._outgoing_order_queue = asyncio.Queue()
+        agent._incoming_message_queue = asyncio.Queue()
+        agent._enable_ws_comm = False
+
+        markets = [make_market(1, "widget"),
+                   make_market(2, "private", private=True)]
+        agent._safely_call_method(agent.initialised)
+        agent._initialised = True
+        agent._safely_call_method(agent.pre_start_tasks)
+
+        incoming = agent._incoming_message_queue
+        fm_ids = itertools.count(1)
+
+        def send_order(order):
+            fm_id = next(fm_ids)
+            json = order_json(fm_id, order.market, order.order_side,
+                              order.price, True,
+                              order.owner_or_target, order.ref)
+            json["units"] = order.units
+            if order.order_type.name == "CANCEL":
+                json["id"] = json["original"] = order.fm_id
+                json["type"] = "CANCEL"
+            self.loop.call_soon(agent._safely_call_method,
+                                lambda: agent.order_accepted(Order(fm_id, json)))
+            incoming.put_nowait({IncomingMessageType.ORDERS_UPDATE: [json]})
+
+        agent.send_order = send_order
+        incoming.put_nowait({IncomingMessageType.SESSION_UPDATE:
+                             {"id": 1, "state": "OPEN"}})
+        incoming.put_nowait({IncomingMessageType.HOLDING_UPDATE:
+                             holding_json(markets)})
+        self.loop.create_task(self._feed(agent, markets, fm_ids))
+        return True
+
+    async def _feed(self, agent, markets, fm_ids):
+        widget, private = markets
+        started = self.loop.time()
+        next_request = started
+        num_requests = 0
+        while self.loop.time() - started < STARTUP + MEASURE + 2:
+            side = OrderSide.BUY if next(fm_ids) % 2 else OrderSide.SELL
+            price = MID + 5 * (next(fm_ids) % 21 - 10)
+            jsons = [order_json(next(fm_ids), widget, side, price)]
+            if self.loop.time() >= next_request:
+                if num_requests % 2 == 0:
+                    side, price = OrderSide.BUY, MID + 30
+                else:
+                    side, price = OrderSide.SELL, MID - 30
+                jsons.append(order_json(next(fm_ids), private, side, price,
+                                        target="M000"))
+                num_requests += 1
+                next_request += REQUEST_INTERVAL
+            agent._incoming_message_queue.put_nowait(
+                {IncomingMessageType.ORDERS_UPDATE: jsons})
+            await asyncio.sleep(1 / ORDER_RATE)
+        agent._stop = True
+
+
+def process_sample(pid):
+    """
+    :return: (CPU seconds used, proportional set size in MB) of a process
+    """
+    with open(f"/proc/{pid}/stat") as stat:
+        fields = stat.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    with open(f"/proc/{pid}/smaps_rollup") as smaps:
+        pss = next(int(line.split()[1]) for line in smaps
+                   if line.startswith("Pss:"))
+    return cpu, pss / 1024
+
+
+def layout(num_processes):
+    """
+    :return: (MB per bot, startup CPU seconds per bot, running CPU share of a
+                core per bot)
+    """
+    specs = [BotSpec(make_dsbot, "REACTIVE" if i % 2 else "MARKET_MAKER")
+             for i in range(NUM_BOTS)]
+    processes = start_shards(specs, num_processes, LocalFeedRunner)
+
+    time.sleep(STARTUP)
+    started = [process_sample(process.pid) for process in processes]
+    time.sleep(MEASURE)
+    ended = [process_sample(process.pid) for process in processes]
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    memory = sum(pss for _, pss in ended)
+    startup_cpu = sum(cpu for cpu, _ in started)
+    running_cpu = sum(end - start for (end, _), (start, _)
+                      in zip(ended, started))
+    return (memory / NUM_BOTS, startup_cpu / NUM_BOTS,
+            running_cpu / MEASURE / NUM_BOTS)
+
+
+def main():
+    print(f"{NUM_BOTS} DSBots, {ORDER_RATE} order updates/s each")
+    for num_processes in LAYOUTS:
+        memory, startup_cpu, running_cpu = layout(num_processes)
+        print(f"  {num_processes} process{'es' if num_processes > 1 else '  '}: "
+              f"{memory:>6.1f} MB per bot, {startup_cpu:>5.2f} s CPU per bot "
+              f"to start, {running_cpu * 100:>5.2f}% of a core per bot "
+              f"running")
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    print(f"all runs: {usage.ru_utime + usage.ru_stime:.1f} s CPU")
+
+
+if __name__ == "__main__":
+    main()
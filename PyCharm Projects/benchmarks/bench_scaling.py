@@ -0,0 +1,91 @@
+"""
+Per-tick cost of a CAPMBot strategy cycle as the number of securities grows
+
+Every tick one order update arrives through received_orders, then a full
+strategy cycle (cancel, reactive, market maker) runs against a book with
+several price levels on both sides of every market. Orders the bot sends
+are dropped, so the book stays the same shape from tick to tick.
+
+Run from this directory: python bench_scaling.py
+"""
+import logging
+import random
+import time
+
+import numpy as np
+from fmclient import Order
+
+from synthetic import make_capm_bot
+
+NUM_SECURITIES = (4, 16, 64)
+NUM_STATES = 4
+NUM_LEVELS = 5
+NUM_TICKS = 200
+
+
+def order_json(fm_id, market, side, price, units=1):
+    return {"id": fm_id, "type": "LIMIT", "side": side, "units": units,
+            "price": price, "marketId": market.fm_id, "mine": False,
+            "original": fm_id, "consumer": None}
+
+
+def run(num_securities, depth_aware, seed=0):
+    """
+    :return: array of per-tick times in seconds
+    """
+    rng = random.Random(seed)
+    Order.clear_all()
+
+    # the last security is the note, so selling notes has something to sell
+    payoffs = {f"s{i}": [rng.randrange(0, 1001, 50)
+                         for _ in range(NUM_STATES)]
+               for i in range(num_securities - 1)}
+    payoffs["note"] = [500] * NUM_STATES
+    bot, markets = make_capm_bot(payoffs, depth_aware=depth_aware)
+    bot.is_session_active = lambda: True
+    bot.send_order = lambda order: None
+
+    # the per-cycle log lines would otherwise dominate the timings
+    bot._logger.setLevel(logging.WARNING)
+
+    next_id = [0]
+
+    def new_order(market):
+        next_id[0] += 1
+        mid = int(np.mean(payoffs[market.item])) // 5 * 5
+        side = rng.choice(("BUY", "SELL"))
+        offset = 5 * rng.randrange(1, 20)
+        price = mid - offset if side == "BUY" else mid + offset
+        price = min(max(price, 5), 1000)
+        return Order(next_id[0], order_json(next_id[0], market, side, price,
+                                            rng.randrange(1, 4)))
+
+    bot.received_orders([new_order(market) for market in markets
+                         for _ in range(2 * NUM_LEVELS)])
+
+    times = []
+    for _ in range(NUM_TICKS):
+        start = time.perf_counter()
+        bot.received_orders([new_order(rng.choice(markets))])
+        bot._run_strategy_cycle()
+        times.append(time.perf_counter() - start)
+
+        # sent orders are never acknowledged here
+        bot._orders.reset()
+
+    return np.array(times)
+
+
+def main():
+    print(f"{'securities':>10} {'mode':>12} {'mean (ms)':>10} "
+          f"{'p99 (ms)':>9}")
+    for num_securities in NUM_SECURITIES:
+        for depth_aware in (False, True):
+            times = run(num_securities, depth_aware) * 1e3
+            mode = "depth" if depth_aware else "top of book"
+            print(f"{num_securities:>10} {mode:>12} {times.mean():>10.3f} "
+                  f"{np.percentile(times, 99):>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
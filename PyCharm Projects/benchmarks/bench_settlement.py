@@ -0,0 +1,130 @@
+"""
+DSBot settling widgets with the manager as each public order trades, or in
+one private order per manager order with batch_settlement
+
+A reactive and a market making DSBot trade on the local exchange, in a
+public market with random one unit orders around MID, while every
+REQUEST_INTERVAL seconds the manager sends it a private order of
+REQUEST_UNITS units, buys above MID and sells below it in turn. Reported:
+units traded with the manager, the private orders sent for them and the
+units each carried, the exchange time a widget was held from its public
+trade to the private order, and the profit, cash and widgets valued at MID.
+
+Run from this directory: python bench_settlement.py
+"""
+from collections import deque
+
+import numpy as np
+from fmclient import OrderSide
+
+from bench_hedge import public_fills
+from synthetic import load_dsbot
+from common.exchange import LocalExchange, MANAGER_CODE
+
+SESSION_TIME = 300
+MID = 500
+ORDER_RATE = 20
+REQUEST_INTERVAL = 10
+REQUEST_UNITS = (1, 5, 10)
+CASH = 10 ** 6
+UNITS = 300
+
+
+def session(dsbot, bot_type, request_units, batch_settlement):
+    """
+    :return: (units traded with the manager, private orders sent, array of
+                held milliseconds per unit, profit in cents)
+    """
+    exchange = LocalExchange(seed=0)
+    widget = exchange.add_market("widget", min_price=5, max_price=1000,
+                                 price_tick=5)
+    private = exchange.add_market("private", private=True, min_price=5,
+                                  max_price=1000, price_tick=5)
+    traders = [exchange.add_account(cash=10 ** 9, units={"widget": 10 ** 6})
+               for _ in range(10)]
+
+    bot = dsbot.DSBot("bench", "bench@local", "", 1, bot_type,
+                      batch_settlement=batch_settlement)
+    bot._logger.setLevel("ERROR")
+    code = exchange.connect(bot, cash=CASH,
+                            units={"widget": UNITS, "private": UNITS})
+
+    # exchange time of every unit traded publicly and not settled yet
+    unsettled = deque()
+    held = []
+    private_orders = [0]
+    on_orders_update = bot._on_orders_update
+
+    def timed_orders_update(jsons):
+        for _ in range(public_fills(jsons, widget.fm_id)):
+            unsettled.append(exchange.time)
+        on_orders_update(jsons)
+
+    bot._on_orders_update = timed_orders_update
+    send_order = bot.send_order
+
+    def counted_send_order(order):
+        if order.market.fm_id == private.fm_id:
+            private_orders[0] += 1
+            for _ in range(min(order.units, len(unsettled))):
+                held.append((exchange.time - unsettled.popleft()) * 1000)
+        send_order(order)
+
+    bot.send_order = counted_send_order
+
+    rng = exchange.random
+    num_requests = [0]
+
+    def flow():
+        exchange.submit(rng.choice(traders), widget,
+                        rng.choice((OrderSide.BUY, OrderSide.SELL)),
+                        MID + 5 * rng.randint(-10, 10), 1)
+        exchange.call_at(exchange.time + 1 / ORDER_RATE, flow)
+
+    def request():
+        # one side resting at a time, the manager's orders would trade
+        # with each other
+        if not exchange.resting_orders(MANAGER_CODE):
+            if num_requests[0] % 2 == 0:
+                side, price = OrderSide.BUY, MID + 5 * rng.randint(3, 8)
+            else:
+                side, price = OrderSide.SELL, MID - 5 * rng.randint(3, 8)
+            exchange.submit(MANAGER_CODE, private, side, price,
+                            request_units, None, code)
+            num_requests[0] += 1
+        exchange.call_at(exchange.time + REQUEST_INTERVAL, request)
+
+    exchange.call_at(0.5, flow)
+    exchange.call_at(1, request)
+    exchange.start()
+    exchange.run(SESSION_TIME)
+    exchange.stop()
+
+    traded = sum(units for _, market_id, _, units, buyer, seller
+                 in exchange.trades if market_id == private.fm_id)
+    cash = widgets = 0
+    for _, market_id, price, units, buyer, seller in exchange.trades:
+        if code not in (buyer, seller):
+            continue
+        sign = 1 if buyer == code else -1
+        cash -= sign * price * units
+        widgets += sign * units
+    return traded, private_orders[0], np.array(held), cash + widgets * MID
+
+
+def main():
+    dsbot = load_dsbot()
+    for bot_type in (dsbot.BotType.REACTIVE, dsbot.BotType.MARKET_MAKER):
+        for request_units in REQUEST_UNITS:
+            for batch_settlement in (False, True):
+                traded, orders, held, profit = session(
+                    dsbot, bot_type, request_units, batch_settlement)
+                mode = "batched" if batch_settlement else "per fill"
+                print(f"{bot_type.name:<12} {request_units:>2} unit requests "
+                      f"{mode:<8}: {traded:>3} units in {orders:>3} private "
+                      f"orders ({traded / max(orders, 1):>4.1f} each), held "
+                      f"{held.mean():>6.0f} ms on average, profit {profit}")
+
+
+if __name__ == "__main__":
+    main()
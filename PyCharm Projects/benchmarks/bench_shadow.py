@@ -0,0 +1,178 @@
+"""
+Shadow portfolio: cost of applying a fill against recomputing the holdings,
+and a CAPMBot whose holdings arrive late
+
+1. One of our orders traded, applied to the shadow portfolio with
+   _apply_fill, against received_holdings recomputing everything from the
+   new holdings, for NUM_SECURITIES securities. Both must end with the same
+   variance, expected return and performance, and the holdings must then
+   reconcile without drift
+2. An event driven CAPMBot trades on the local exchange, which delivers its
+   holdings HOLDINGS_DELAY seconds after the order updates. Strategy passes
+   that ran with fills the holdings didn't show yet would have decided on
+   stale numbers without the shadow portfolio; holdings that drifted from it
+   are counted
+3. The same session with the holdings delivered before the order updates
+   that caused them, and every order update delivered twice. No holdings
+   may drift, and the shadow must end on the exchange's units and cash
+
+Run from this directory: python bench_shadow.py
+"""
+import random
+import timeit
+from collections import deque
+
+import numpy as np
+from fmclient import OrderSide
+
+from synthetic import CAPM_PAYOFFS, make_book_order, make_capm_bot, \
+    make_holding
+from CAPMBot import CAPMBot
+from common.exchange import LocalExchange
+
+NUM_SECURITIES = (4, 16, 64)
+NUM_STATES = 4
+NUM_CALLS = 2000
+SESSION_TIME = 60
+HOLDINGS_DELAY = 0.25
+ORDER_RATE = 100
+
+
+def fill_cost(num_securities):
+    """
+    :return: (microseconds per fill applied, per holdings recomputed)
+    """
+    rng = random.Random(num_securities)
+    payoffs = {f"s{i}": [rng.randrange(0, 1001, 50) for _ in range(NUM_STATES)]
+               for i in range(num_securities)}
+    units = {item: 5 for item in payoffs}
+    bot, markets = make_capm_bot(payoffs, units=units, cash=20000)
+
+    # our resting buy of one unit of the first security traded at 400
+    fill = make_book_order(10 ** 6, markets[0], OrderSide.BUY, 400, mine=True,
+                           consumer=10 ** 6 + 1)
+    bot._apply_fill(fill)
+    shadow = (bot._current_port_variance, bot._current_exp_return,
+              bot._current_performance)
+
+    units[markets[0].item] += 1
+    holding = make_holding(markets, units, 20000 - 400)
+    bot.received_holdings(holding)
+    recomputed = (bot._current_port_variance, bot._current_exp_return,
+                  bot._current_performance)
+    assert np.allclose(shadow, recomputed)
+    assert bot._shadow.summary()["drifted"] == 0
+
+    def apply():
+        bot._apply_fill(fill)
+        bot._shadow._pending = {}
+        bot._shadow._fill_ids.clear()
+
+    applied = timeit.timeit(apply, number=NUM_CALLS)
+    received = timeit.timeit(lambda: bot.received_holdings(holding),
+                             number=NUM_CALLS)
+    return applied / NUM_CALLS * 1e6, received / NUM_CALLS * 1e6
+
+
+def session(holdings_delay=HOLDINGS_DELAY, holdings_first=False,
+            repeat_updates=False):
+    """
+    :return: (strategy passes, passes ahead of the holdings, shadow summary,
+                trades, True if the shadow ended on the exchange's holdings)
+    """
+    exchange = LocalExchange(seed=0, holdings_first=holdings_first)
+    markets = [exchange.add_market(item, ",".join(str(p) for p in payoff),
+                                   min_price=5, price_tick=5)
+               for item, payoff in CAPM_PAYOFFS.items()]
+    traders = [exchange.add_account(cash=10 ** 9,
+                                    units={m.item: 10 ** 6 for m in markets})
+               for _ in range(20)]
+
+    bot = CAPMBot("bench", "bench@local", "", 1, event_driven=True)
+    bot._logger.setLevel("ERROR")
+    code = exchange.connect(bot, cash=20000, units={m.item: 5 for m in markets},
+                            short_units=5)
+    bot._orders._clock = lambda: exchange.time
+
+    on_holding_update = bot._on_holding_update
+    late = deque()
+
+    # in the order they were sent, timers due at the same time may run in
+    # any order
+    def late_holding_update(json):
+        late.append(json)
+        exchange.loop.call_later(holdings_delay,
+                                 lambda: on_holding_update(late.popleft()))
+
+    if holdings_delay:
+        bot._on_holding_update = late_holding_update
+
+    on_orders_update = bot._on_orders_update
+
+    def repeated_orders_update(jsons):
+        on_orders_update(jsons)
+        on_orders_update(jsons)
+
+    if repeat_updates:
+        bot._on_orders_update = repeated_orders_update
+
+    passes = {"all": 0, "ahead": 0}
+    run_strategy_cycle = bot._run_strategy_cycle
+
+    def counted_strategy_cycle():
+        passes["all"] += 1
+        if bot._shadow._pending:
+            passes["ahead"] += 1
+        run_strategy_cycle()
+
+    bot._run_strategy_cycle = counted_strategy_cycle
+
+    rng = exchange.random
+    mids = {market: sum(CAPM_PAYOFFS[market.item]) // 4 // 5 * 5
+            for market in markets}
+
+    def flow():
+        market = rng.choice(markets)
+        exchange.submit(rng.choice(traders), market,
+                        rng.choice((OrderSide.BUY, OrderSide.SELL)),
+                        max(mids[market] + 5 * rng.randint(-8, 8), 5), 1)
+        exchange.call_at(exchange.time + 1 / ORDER_RATE, flow)
+
+    exchange.call_at(0.5, flow)
+    exchange.start()
+    exchange.run(SESSION_TIME + holdings_delay)
+    summary = bot._shadow.summary()
+    account = exchange._accounts[code]
+    in_step = bot._shadow.cash == account.cash and np.array_equal(
+        bot._shadow.units,
+        [account.units[market.fm_id] for market in bot._registry.markets])
+    exchange.stop()
+
+    trades = sum(1 for trade in exchange.trades if code in trade[4:])
+    return passes["all"], passes["ahead"], summary, trades, in_step
+
+
+def main():
+    print("securities  apply fill (us)  received_holdings (us)")
+    for num_securities in NUM_SECURITIES:
+        applied, received = fill_cost(num_securities)
+        print(f"{num_securities:>10}  {applied:>15.1f}  {received:>22.1f}")
+
+    passes, ahead, summary, trades, _ = session()
+    print(f"holdings {HOLDINGS_DELAY} s late: {ahead} of {passes} strategy "
+          f"passes ran ahead of the holdings, bot traded {trades} times")
+    print(f"shadow portfolio    : {summary['fills']} fills, "
+          f"{summary['drifted']} of {summary['holdings']} holdings drifted")
+    assert summary["drifted"] == 0
+
+    _, _, summary, trades, in_step = session(
+        holdings_delay=0, holdings_first=True, repeat_updates=True)
+    print(f"holdings first, updates twice: bot traded {trades} times, "
+          f"{summary['fills']} fills, {summary['drifted']} of "
+          f"{summary['holdings']} holdings drifted, shadow "
+          f"{'on' if in_step else 'off'} the exchange's holdings")
+    assert summary["drifted"] == 0 and in_step
+
+
+if __name__ == "__main__":
+    main()
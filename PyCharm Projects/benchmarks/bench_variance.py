@@ -0,0 +1,90 @@
+"""
+Benchmark of potential_performance on the variance engine against the
+previous path, which rebuilt the covariance matrix with np.cov for every
+candidate order set
+
+Run from this directory: python bench_variance.py
+"""
+import itertools
+import timeit
+
+import numpy as np
+from fmclient import Order, OrderSide, OrderType
+
+from legacy_capm import potential_performance
+from synthetic import make_capm_bot
+
+CENTS_IN_DOLLAR = 100
+NUM_CALLS = 2000
+
+
+def legacy_potential_performance(bot, orders):
+    """
+    potential_performance as it was before the variance engine
+    """
+    cash = bot._cash_settled
+    units = bot._asset_units.copy()
+
+    for order in orders:
+        index = bot._registry.index(order.market)
+        if order.order_side == OrderSide.BUY:
+            cash += order.price
+            units[index] -= 1
+        else:
+            cash -= order.price
+            units[index] += 1
+
+    x = list(units)
+    payoffs = bot._registry.payoffs.tolist()
+
+    weights = np.array(x)
+    covar_matrix = np.dot(1 / (CENTS_IN_DOLLAR ** 2),
+                          np.cov(payoffs, bias=True))
+    variance = np.dot(np.dot(weights, covar_matrix), weights.transpose())
+
+    exp_return = (sum(np.dot(np.dot(1 / (len(payoffs)), x), payoffs)) +
+                  cash) / CENTS_IN_DOLLAR
+
+    return exp_return - bot._risk_penalty * variance
+
+
+def make_order(market, side, price):
+    order = Order.create_new(market)
+    order.order_side = side
+    order.order_type = OrderType.LIMIT
+    order.price = price
+    order.units = 1
+    return order
+
+
+def main():
+    bot, markets = make_capm_bot()
+
+    # best bid and ask in every market, as the reactive strategy sees them
+    book = [make_order(market, side, 300 if side == OrderSide.BUY else 400)
+            for market in markets for side in (OrderSide.BUY, OrderSide.SELL)]
+    candidates = [list(c) for size in (1, 2, 4)
+                  for c in itertools.combinations(book, size)
+                  if len({o.market for o in c}) == size]
+
+    # both paths must agree before comparing their speed
+    for orders in candidates:
+        assert abs(legacy_potential_performance(bot, orders) -
+                   potential_performance(bot, orders)) < 1e-9
+
+    print(f"{'orders':>8} {'legacy (us)':>12} {'engine (us)':>12} "
+          f"{'speedup':>8}")
+    for size in (1, 2, 4):
+        orders = next(c for c in candidates if len(c) == size)
+        legacy = timeit.timeit(
+            lambda: legacy_potential_performance(bot, orders),
+            number=NUM_CALLS) / NUM_CALLS * 1e6
+        engine = timeit.timeit(
+            lambda: potential_performance(bot, orders),
+            number=NUM_CALLS) / NUM_CALLS * 1e6
+        print(f"{size:>8} {legacy:>12.2f} {engine:>12.2f} "
+              f"{legacy / engine:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Monte Carlo simulators of the warmup exercises, one Python loop iteration per
+trial as they were against numpy chunks of trials, in this process and over
+a process pool
+
+1. Each simulator, old and new, at LOOP_TRIALS trials: time per trial, and
+   the estimate against the exact probability
+2. The new simulators at each of NUM_TRIALS trials, in this process and over
+   os.cpu_count() processes, which must give the same estimate for a seed
+
+Run from this directory: python bench_warmup.py
+"""
+import importlib
+import math
+import os
+import random
+import sys
+import time
+
+from synthetic import PROJECTS_DIR
+
+NUM_PEOPLE = 23
+NUM_DOORS = 100
+LOOP_TRIALS = 10 ** 5
+NUM_TRIALS = (10 ** 6, 10 ** 7, 10 ** 8)
+
+
+def load_warmup():
+    """
+    :return: the warmup exercises module, imported by name from its directory
+                so the pool's processes can import it too
+    """
+    sys.path.insert(0, os.path.join(PROJECTS_DIR, "0. fnce30010", "warmup"))
+    return importlib.import_module("main")
+
+
+def legacy_birthday_sharing_probability(num_people, num_trials):
+    """
+    birthday_sharing_probability as it was, one trial per loop iteration
+    """
+    num_matches = 0
+    for _ in range(num_trials):
+        matches = {}
+        for _ in range(num_people):
+            birthdate = random.randint(1, 366)
+            if birthdate in matches:
+                num_matches += 1
+                break
+            matches[birthdate] = 0
+    return num_matches / num_trials
+
+
+def legacy_monty_hall_strategy(warmup, num_doors, switch, num_trials):
+    """
+    monty_hall_strategy as it was, one monty_hall_simulation per trial
+    """
+    wins = 0
+    for _ in range(num_trials):
+        wins += warmup.monty_hall_simulation(num_doors, switch)
+    return wins / num_trials
+
+
+def exact_birthday(num_people):
+    return 1 - math.prod((366 - k) / 366 for k in range(num_people))
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    warmup = load_warmup()
+    cases = {
+        "birthday": (exact_birthday(NUM_PEOPLE),
+                     lambda trials: legacy_birthday_sharing_probability(
+                         NUM_PEOPLE, trials),
+                     lambda trials, **kwargs:
+                     warmup.birthday_sharing_probability(NUM_PEOPLE, trials,
+                                                         **kwargs)),
+        "monty hall": (1 - 1 / NUM_DOORS,
+                       lambda trials: legacy_monty_hall_strategy(
+                           warmup, NUM_DOORS, True, trials),
+                       lambda trials, **kwargs: warmup.monty_hall_strategy(
+                           NUM_DOORS, True, trials, **kwargs)),
+    }
+
+    print(f"{LOOP_TRIALS} trials, {NUM_PEOPLE} people and {NUM_DOORS} doors "
+          f"switching")
+    for name, (exact, legacy, batched) in cases.items():
+        for label, simulate in (("loop", legacy), ("numpy", batched)):
+            estimate, elapsed = timed(simulate, LOOP_TRIALS)
+            print(f"  {name:<10} {label:<5}: {elapsed / LOOP_TRIALS * 1e9:>8.0f} "
+                  f"ns/trial, {estimate:.4f} against {exact:.4f}")
+
+    processes = os.cpu_count()
+    print(f"\nnumpy, in this process and over {processes} processes")
+    for name, (exact, _, batched) in cases.items():
+        for num_trials in NUM_TRIALS:
+            here, here_time = timed(batched, num_trials, seed=0)
+            pooled, pool_time = timed(batched, num_trials, seed=0,
+                                      processes=processes)
+            assert here == pooled
+            print(f"  {name:<10} {num_trials:>11,} trials: "
+                  f"{here_time:>6.2f} s here, {pool_time:>6.2f} s pooled, "
+                  f"{here:.5f} against {exact:.5f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+CAPMBot's checks of one order set at a time, as the bot made them before it
+evaluated every set at once, kept as the baseline the benchmarks compare the
+batch paths with
+
+Both take the bot, and read its ledger, variance engine and performance the
+way the methods did.
+"""
+from typing import List
+
+import numpy as np
+from fmclient import Order, OrderSide
+
+
+def potential_performance(bot, orders: List[Order]):
+    """
+    Returns the portfolio performance if the given list of orders is
+    executed. The performance as per the following formula: Performance
+    = ExpectedPayoff - b * PayoffVariance, where b is the penalty for
+    risk.
+    :param bot         : CAPMBot with holdings
+    :param orders      : list of orders to be simulated on portfolio
+    :return performance: percentage increase in portfolio performance
+    """
+
+    cash = bot._cash_settled
+    delta = np.zeros(len(bot._registry))
+
+    # simulate list of orders executing
+    for order in orders:
+        index = bot._registry.index(order.market)
+
+        # for a buy order that exists in the market, we sell to it
+        if order.order_side == OrderSide.BUY:
+            cash += order.price
+            delta[index] -= 1
+
+        # for a sell order, we buy from it
+        else:
+            cash -= order.price
+            delta[index] += 1
+
+    # variance as a change from the current holdings
+    variance = bot._variance_engine.trade_variance(delta)
+
+    performance = bot._portfolio_performance(
+        bot._get_expected_return(bot._variance_engine.units + delta, cash),
+        bot._risk_penalty,
+        variance)
+
+    return performance
+
+
+def enough_assets(bot, orders: List[Order]):
+    """
+    Received orders are the orders in the market! so for a buy order,
+    we sell to it, and for a sell order, we buy from it
+    :param bot   : CAPMBot with holdings
+    :param orders: Order set received
+    :return      : True if there are enough assets to execute each order
+                    in the order set received
+    """
+    # orders are the PRESENT orders in the market, we buy 1 unit from
+    # each sell order and sell 1 unit to each buy order
+    return bot._ledger.fits(
+        [bot._registry.index(order.market) for order in orders],
+        [order.order_side == OrderSide.SELL for order in orders],
+        [order.price for order in orders],
+        np.ones(len(orders), dtype=int))
@@ -0,0 +1,278 @@
+"""
+Benchmark suite for the code the bots run on every tick, saved as JSON so
+runs can be compared
+
+Every case builds its bot and order book from synthetic fmclient objects,
+without a server, then times one call of a hot path:
+
+    capm.get_potential_performance      one order per security, the
+                                        legacy_capm path
+    capm.reactive_strategy[N orders]    N top of book orders, priced so
+                                        nothing trades, the steady state
+    capm.get_best_bid_ask[N historical] N traded orders in the Order
+                                        registry besides the live book
+    dsbot.get_order_book_state          with a manager order and a public
+    dsbot.react_to_market               book that isn't profitable
+
+Each case is timed like timeit: a batch of calls long enough to measure,
+repeated, keeping the per call minimum, median and mean.
+
+Run from this directory:
+    python suite.py                       results/<time>-<commit>.json
+    python suite.py --output run.json
+    python suite.py --compare base.json   also flags cases that slowed down
+    python suite.py --filter dsbot        only cases whose name contains it
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+from fmclient import Order, OrderSide
+
+from legacy_capm import potential_performance
+from synthetic import (PROJECTS_DIR, clear_markets, load_dsbot,
+                       make_book_order, make_capm_bot, make_holding,
+                       make_market)
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "results")
+REACTIVE_ORDERS = (8, 16, 32, 64)
+HISTORICAL_ORDERS = (1000, 10000, 100000)
+DSBOT_HISTORICAL_ORDERS = 10000
+DSBOT_BOOK_DEPTH = 20
+
+MIN_BATCH_TIME = 0.2
+REPEAT = 5
+REGRESSION_RATIO = 1.2
+
+
+def add_historical_orders(markets, count, first_id):
+    """
+    Fills the Order registry with orders that have already traded, as a
+    long session leaves behind
+    """
+    for i in range(count):
+        fm_id = first_id + 2 * i
+        make_book_order(fm_id, markets[i % len(markets)],
+                        OrderSide.BUY if i % 2 else OrderSide.SELL,
+                        500, consumer=fm_id + 1)
+
+
+def capm_bot(num_securities):
+    """
+    :return: CAPMBot of the given number of securities, its markets, and
+                a book of one bid and one ask per market nothing trades with
+    """
+    Order.clear_all()
+    rng = random.Random(num_securities)
+    payoffs = {f"s{i}": [rng.randrange(0, 1001, 50) for _ in range(4)]
+               for i in range(num_securities)}
+    bot, markets = make_capm_bot(payoffs)
+
+    book = []
+    for i, market in enumerate(markets):
+        book.append(make_book_order(2 * i + 1, market, OrderSide.BUY, 5))
+        book.append(make_book_order(2 * i + 2, market, OrderSide.SELL, 1000))
+    bot._order_book.update(book)
+    return bot, markets
+
+
+def capm_potential_performance():
+    bot, markets = capm_bot(4)
+    orders = [make_book_order(100 + i, market,
+                              OrderSide.BUY if i % 2 else OrderSide.SELL, 500)
+              for i, market in enumerate(markets)]
+    return lambda: potential_performance(bot, orders)
+
+
+def capm_reactive_strategy(num_orders):
+    bot, _ = capm_bot(num_orders // 2)
+
+    def run():
+        assert bot._reactive_strategy()
+    return run
+
+
+def capm_best_bid_ask(num_historical):
+    bot, markets = capm_bot(4)
+    add_historical_orders(markets, num_historical, 1000)
+    return bot._get_best_bid_ask
+
+
+def dsbot():
+    """
+    :return: an initialised DSBot in an open session, with a manager buy
+                order and a public book it can't profitably trade with
+    """
+    module = load_dsbot()
+    clear_markets()
+    Order.clear_all()
+    widget = make_market(1, "widget")
+    private = make_market(2, "private", private=True)
+
+    bot = module.DSBot("bench", "bench@local", "", 1, module.BotType.REACTIVE)
+    bot.initialised()
+    bot.received_holdings(make_holding([widget, private],
+                                       {"widget": 5, "private": 5}, 10000))
+
+    def send_order(order):
+        raise AssertionError(f"Benchmark book is profitable: {order}")
+    bot.send_order = send_order
+
+    add_historical_orders([widget], DSBOT_HISTORICAL_ORDERS, 1000)
+    book = [make_book_order(1, private, OrderSide.BUY, 500,
+                            owner_target="M000")]
+    for level in range(DSBOT_BOOK_DEPTH):
+        book.append(make_book_order(10 + 2 * level, widget, OrderSide.BUY,
+                                    400 - 5 * level))
+        book.append(make_book_order(11 + 2 * level, widget, OrderSide.SELL,
+                                    600 + 5 * level))
+    # received before the session opens, so no strategy runs yet
+    bot.received_orders(book)
+    bot._session_is_open = True
+    return bot
+
+
+def dsbot_order_book_state():
+    return dsbot()._get_order_book_state
+
+
+def dsbot_react_to_market():
+    return dsbot()._react_to_market
+
+
+def cases():
+    """
+    :return: list of (name, function that sets up the case and returns the
+                call to time)
+    """
+    found = [("capm.get_potential_performance", capm_potential_performance)]
+    found += [(f"capm.reactive_strategy[{n} orders]",
+               lambda n=n: capm_reactive_strategy(n))
+              for n in REACTIVE_ORDERS]
+    found += [(f"capm.get_best_bid_ask[{n} historical]",
+               lambda n=n: capm_best_bid_ask(n))
+              for n in HISTORICAL_ORDERS]
+    found += [("dsbot.get_order_book_state", dsbot_order_book_state),
+              ("dsbot.react_to_market", dsbot_react_to_market)]
+    return found
+
+
+def time_case(call):
+    """
+    :return: dictionary of per call timings in microseconds
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            call()
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_BATCH_TIME:
+            break
+        number *= 2 if elapsed <= 0 else \
+            max(2, min(10, int(MIN_BATCH_TIME / elapsed) + 1))
+
+    timings = [elapsed / number]
+    for _ in range(REPEAT - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            call()
+        timings.append((time.perf_counter() - start) / number)
+
+    return {"min_us": min(timings) * 1e6,
+            "median_us": statistics.median(timings) * 1e6,
+            "mean_us": statistics.mean(timings) * 1e6,
+            "number": number, "repeat": REPEAT}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PROJECTS_DIR,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """
+    Prints the change of every case against a baseline run
+    :return: names of the cases slower than REGRESSION_RATIO times baseline
+    """
+    regressions = []
+    print(f"\n{'case':<40} {'baseline':>10} {'now':>10} {'ratio':>7}")
+    for name, timing in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"{name:<40} {'-':>10} {timing['min_us']:>10.1f}")
+            continue
+        ratio = timing["min_us"] / before["min_us"]
+        flag = ""
+        if ratio > REGRESSION_RATIO:
+            regressions.append(name)
+            flag = "  slower"
+        print(f"{name:<40} {before['min_us']:>10.1f} "
+              f"{timing['min_us']:>10.1f} {ratio:>7.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--output", help="JSON file to write the results to")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="JSON results of a previous run")
+    parser.add_argument("--filter", default="",
+                        help="only run cases whose name contains this")
+    args = parser.parse_args()
+
+    # the bots inform() as they are set up and traded
+    logging.disable(logging.INFO)
+
+    commit = git_commit()
+    results = {}
+    print(f"{'case':<40} {'min (us)':>10} {'median':>10} {'calls':>8}")
+    for name, setup in cases():
+        if args.filter not in name:
+            continue
+        timing = time_case(setup())
+        results[name] = timing
+        print(f"{name:<40} {timing['min_us']:>10.1f} "
+              f"{timing['median_us']:>10.1f} {timing['number']:>8}")
+
+    created = datetime.datetime.now()
+    run = {
+        "created": created.isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "results": results,
+    }
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(
+            RESULTS_DIR, f"{created:%Y%m%d-%H%M%S}-{commit or 'unknown'}.json")
+    with open(output, "w") as file:
+        json.dump(run, file, indent=2)
+    print(f"\nresults written to {output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,401 @@
+"""
+Parameter sweep of the bots' hand-set constants on the local exchange
+
+Every configuration, some of a bot's parameters set, trades one simulated
+session per seed against scripted order flow on a LocalExchange:
+
+    capm   CAPMBot in the assignment 2 markets, random orders around each
+           security's expected payoff, scored by the utility of its final
+           portfolio less that of its first, expected payoff less
+           EVAL_RISK_PENALTY times the variance in dollars as the assignment
+           scores it, whatever risk_penalty the bot ran with
+    dsbot  DSBot with a public widget market and a manager sending it an
+           order every REQUEST_INTERVAL seconds, scored by its profit, cash
+           and widgets valued at MID
+
+along with its fills (trades it was in) and messages (orders and cancels it
+sent). Sessions run on a process pool, one per core by default. Each result
+is appended to a JSON lines cache as it comes in, keyed by the bot, the
+parameters, the seed and the session length, so an interrupted sweep picks up
+where it stopped and no session is run twice. The table averages every
+cached session of the configurations swept, best score first.
+
+Run from this directory:
+    python sweep.py capm risk_penalty=0.001,0.007,0.02 PROFIT_MARGIN=0,25,50
+    python sweep.py dsbot --random 20 PROFIT_MARGIN=0:40 bot_type=REACTIVE
+    python sweep.py capm MM_STALL_TIME=0.5,1.25,2 --seeds 3 --processes 4
+
+NAME=a,b,c sweeps the values given, NAME=low:high draws from the range with
+--random, integers if both ends are. Parameters in capitals are module
+constants, the others constructor arguments.
+
+CAPMBot's optimiser has a wall clock time budget, so a session's result can
+move a little with the load on the machine. More seeds average that out.
+"""
+import argparse
+import concurrent.futures
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import statistics
+
+import numpy as np
+from fmclient import OrderSide
+
+from synthetic import CAPM_PAYOFFS, load_dsbot
+import CAPMBot as capm_module
+from bench_exchange import make_marketplace, order_flow
+from suite import RESULTS_DIR
+from portfolio import VarianceEngine
+from common.exchange import LocalExchange, MANAGER_CODE
+
+# parameters that can be swept, constants of the bot's module or arguments
+PARAMETERS = {
+    "capm": {"risk_penalty": "argument", "aggressiveness_param": "argument",
+             "PROFIT_MARGIN": "constant", "MM_STALL_TIME": "constant",
+             "MIN_CASH_THRESHOLD": "constant"},
+    "dsbot": {"PROFIT_MARGIN": "constant", "bot_type": "argument",
+              "batch_settlement": "argument"},
+}
+SESSION_TIME = 60
+EVAL_RISK_PENALTY = 0.007
+CENTS_IN_DOLLAR = 100
+
+# CAPMBot's market, as bench_exchange's with fewer scripted orders
+CAPM_ORDER_RATE = 20
+CAPM_CASH = 20000
+CAPM_UNITS = 5
+
+# DSBot's market
+DSBOT_ORDER_RATE = 20
+REQUEST_INTERVAL = 5
+REQUEST_UNITS = 3
+MID = 500
+DSBOT_CASH = 10 ** 5
+DSBOT_UNITS = 20
+
+# module constants as the bots define them, restored before every session as
+# pool processes run one session after another
+CAPM_DEFAULTS = {name: getattr(capm_module, name)
+                 for name, kind in PARAMETERS["capm"].items()
+                 if kind == "constant"}
+
+
+def parse_value(text):
+    for parse in (int, float):
+        try:
+            return parse(text)
+        except ValueError:
+            pass
+    return {"True": True, "False": False}.get(text, text)
+
+
+def configurations(bot, specs, num_random=None, sample_seed=0):
+    """
+    :param specs     : list of NAME=a,b,c or NAME=low:high
+    :param num_random: draws of a random search, None for the full grid
+    :return          : list of dictionaries of parameter to value
+    """
+    names = []
+    grids = []
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        if name not in PARAMETERS[bot]:
+            raise ValueError(f"{bot} has no parameter {name}, one of "
+                             f"{', '.join(PARAMETERS[bot])}")
+        if ":" in values:
+            low, high = (parse_value(value) for value in values.split(":"))
+            grids.append((low, high))
+        else:
+            grids.append([parse_value(value) for value in values.split(",")])
+        names.append(name)
+
+    if num_random is None:
+        if any(isinstance(grid, tuple) for grid in grids):
+            raise ValueError("ranges low:high are only drawn from with --random")
+        return [dict(zip(names, values)) for values in itertools.product(*grids)]
+
+    # the same draws every time, for the cache to be reused
+    rng = random.Random(sample_seed)
+    drawn = []
+    for _ in range(num_random):
+        config = {}
+        for name, grid in zip(names, grids):
+            if isinstance(grid, list):
+                config[name] = rng.choice(grid)
+            elif isinstance(grid[0], int) and isinstance(grid[1], int):
+                config[name] = rng.randint(*grid)
+            else:
+                config[name] = round(rng.uniform(*grid), 6)
+        drawn.append(config)
+    return drawn
+
+
+def cache_key(bot, params, seed, session_time):
+    return json.dumps({"bot": bot, "params": params, "seed": seed,
+                       "session_time": session_time}, sort_keys=True)
+
+
+def read_cache(path):
+    """
+    :return: dictionary of cache key to result
+    """
+    cached = {}
+    if not os.path.exists(path):
+        return cached
+    with open(path) as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # the last line of a sweep that was killed while writing
+                continue
+            cached[record["key"]] = record["result"]
+    return cached
+
+
+def net_holdings(exchange, code, cash, units):
+    """
+    :param units: dictionary of market id to units held at the start
+    :return     : (cash, dictionary of market id to units) after the
+                    session's trades, and the number of trades
+    """
+    units = dict(units)
+    fills = 0
+    for _, market_id, price, traded, buyer, seller in exchange.trades:
+        if code not in (buyer, seller):
+            continue
+        sign = 1 if buyer == code else -1
+        cash -= sign * price * traded
+        units[market_id] += sign * traded
+        fills += 1
+    return cash, units, fills
+
+
+def count_messages(bot):
+    """
+    Counts the orders and cancels a connected bot sends
+    :return: list whose first item is the count
+    """
+    sent = [0]
+    send_order = bot.send_order
+
+    def counted_send_order(order):
+        sent[0] += 1
+        send_order(order)
+
+    bot.send_order = counted_send_order
+    return sent
+
+
+def capm_utility(engine, cash, units):
+    """
+    :param units: vector of units held, in payoff table order
+    """
+    expected = np.dot(engine.expected_payoffs, units) + cash / CENTS_IN_DOLLAR
+    return expected - EVAL_RISK_PENALTY * engine.portfolio_variance(units)
+
+
+def capm_session(params, seed, session_time):
+    for name, value in CAPM_DEFAULTS.items():
+        setattr(capm_module, name, params.get(name, value))
+    arguments = {name: value for name, value in params.items()
+                 if PARAMETERS["capm"][name] == "argument"}
+
+    exchange, markets, traders = make_marketplace(seed)
+    send = order_flow(exchange, markets, traders)
+    bot = capm_module.CAPMBot("sweep", "sweep@local", "", 1, **arguments)
+    bot._logger.setLevel("ERROR")
+    code = exchange.connect(bot, cash=CAPM_CASH,
+                            units={market.item: CAPM_UNITS
+                                   for market in markets},
+                            short_units=5)
+    messages = count_messages(bot)
+
+    def flow():
+        send()
+        exchange.call_at(exchange.time + 1 / CAPM_ORDER_RATE, flow)
+
+    exchange.call_at(0.5, flow)
+    exchange.start()
+    exchange.run(session_time)
+    exchange.stop()
+
+    start_units = {market.fm_id: CAPM_UNITS for market in markets}
+    cash, units, fills = net_holdings(exchange, code, CAPM_CASH, start_units)
+    engine = VarianceEngine(np.array([CAPM_PAYOFFS[market.item]
+                                      for market in markets])
+                            / CENTS_IN_DOLLAR)
+    start = capm_utility(engine, CAPM_CASH,
+                         [start_units[market.fm_id] for market in markets])
+    end = capm_utility(engine, cash, [units[market.fm_id] for market in markets])
+    return {"score": float(end - start), "fills": fills,
+            "messages": messages[0]}
+
+
+def dsbot_session(params, seed, session_time):
+    dsbot = load_dsbot()
+    arguments = {"bot_type": dsbot.BotType.REACTIVE}
+    for name, value in params.items():
+        if PARAMETERS["dsbot"][name] == "constant":
+            setattr(dsbot, name, value)
+        elif name == "bot_type":
+            arguments[name] = dsbot.BotType[value]
+        else:
+            arguments[name] = value
+
+    exchange = LocalExchange(seed=seed)
+    widget = exchange.add_market("widget", min_price=5, max_price=1000,
+                                 price_tick=5)
+    private = exchange.add_market("private", private=True, min_price=5,
+                                  max_price=1000, price_tick=5)
+    traders = [exchange.add_account(cash=10 ** 9, units={"widget": 10 ** 6})
+               for _ in range(10)]
+    bot = dsbot.DSBot("sweep", "sweep@local", "", 1, **arguments)
+    bot._logger.setLevel("ERROR")
+    code = exchange.connect(bot, cash=DSBOT_CASH,
+                            units={"widget": DSBOT_UNITS,
+                                   "private": DSBOT_UNITS})
+    messages = count_messages(bot)
+
+    rng = exchange.random
+    num_requests = [0]
+
+    def flow():
+        exchange.submit(rng.choice(traders), widget,
+                        rng.choice((OrderSide.BUY, OrderSide.SELL)),
+                        MID + 5 * rng.randint(-10, 10), 1)
+        exchange.call_at(exchange.time + 1 / DSBOT_ORDER_RATE, flow)
+
+    def request():
+        # one side resting at a time, the manager's orders would trade
+        # with each other
+        if not exchange.resting_orders(MANAGER_CODE):
+            if num_requests[0] % 2 == 0:
+                side, price = OrderSide.BUY, MID + 5 * rng.randint(0, 8)
+            else:
+                side, price = OrderSide.SELL, MID - 5 * rng.randint(0, 8)
+            exchange.submit(MANAGER_CODE, private, side, price, REQUEST_UNITS,
+                            None, code)
+            num_requests[0] += 1
+        exchange.call_at(exchange.time + REQUEST_INTERVAL, request)
+
+    exchange.call_at(0.5, flow)
+    exchange.call_at(1, request)
+    exchange.start()
+    exchange.run(session_time)
+    exchange.stop()
+
+    cash, units, fills = net_holdings(
+        exchange, code, DSBOT_CASH,
+        {widget.fm_id: DSBOT_UNITS, private.fm_id: DSBOT_UNITS})
+    profit = cash - DSBOT_CASH + MID * (units[widget.fm_id] +
+                                        units[private.fm_id] - 2 * DSBOT_UNITS)
+    return {"score": profit, "fills": fills, "messages": messages[0]}
+
+
+def run_session(bot, params, seed, session_time):
+    """
+    One session in a pool process
+    """
+    logging.disable(logging.INFO)
+    session = capm_session if bot == "capm" else dsbot_session
+    return session(params, seed, session_time)
+
+
+def sweep(bot, configs, seeds, session_time, cache_path, processes=None):
+    """
+    Runs every session not in the cache, appending each result to it
+    :return: list of (params, list of results) in the order of configs
+    """
+    cached = read_cache(cache_path)
+    jobs = {}
+    for params in configs:
+        for seed in seeds:
+            key = cache_key(bot, params, seed, session_time)
+            if key not in cached:
+                jobs[key] = (params, seed)
+    print(f"{len(configs) * len(seeds)} sessions, {len(jobs)} to run, "
+          f"{len(configs) * len(seeds) - len(jobs)} cached in {cache_path}")
+
+    if jobs:
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        context = multiprocessing.get_context("spawn")
+        with concurrent.futures.ProcessPoolExecutor(
+                processes, mp_context=context) as pool, \
+                open(cache_path, "a") as cache:
+            futures = {pool.submit(run_session, bot, params, seed,
+                                   session_time): key
+                       for key, (params, seed) in jobs.items()}
+            for done, future in enumerate(
+                    concurrent.futures.as_completed(futures), 1):
+                key = futures[future]
+                cached[key] = future.result()
+                cache.write(json.dumps({"key": key, "result": cached[key]})
+                            + "\n")
+                cache.flush()
+                print(f"\r{done}/{len(jobs)} sessions run", end="", flush=True)
+        print()
+
+    return [(params, [cached[cache_key(bot, params, seed, session_time)]
+                      for seed in seeds])
+            for params in configs]
+
+
+def print_table(results, top=None):
+    """
+    Prints each configuration's mean score, fills and messages over its
+    sessions, best score first
+    """
+    rows = sorted(((statistics.mean(result["score"] for result in sessions),
+                    statistics.mean(result["fills"] for result in sessions),
+                    statistics.mean(result["messages"] for result in sessions),
+                    len(sessions), params)
+                   for params, sessions in results),
+                  key=lambda row: -row[0])
+    names = sorted({name for *_, params in rows for name in params})
+    widths = [max(len(name), 8) for name in names]
+    print(" ".join(f"{name:>{width}}" for name, width in zip(names, widths)) +
+          f" {'score':>10} {'fills':>8} {'messages':>9} {'runs':>5}")
+    for score, fills, messages, runs, params in rows[:top]:
+        print(" ".join(f"{str(params.get(name, '-')):>{width}}"
+                       for name, width in zip(names, widths)) +
+              f" {score:>10.2f} {fills:>8.1f} {messages:>9.1f} {runs:>5}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("bot", choices=PARAMETERS)
+    parser.add_argument("params", nargs="+", metavar="NAME=VALUES",
+                        help="NAME=a,b,c or, with --random, NAME=low:high")
+    parser.add_argument("--random", type=int, metavar="N",
+                        help="draw N configurations instead of the full grid")
+    parser.add_argument("--sample-seed", type=int, default=0,
+                        help="seed of the random draws")
+    parser.add_argument("--seeds", type=int, default=1,
+                        help="sessions per configuration, seeds 0 to N - 1")
+    parser.add_argument("--session-time", type=float, default=SESSION_TIME)
+    parser.add_argument("--processes", type=int,
+                        help="pool size, the number of CPUs by default")
+    parser.add_argument("--cache", help="JSON lines file of session results, "
+                                        "results/sweep-<bot>.jsonl by default")
+    parser.add_argument("--top", type=int, help="only print the N best")
+    args = parser.parse_args()
+
+    try:
+        configs = configurations(args.bot, args.params, args.random,
+                                 args.sample_seed)
+    except ValueError as error:
+        parser.error(str(error))
+    cache_path = args.cache or os.path.join(RESULTS_DIR,
+                                            f"sweep-{args.bot}.jsonl")
+    results = sweep(args.bot, configs, list(range(args.seeds)),
+                    args.session_time, cache_path, args.processes)
+    print_table(results, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Synthetic fmclient objects so the bots can be benchmarked without a server
+"""
+import importlib.util
+import os
+import sys
+
+from fmclient import Holding, Market, Order
+
+PROJECTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROJECTS_DIR, "3. assignment_2"))
+
+from CAPMBot import CAPMBot  # noqa: E402
+
+# payoffs used in the assignment 2 simulations, in cents
+CAPM_PAYOFFS = {"a": [1000, 0, 750, 250], "b": [0, 250, 750, 100],
+                "c": [0, 750, 250, 1000], "note": [500, 500, 500, 500]}
+
+
+def make_market(market_id, item, description="", private=False):
+    """
+    Creates (or fetches) the singleton Market for the given id
+    """
+    return Market(market_id, {
+        "id": market_id, "item": item, "name": item.title(),
+        "description": description, "minimumPrice": 5,
+        "maximumPrice": 1000, "priceTick": 5, "minimumUnit": 1,
+        "maximumUnit": 100, "unitTick": 1, "privateMarket": private,
+    })
+
+
+def make_holding(markets, units, cash, short_units=5):
+    """
+    Creates a Holding with the given units per market and cash in cents
+    """
+    return Holding({
+        "cash": cash, "availableCash": cash, "initialCash": cash,
+        "assets": [{"units": units[market.item],
+                    "availableUnits": units[market.item],
+                    "market": {"id": market.fm_id},
+                    "grant": {"shortUnits": short_units}}
+                   for market in markets],
+    })
+
+
+def make_book_order(fm_id, market, side, price, units=1, mine=False,
+                    consumer=None, owner_target=None):
+    """
+    Creates (or updates) the singleton Order for the given id, as if
+    received from FlexeMarkets
+    :param consumer    : None for a pending order, otherwise the id of the
+                         order that consumed it
+    :param owner_target: trader code of a private order
+    """
+    return Order(fm_id, {
+        "id": fm_id, "type": "LIMIT", "side": side.name, "units": units,
+        "price": price, "marketId": market.fm_id, "mine": mine,
+        "original": fm_id, "consumer": consumer, "clientDescription": None,
+        "ownerTarget": owner_target,
+    })
+
+
+def load_dsbot():
+    """
+    :return: the assignment 1 DSBot module, which is named after the
+                student number so can't be imported by name
+    """
+    spec = importlib.util.spec_from_file_location(
+        "dsbot", os.path.join(PROJECTS_DIR, "2. assignment_1", "921322.py"))
+    dsbot = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(dsbot)
+    return dsbot
+
+
+def clear_markets():
+    """
+    Markets are process wide singletons and bots read every one of them in
+    initialised(), so forget the previous marketplace before building another
+    """
+    Market._Market__instances_by_id.clear()
+    Market._Market__instances_by_item.clear()
+
+
+def make_capm_bot(payoffs=None, first_market_id=1, units=None, cash=20000,
+                  periodic=False, **kwargs):
+    """
+    Creates a CAPMBot that is initialised and has received holdings, without
+    connecting to FlexeMarkets
+    :param periodic: keep the bot's periodic tasks, to run them in a loop
+    :param kwargs  : passed on to the CAPMBot constructor
+    :return: the bot and its list of markets
+    """
+    payoffs = payoffs or CAPM_PAYOFFS
+    clear_markets()
+    markets = [make_market(first_market_id + i, item,
+                           ",".join(str(p) for p in payoff))
+               for i, (item, payoff) in enumerate(payoffs.items())]
+
+    bot = CAPMBot("bench", "bench@local", "", first_market_id, **kwargs)
+    bot._enable_ws_comm = False
+    bot.initialised()
+
+    # the periodic tasks only run inside the agent's loop, drop them here
+    if not periodic:
+        for task in bot._user_tasks:
+            task.close()
+        bot._user_tasks = []
+
+    units = units or {market.item: 5 for market in markets}
+    bot.received_holdings(make_holding(markets, units, cash))
+    return bot, markets
@@ -0,0 +1,16 @@
+"""
+Modules shared by the trading bots
+
+Bots add the PyCharm Projects directory to sys.path to import these.
+"""
+from common.order_book import OrderBook
+from common.quote_manager import QuoteManager
+from common.exchange import LocalExchange, MANAGER_CODE
+from common.replay import LogRecording, LogReplay, read_log
+from common.log_store import LogStore, convert_log
+from common.latency import LatencyTracker
+from common.async_log import QueuedLog, QueuedLogging
+from common.order_manager import OrderManager, OrderState
+from common.ledger import Ledger
+from common.manager_queue import ManagerQueue
+from common.runner import BotRunner, BotSpec, run_sharded
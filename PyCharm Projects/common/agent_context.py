@@ -0,0 +1,170 @@
+"""
+The fmclient internals bots run outside Agent.run() depend on, in one place
+
+fmclient keeps every Order, Session and Market in process wide registries, and
+whether an order is `mine` depends on who is looking. A bot run side by side
+with others, on the LocalExchange or in a BotRunner, therefore gets its own
+view of those registries, selected by a context variable that asyncio carries
+into the bot's tasks and callbacks. bot_context() makes such a context.
+
+Neither the registries nor the steps of Agent.run() are public: the views
+replace the name mangled class attributes holding the registries, and the
+exchange and the runner start a bot through Agent._initialise, _user_tasks,
+_process_order_queue and _process_incoming_messages. Importing this module
+checks that fmclient is a version they are known to work with, and that each
+of them is still there, so an fmclient upgrade fails here rather than running
+bots half wired. A new version is added to FMCLIENT_VERSIONS once they are
+checked against it.
+"""
+import contextvars
+from collections.abc import MutableMapping
+
+import fmclient
+from fmclient import Agent, Market, Order, Session
+
+FMCLIENT_VERSIONS = ("3.0.0-rc-1",)
+
+# name -> (fmclient class, its registry attribute)
+REGISTRIES = {
+    "Order": (Order, "_Order__instances_by_id"),
+    "Session": (Session, "_Session__instances_by_id"),
+    "Market": (Market, "_Market__instances_by_id"),
+    "MarketByItem": (Market, "_Market__instances_by_item"),
+}
+
+# Agent methods that Agent.run() calls and the exchange and runner call instead
+_AGENT_METHODS = ("_initialise", "_process_order_queue",
+                  "_process_incoming_messages")
+
+# registries of Orders / Sessions / Markets seen by the bot whose callback is
+# running, by name
+_registry_view = contextvars.ContextVar("registry_view", default=None)
+
+
+def _check_fmclient():
+    version = getattr(fmclient, "__version__", None)
+    if version not in FMCLIENT_VERSIONS:
+        raise ImportError(f"common.agent_context relies on fmclient internals "
+                          f"checked against {', '.join(FMCLIENT_VERSIONS)}, "
+                          f"not {version}")
+    missing = [f"{cls.__name__}.{attr}" for cls, attr in REGISTRIES.values()
+               if not hasattr(cls, attr)]
+    missing += [f"Agent.{name}" for name in _AGENT_METHODS
+                if not hasattr(Agent, name)]
+    if missing:
+        raise ImportError(f"fmclient {version} has no {', '.join(missing)}")
+
+
+_check_fmclient()
+
+
+class _RegistryView(MutableMapping):
+    """
+    Stands in for an fmclient class level registry, delegating to the
+    registry of the current context's bot, or the original one elsewhere and
+    for bots that share it
+    """
+
+    def __init__(self, name, default):
+        self._name = name
+        self._default = default
+
+    def _registry(self):
+        views = _registry_view.get()
+        if views is None or self._name not in views:
+            return self._default
+        return views[self._name]
+
+    def __getitem__(self, key):
+        return self._registry()[key]
+
+    def __setitem__(self, key, value):
+        self._registry()[key] = value
+
+    def __delitem__(self, key):
+        del self._registry()[key]
+
+    def __contains__(self, key):
+        return key in self._registry()
+
+    def __iter__(self):
+        return iter(self._registry())
+
+    def __len__(self):
+        return len(self._registry())
+
+    def __copy__(self):
+        return dict(self._registry())
+
+    def items(self):
+        return self._registry().items()
+
+    def values(self):
+        return self._registry().values()
+
+    def keys(self):
+        return self._registry().keys()
+
+    def clear(self):
+        self._registry().clear()
+
+
+def install_registry_views(names=("Order", "Session")):
+    """
+    Replaces the named fmclient registries with views, once
+    """
+    for name in names:
+        cls, attr = REGISTRIES[name]
+        registry = getattr(cls, attr)
+        if not isinstance(registry, _RegistryView):
+            setattr(cls, attr, _RegistryView(name, registry))
+
+
+def clear_registries(names):
+    """
+    Forgets everything in the named registries, as the current context sees
+    them
+    """
+    for name in names:
+        cls, attr = REGISTRIES[name]
+        getattr(cls, attr).clear()
+
+
+def bot_context(registries=("Order", "Session")):
+    """
+    :param registries: names of the fmclient registries the bot keeps to
+                        itself, of "Order", "Session", "Market" and
+                        "MarketByItem", the others are shared
+    :return          : a copy of the current context in which they are
+                        empty, to run the bot's handlers and create its
+                        tasks in
+    """
+    install_registry_views(registries)
+    context = contextvars.copy_context()
+    context.run(_registry_view.set, {name: {} for name in registries})
+    return context
+
+
+# ---- AGENT.RUN() STEPS ----
+def initialise(agent):
+    """
+    Logs the bot in, connects it and calls initialised(), as Agent.run()
+    does first. fmclient exits with SystemExit if the bot can't connect
+    """
+    agent._initialise()
+
+
+def user_tasks(agent):
+    """
+    :return: coroutines of the bot's periodic tasks
+    """
+    return list(agent._user_tasks)
+
+
+def agent_coroutines(agent):
+    """
+    :return: the bot's periodic tasks and the order and message tasks that
+                Agent.run() would run
+    """
+    return user_tasks(agent) + [agent._process_order_queue(),
+                                agent._process_incoming_messages()]
@@ -0,0 +1,256 @@
+"""
+Queue backed logging for the bots' inform, warning, error and debug
+
+fmclient's Agent.inform formats its message and writes it to the log file,
+the console and, with user communication, the websocket before it returns,
+on the event loop between order updates. A bot with QueuedLogging started
+only appends a record to a bounded queue; a background thread formats the
+records and hands them to the same logger handlers, and passes websocket
+messages back to the event loop, the only thread that may send them.
+
+    self.inform("Performance  : %s", self._current_performance)
+
+Formatting is lazy: the message is %-formatted with its arguments, or called
+if it is a callable, on the logging thread. Arguments should be values that
+won't change before then, numbers, strings and orders, not lists being
+updated. Records are timestamped when they are queued.
+
+A category can be sampled, keeping 1 in every N of its records:
+
+    self.inform("Not enough cash", category="opportunity")
+    if self.log_sampled("status"):
+        ... several lines logged together, or not at all
+
+When the queue is full new records are dropped and counted instead of
+blocking the bot, and the logging thread warns how many were dropped once it
+catches up. Sampling and dropping only apply while the queue is started.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+
+from fmclient.data.message import MessageType
+
+QUEUE_SIZE = 10000
+FLUSH_INTERVAL = 0.05
+
+# websocket message type of each logging level
+MESSAGE_TYPES = {logging.DEBUG: MessageType.DEBUG,
+                 logging.INFO: MessageType.INFO,
+                 logging.WARNING: MessageType.WARN,
+                 logging.ERROR: MessageType.ERROR}
+
+
+def render(msg, args=()):
+    """
+    :return: the message as it is logged, msg() if msg is a callable
+    """
+    if callable(msg):
+        return str(msg())
+    return str(msg) % args if args else msg
+
+
+class QueuedLog:
+
+    def __init__(self, logger, send_ws=None, queue_size=QUEUE_SIZE,
+                 sample=None, interval=FLUSH_INTERVAL):
+        """
+        Starts the logging thread
+        :param logger    : logging.Logger whose handlers write the records
+        :param send_ws   : function(message, MessageType) called from the
+                           logging thread for records sent on the websocket
+        :param queue_size: records queued before new ones are dropped
+        :param sample    : dictionary of category to N, only 1 in every N
+                           records of the category is logged
+        :param interval  : seconds between writes of the queued records
+        """
+        self._logger = logger
+        self._send_ws = send_ws
+        self._queue_size = queue_size
+        self._sample = dict(sample or {})
+        self._interval = interval
+
+        # (level, msg, args, ws, time queued), appended by the bot and
+        # popped by the logging thread
+        self._queue = deque()
+        self._seen = {}
+        self._lock = threading.Lock()
+
+        self.num_logged = 0
+        self.dropped = {}
+        self.sampled_out = {}
+        self._num_dropped = 0
+        self._num_reported = 0
+
+        self._stopped = False
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name=f"{logger.name} log")
+        self._thread.start()
+        # write what is left when the interpreter exits, before logging
+        # closes its handlers
+        atexit.register(self.stop)
+
+    @property
+    def num_dropped(self):
+        return self._num_dropped
+
+    def __len__(self):
+        return len(self._queue)
+
+    def sampled(self, category):
+        """
+        Counts one record, or group of records, of a category
+        :return: False if sampling leaves it out
+        """
+        every = self._sample.get(category)
+        if not every:
+            return True
+        seen = self._seen.get(category, 0)
+        self._seen[category] = seen + 1
+        if seen % every:
+            self.sampled_out[category] = self.sampled_out.get(category, 0) + 1
+            return False
+        return True
+
+    def log(self, level, msg, args=(), ws=True, category=None):
+        """
+        Queues a record, called from the bot
+        :param level   : logging level
+        :param msg     : message or format string, or a callable returning
+                         the message
+        :param args    : arguments of the format string
+        :param ws      : also send it on the websocket
+        :param category: category it is sampled and counted under, or None
+        """
+        if not self._logger.isEnabledFor(level):
+            return
+        if category is not None and not self.sampled(category):
+            return
+        if len(self._queue) >= self._queue_size:
+            self._num_dropped += 1
+            self.dropped[category] = self.dropped.get(category, 0) + 1
+            return
+        self._queue.append((level, msg, args, ws, time.time()))
+
+    def flush(self):
+        """
+        Writes every queued record before returning
+        """
+        self._drain()
+
+    def stop(self):
+        """
+        Writes the queued records and stops the logging thread
+        """
+        atexit.unregister(self.stop)
+        self._stopped = True
+        self._wake.set()
+        self._thread.join()
+        self._drain()
+
+    # ---- LOGGING THREAD ----
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self._interval)
+            self._wake.clear()
+            self._drain()
+
+    def _drain(self):
+        with self._lock:
+            queue = self._queue
+            while queue:
+                self._write(*queue.popleft())
+
+            dropped = self._num_dropped - self._num_reported
+            if dropped:
+                self._num_reported += dropped
+                self._write(logging.WARNING,
+                            "Log queue full, %d records dropped",
+                            (dropped,), False, time.time())
+
+    def _write(self, level, msg, args, ws, created):
+        try:
+            message = render(msg, args)
+        except Exception as e:
+            message = f"Can't format log message {msg!r} % {args!r}: {e}"
+
+        logger = self._logger
+        record = logger.makeRecord(logger.name, level, __file__, 0, message,
+                                   None, None)
+        record.created = created
+        record.msecs = int((created - int(created)) * 1000) + 0.0
+        logger.handle(record)
+        self.num_logged += 1
+
+        if ws and self._send_ws is not None:
+            self._send_ws(str(message), MESSAGE_TYPES[level])
+
+
+class QueuedLogging:
+    """
+    Mixin for an fmclient Agent, listed before Agent in the bases, whose
+    inform, warning, error and debug take format arguments and a category,
+    and go through a QueuedLog once start_log_queue is called
+    """
+    _log_queue = None
+
+    @property
+    def log_queue(self):
+        """
+        :return: the QueuedLog, or None while logging synchronously
+        """
+        return self._log_queue
+
+    def start_log_queue(self, queue_size=QUEUE_SIZE, sample=None):
+        """
+        Logs through a background thread from now on, see QueuedLog
+        """
+        if self._log_queue is None:
+            self._log_queue = QueuedLog(self._logger, self._send_ws_threadsafe,
+                                        queue_size=queue_size, sample=sample)
+
+    def stop_log_queue(self):
+        """
+        Writes the queued records, then logs synchronously again
+        """
+        if self._log_queue is not None:
+            self._log_queue.stop()
+            self._log_queue = None
+
+    def log_sampled(self, category):
+        """
+        :return: False if sampling leaves out this record, or group of
+                    records logged together, of the category
+        """
+        return self._log_queue is None or self._log_queue.sampled(category)
+
+    def _send_ws_threadsafe(self, message, msg_type):
+        loop = self._loop
+        if self._enable_ws_comm and loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._send_ws_message, message, msg_type)
+
+    def _queue_or_log(self, level, log, msg, args, ws, category):
+        if self._log_queue is None:
+            log(render(msg, args) if args or callable(msg) else msg, ws)
+        else:
+            self._log_queue.log(level, msg, args, ws and self._enable_ws_comm,
+                                category)
+
+    def inform(self, msg, *args, ws=True, category=None):
+        self._queue_or_log(logging.INFO, super().inform, msg, args, ws,
+                           category)
+
+    def warning(self, msg, *args, ws=True, category=None):
+        self._queue_or_log(logging.WARNING, super().warning, msg, args, ws,
+                           category)
+
+    def error(self, msg, *args, ws=True, category=None):
+        self._queue_or_log(logging.ERROR, super().error, msg, args, ws,
+                           category)
+
+    def debug(self, msg, *args, ws=True, category=None):
+        self._queue_or_log(logging.DEBUG, super().debug, msg, args, ws,
+                           category)
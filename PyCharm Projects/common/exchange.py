@@ -0,0 +1,712 @@
+"""
+Local, deterministic stand-in for the FlexeMarkets exchange
+
+Bots written against fmclient.Agent connect to a LocalExchange instead of the
+hosted service and run unmodified: the exchange takes over send_order and
+drives the Agent's own message handlers, so initialised, received_orders,
+received_holdings, received_session_info, order_accepted and order_rejected
+are called exactly as they would be live.
+
+    exchange = LocalExchange(seed=0)
+    widget = exchange.add_market("widget", min_price=5, max_price=1000)
+    exchange.connect(bot, cash=10000, units={"widget": 5})
+    exchange.start()
+    exchange.run(60)
+
+The exchange keeps its own price-time priority book, enforces cash and short
+limits, and supports private markets in which a manager account trades with
+one trader at a time. Time is virtual: the event loop jumps straight to the
+next scheduled callback, so a session runs as fast as the bots can process
+it and replays identically under the same seed.
+
+fmclient keeps every Order and Session in process wide registries, and whether
+an order is `mine` depends on who is looking. Each connected bot therefore
+runs in its own common.agent_context.bot_context(), with its own view of
+those registries.
+"""
+import asyncio
+import bisect
+import contextvars
+import functools
+import itertools
+import random
+import selectors
+
+from fmclient import Market, Order, OrderSide, OrderType
+
+from common.agent_context import bot_context, clear_registries, \
+    install_registry_views, user_tasks
+
+MANAGER_CODE = "M000"
+
+
+class _VirtualSelector(selectors.DefaultSelector):
+
+    def __init__(self, loop):
+        super().__init__()
+        self._loop = loop
+
+    def select(self, timeout=None):
+        # nothing is ready, so move the clock on to the next timer
+        if timeout is None:
+            raise RuntimeError("Virtual time loop has nothing scheduled")
+        self._loop.advance(timeout)
+        return super().select(0)
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    """
+    Event loop whose clock only moves when nothing is ready to run, straight
+    to the next scheduled callback
+    """
+
+    def __init__(self):
+        self._now = 0.0
+        super().__init__(_VirtualSelector(self))
+
+    def time(self):
+        return self._now
+
+    def advance(self, seconds):
+        self._now += seconds
+
+
+class _Account:
+
+    def __init__(self, code, cash, units, short_units, agent=None,
+                 unlimited=False):
+        """
+        :param units      : dictionary of market id to units held
+        :param short_units: dictionary of market id to units it may short
+        :param unlimited  : True for the manager, never short of cash/units
+        """
+        self.code = code
+        self.cash = cash
+        self.initial_cash = cash
+        self.units = dict(units)
+        self.initial_units = dict(units)
+        self.short_units = dict(short_units)
+        self.reserved_cash = 0
+        self.reserved_units = {market_id: 0 for market_id in units}
+        self.agent = agent
+        self.unlimited = unlimited
+        self.context = None
+        self.tasks = []
+
+    def add_market(self, market_id):
+        self.units[market_id] = self.initial_units[market_id] = 0
+        self.short_units[market_id] = self.reserved_units[market_id] = 0
+
+    def holding_json(self):
+        return {
+            "cash": self.cash,
+            "availableCash": self.cash - self.reserved_cash,
+            "initialCash": self.initial_cash,
+            "assets": [{
+                "units": units,
+                "availableUnits": units - self.reserved_units[market_id],
+                "initialUnits": self.initial_units[market_id],
+                "initialShortUnits": 0,
+                "market": {"id": market_id},
+                "grant": {"canBuy": True, "canSell": True, "units": 0,
+                          "shortUnits": self.short_units[market_id]},
+            } for market_id, units in self.units.items()],
+        }
+
+
+class _Resting:
+
+    __slots__ = ("fm_id", "seq", "account", "market_id", "side", "price",
+                 "units", "ref", "target", "original", "book_key")
+
+    def __init__(self, fm_id, seq, account, market_id, side, price, units,
+                 ref, target, original, book_key):
+        self.fm_id = fm_id
+        self.seq = seq
+        self.account = account
+        self.market_id = market_id
+        self.side = side
+        self.price = price
+        self.units = units
+        self.ref = ref
+        self.target = target
+        self.original = original
+        self.book_key = book_key
+
+
+class _Side:
+    """
+    One side of a book: price levels sorted by price, and the orders at each
+    price keyed by their time priority
+    """
+
+    def __init__(self, is_bid):
+        self._is_bid = is_bid
+        self._prices = []
+        self._levels = {}
+
+    def add(self, order):
+        level = self._levels.get(order.price)
+        if level is None:
+            level = self._levels[order.price] = {}
+            bisect.insort(self._prices, order.price)
+        level[order.seq] = order
+
+    def remove(self, order):
+        level = self._levels[order.price]
+        del level[order.seq]
+        if not level:
+            del self._levels[order.price]
+            del self._prices[bisect.bisect_left(self._prices, order.price)]
+
+    def crossing(self, price):
+        """
+        :return: orders an incoming order at the given price would trade
+                    with, best first
+        """
+        if self._is_bid:
+            start = bisect.bisect_left(self._prices, price)
+            prices = reversed(self._prices[start:])
+        else:
+            prices = self._prices[:bisect.bisect_right(self._prices, price)]
+        for level_price in prices:
+            yield from list(self._levels[level_price].values())
+
+
+class LocalExchange:
+
+    def __init__(self, seed=0, latency=0.0, first_market_id=1,
+                 echo_first=False, holdings_first=False):
+        """
+        Starts an empty marketplace. Markets are process wide singletons
+        that bots read in initialised(), so any previous ones are forgotten
+        :param seed           : seeds `random`, for scripted order flow
+        :param latency        : seconds between a bot sending an order and
+                                the exchange processing it
+        :param first_market_id: fm_id of the first market added
+        :param echo_first     : True to send the order updates before
+                                order_accepted, as FlexeMarkets sometimes does
+        :param holdings_first : True to send the new holdings before the
+                                order updates that caused them
+        """
+        install_registry_views()
+        clear_registries(("Market", "MarketByItem"))
+
+        self.random = random.Random(seed)
+        self._latency = latency
+        self._echo_first = echo_first
+        self._holdings_first = holdings_first
+        self._loop = VirtualTimeLoop()
+        self._context = contextvars.copy_context()
+
+        self._market_ids = itertools.count(first_market_id)
+        self._markets = {}
+        self._order_ids = itertools.count(1)
+        self._seqs = itertools.count()
+        self._account_codes = (f"T{i:03d}" for i in itertools.count(1))
+        self._accounts = {}
+        self._agents = []
+        self._manager = None
+
+        # book key (market id, or market id and trader pair) -> side -> _Side
+        self._books = {}
+        self._resting = {}
+
+        self._session_ids = itertools.count(1)
+        self._session = None
+
+        self.trades = []
+        self.num_events = 0
+        self.num_rejected = 0
+
+    # ---- MARKETPLACE SETUP ----
+    def add_market(self, item, description="", private=False, min_price=1,
+                   max_price=1000, price_tick=1, min_units=1, max_units=100):
+        """
+        :return: the new Market
+        """
+        market_id = next(self._market_ids)
+        market = Market(market_id, {
+            "id": market_id, "item": item, "name": item.title(),
+            "description": description, "minimumPrice": min_price,
+            "maximumPrice": max_price, "priceTick": price_tick,
+            "minimumUnit": min_units, "maximumUnit": max_units,
+            "unitTick": 1, "privateMarket": private,
+        })
+        self._markets[market_id] = market
+        for account in self._accounts.values():
+            account.add_market(market_id)
+        if private and self._manager is None:
+            self._manager = self._new_account(MANAGER_CODE, 0, {}, {},
+                                              unlimited=True)
+        return market
+
+    def add_account(self, cash=0, units=None, short_units=0):
+        """
+        Adds a trader with no bot, whose orders are sent with submit()
+        :param units      : dictionary of market item to units held
+        :param short_units: units it may short in every market, or a
+                            dictionary of market item to units
+        :return           : the account code
+        """
+        return self._new_account(next(self._account_codes), cash,
+                                 *self._by_market_id(units, short_units)).code
+
+    def connect(self, agent, cash=0, units=None, short_units=0):
+        """
+        Connects an fmclient Agent in place of the hosted service
+        :param agent      : the bot, not yet initialised
+        :return           : the bot's account code
+        """
+        account = self._new_account(next(self._account_codes), cash,
+                                    *self._by_market_id(units, short_units),
+                                    agent=agent)
+
+        # the bot's own view of the Order and Session registries
+        account.context = bot_context()
+        self._agents.append(account)
+
+        agent._enable_ws_comm = False
+        agent._loop = self._loop
+        agent.send_order = functools.partial(self._send_order, account)
+        return account.code
+
+    def _new_account(self, code, cash, units, short_units, agent=None,
+                     unlimited=False):
+        units = {market_id: units.get(market_id, 0)
+                 for market_id in self._markets}
+        short_units = {market_id: short_units.get(market_id, 0)
+                       for market_id in self._markets}
+        account = _Account(code, cash, units, short_units, agent, unlimited)
+        self._accounts[code] = account
+        return account
+
+    def _by_market_id(self, units, short_units):
+        by_item = {market.item: market_id
+                   for market_id, market in self._markets.items()}
+        units = {by_item[item]: value for item, value in (units or {}).items()}
+        if isinstance(short_units, dict):
+            short_units = {by_item[item]: value
+                           for item, value in short_units.items()}
+        else:
+            short_units = dict.fromkeys(self._markets, short_units)
+        return units, short_units
+
+    # ---- RUNNING ----
+    @property
+    def loop(self):
+        return self._loop
+
+    @property
+    def time(self):
+        return self._loop.time()
+
+    def call_at(self, when, callback, *args):
+        """
+        Schedules a callback, e.g. scripted order flow, at a virtual time
+        """
+        return self._loop.call_at(when, callback, *args,
+                                  context=self._context)
+
+    def start(self):
+        """
+        Initialises every connected bot, opens a session and starts the
+        bots' periodic tasks
+        """
+        for account in self._agents:
+            agent = account.agent
+            account.context.run(agent._safely_call_method, agent.initialised)
+            account.context.run(agent._safely_call_method,
+                                agent.pre_start_tasks)
+
+        self.open_session()
+
+        for account in self._agents:
+            account.tasks += [
+                account.context.run(self._loop.create_task, task)
+                for task in user_tasks(account.agent)]
+
+    def run(self, seconds):
+        """
+        Runs the marketplace for the given virtual seconds
+        """
+        self._loop.run_until_complete(asyncio.sleep(seconds))
+
+    def stop(self):
+        """
+        Stops every bot's periodic tasks and closes the event loop
+        """
+        tasks = []
+        for account in self._agents:
+            account.agent._stop = True
+            tasks += account.tasks
+        if tasks:
+            self._loop.run_until_complete(asyncio.gather(*tasks))
+        self._loop.close()
+
+    def open_session(self):
+        """
+        Opens a new session with an empty book, holdings carry over
+        """
+        for order in list(self._resting.values()):
+            self._unreserve(order, order.units)
+            self._remove(order)
+
+        session_id = next(self._session_ids)
+        self._session = {"id": session_id, "state": "OPEN"}
+        for account in self._agents:
+            account.context.run(account.agent._on_session_update,
+                                dict(self._session))
+            account.context.run(account.agent._on_holding_update,
+                                account.holding_json())
+
+    def close_session(self):
+        self._session = dict(self._session, state="CLOSED")
+        for account in self._agents:
+            account.context.run(account.agent._on_session_update,
+                                dict(self._session))
+
+    @property
+    def is_open(self):
+        return self._session is not None and self._session["state"] == "OPEN"
+
+    # ---- ORDERS ----
+    def submit(self, code, market, side, price, units, ref=None,
+               target=None):
+        """
+        Sends a limit order for a trader with no bot, processed immediately
+        :param code  : account code, or MANAGER_CODE
+        :param target: account code of the other trader in a private market
+        :return      : fm_id of the order, None if it was rejected
+        """
+        request = (OrderType.LIMIT, None, market.fm_id, side, price, units,
+                   ref, target)
+        return self._process(self._accounts[code], request)[0]
+
+    def cancel(self, code, fm_id):
+        """
+        Cancels a resting order for a trader with no bot
+        :return: True if the order was cancelled
+        """
+        order = self._resting.get(fm_id)
+        if order is None:
+            return False
+        request = (OrderType.CANCEL, fm_id, order.market_id, order.side,
+                   order.price, order.units, None, None)
+        return self._process(self._accounts[code], request)[0] is not None
+
+    def resting_orders(self, code=None):
+        """
+        :return: list of (fm_id, account code, market id, side, price, units)
+                    of resting orders, optionally of one account
+        """
+        return [(order.fm_id, order.account.code, order.market_id,
+                 order.side, order.price, order.units)
+                for order in self._resting.values()
+                if code is None or order.account.code == code]
+
+    def _send_order(self, account, order):
+        """
+        Agent.send_order of connected bots, processed after the latency
+        """
+        assert isinstance(order, Order)
+        request = (order.order_type, order.fm_id,
+                   order.market and order.market.fm_id, order.order_side,
+                   order.price, order.units, order.ref, order.owner_or_target)
+        self._loop.call_later(self._latency, self._process, account, request,
+                              order, context=self._context)
+
+    def _process(self, account, request, order=None):
+        """
+        Validates and executes an order, then sends every update to the bots
+        :return: (fm_id, reason rejected)
+        """
+        error = self._validate(account, request)
+        if error is not None:
+            self.num_rejected += 1
+            if order is not None:
+                account.context.run(self._reject, account.agent, error, order)
+            return None, error
+
+        order_type = request[0]
+        if order_type == OrderType.CANCEL:
+            accepted, events = self._execute_cancel(account, request)
+        else:
+            accepted, events = self._execute_limit(account, request)
+        self.num_events += len(events)
+
+        touched = {account}
+        for event in events:
+            touched.add(event[1])
+        self._dispatch(account if order is not None else None, accepted,
+                       events, touched)
+        return accepted[0], None
+
+    def _validate(self, account, request):
+        """
+        :return: reason the order is rejected, None if it is valid
+        """
+        order_type, fm_id, market_id, side, price, units, _, target = request
+        if not self.is_open:
+            return "Session is not open"
+
+        if order_type == OrderType.CANCEL:
+            order = self._resting.get(fm_id)
+            if order is None:
+                return "Order is not pending"
+            if order.account is not account:
+                return "Order is not yours"
+            return None
+
+        if order_type != OrderType.LIMIT:
+            return f"Unsupported order type {order_type}"
+        market = self._markets.get(market_id)
+        if market is None:
+            return "Unknown market"
+        if not isinstance(price, int) or not isinstance(units, int):
+            return "Price and units must be integers"
+        if not market.min_price <= price <= market.max_price or \
+                price % market.price_tick:
+            return "Invalid price"
+        if not market.min_units <= units <= market.max_units:
+            return "Invalid units"
+
+        if market.private_market:
+            counterparty = self._accounts.get(target)
+            if counterparty is None or counterparty is account or \
+                    MANAGER_CODE not in (account.code, target):
+                return "Private orders must be between a trader and manager"
+        elif target is not None:
+            return "Public orders can't have a target"
+
+        if not account.unlimited:
+            if side == OrderSide.BUY:
+                if price * units > account.cash - account.reserved_cash:
+                    return "Not enough cash available"
+            elif account.units[market_id] - \
+                    account.reserved_units[market_id] - units < \
+                    -account.short_units[market_id]:
+                return "Not enough units available"
+
+        book = self._books.get(self._book_key(account, market_id, target))
+        if book is not None:
+            opposite = book[OrderSide.SELL if side == OrderSide.BUY
+                            else OrderSide.BUY]
+            remaining = units
+            for resting in opposite.crossing(price):
+                if resting.account is account:
+                    return "Order would trade with your own order"
+                remaining -= resting.units
+                if remaining <= 0:
+                    break
+        return None
+
+    def _book_key(self, account, market_id, target):
+        if target is None:
+            return market_id
+        return (market_id,) + tuple(sorted((account.code, target)))
+
+    def _execute_limit(self, account, request):
+        """
+        Matches an incoming limit order against the book in price-time
+        priority, trading at the resting order's price. Partly traded orders
+        are split as FlexeMarkets does: the original is consumed with a
+        consumer of 0, a child order holds each traded part and a balance
+        child holds the rest, which keeps the original's place in the book
+        :return: (accepted event, list of events)
+        """
+        _, _, market_id, side, price, units, ref, target = request
+        target_account = self._accounts.get(target)
+        book_key = self._book_key(account, market_id, target)
+        book = self._books.get(book_key)
+        if book is None:
+            book = self._books[book_key] = {OrderSide.BUY: _Side(True),
+                                            OrderSide.SELL: _Side(False)}
+
+        fm_id = next(self._order_ids)
+        accepted = (fm_id, account, market_id, side, OrderType.LIMIT, price,
+                    units, ref, target_account, fm_id, None)
+
+        # trades with the resting orders, best price first
+        opposite = book[OrderSide.SELL if side == OrderSide.BUY
+                        else OrderSide.BUY]
+        fills = []
+        remaining = units
+        for resting in opposite.crossing(price):
+            if not remaining:
+                break
+            traded = min(remaining, resting.units)
+            fills.append((resting, traded))
+            remaining -= traded
+
+        if not fills:
+            self._rest(fm_id, account, market_id, side, price, units, ref,
+                       target_account, fm_id, book_key)
+            return accepted, [accepted]
+
+        events = []
+        incoming_split = len(fills) > 1 or remaining > 0
+        if incoming_split:
+            events.append(accepted[:-1] + (0,))
+
+        for resting, traded in fills:
+            # the incoming part and resting part consume each other
+            incoming_part = next(self._order_ids) if incoming_split else fm_id
+            resting_part = resting.fm_id
+            if traded < resting.units:
+                resting_part = next(self._order_ids)
+            events.append((incoming_part, account, market_id, side,
+                           OrderType.LIMIT, resting.price, traded, ref,
+                           target_account, fm_id, resting_part))
+            events += self._trade_resting(resting, traded, resting_part,
+                                          incoming_part)
+            self._settle(account, resting, traded)
+
+        if remaining:
+            balance_id = next(self._order_ids)
+            balance = self._rest(balance_id, account, market_id, side, price,
+                                 remaining, ref, target_account, fm_id,
+                                 book_key)
+            events.append(self._event(balance, None))
+
+        return accepted, events
+
+    def _trade_resting(self, resting, traded, resting_part, consumer):
+        """
+        Trades units of a resting order, splitting it when partly traded
+        :return: list of events
+        """
+        self._unreserve(resting, traded)
+
+        if traded == resting.units:
+            self._remove(resting)
+            return [self._event(resting, consumer)]
+
+        events = [self._event(resting, 0),
+                  self._event(resting, consumer, fm_id=resting_part,
+                              units=traded)]
+
+        # the balance keeps the original's time priority
+        del self._resting[resting.fm_id]
+        resting.fm_id = next(self._order_ids)
+        resting.units -= traded
+        self._resting[resting.fm_id] = resting
+        events.append(self._event(resting, None))
+        return events
+
+    def _execute_cancel(self, account, request):
+        resting = self._resting[request[1]]
+        cancel_id = next(self._order_ids)
+        accepted = (cancel_id, account, resting.market_id, resting.side,
+                    OrderType.CANCEL, resting.price, resting.units, None,
+                    resting.target, cancel_id, resting.fm_id)
+
+        self._unreserve(resting, resting.units)
+        self._remove(resting)
+        return accepted, [accepted, self._event(resting, cancel_id)]
+
+    @staticmethod
+    def _event(order, consumer, fm_id=None, units=None):
+        return (fm_id or order.fm_id, order.account, order.market_id,
+                order.side, OrderType.LIMIT, order.price,
+                units or order.units, order.ref, order.target,
+                order.original, consumer)
+
+    def _rest(self, fm_id, account, market_id, side, price, units, ref,
+              target, original, book_key):
+        order = _Resting(fm_id, next(self._seqs), account, market_id, side,
+                         price, units, ref, target, original, book_key)
+        self._resting[fm_id] = order
+        self._books[book_key][side].add(order)
+        if side == OrderSide.BUY:
+            account.reserved_cash += price * units
+        else:
+            account.reserved_units[market_id] += units
+        return order
+
+    def _remove(self, order):
+        del self._resting[order.fm_id]
+        self._books[order.book_key][order.side].remove(order)
+
+    @staticmethod
+    def _unreserve(order, units):
+        if order.side == OrderSide.BUY:
+            order.account.reserved_cash -= order.price * units
+        else:
+            order.account.reserved_units[order.market_id] -= units
+
+    def _settle(self, account, resting, traded):
+        """
+        Moves cash and units between the incoming order's account and the
+        resting order's account, at the resting order's price
+        """
+        if resting.side == OrderSide.BUY:
+            buyer, seller = resting.account, account
+        else:
+            buyer, seller = account, resting.account
+        value = resting.price * traded
+        buyer.cash -= value
+        seller.cash += value
+        buyer.units[resting.market_id] += traded
+        seller.units[resting.market_id] -= traded
+        self.trades.append((self.time, resting.market_id, resting.price,
+                            traded, buyer.code, seller.code))
+
+    # ---- DISPATCH TO BOTS ----
+    def _dispatch(self, sender, accepted, events, touched):
+        """
+        Sends order_accepted to the bot that sent the order, then the order
+        updates to every bot that can see them, then new holdings. With
+        echo_first, order_accepted comes after the order updates, and with
+        holdings_first the new holdings come before them
+        """
+        if sender is not None and not self._echo_first:
+            sender.context.run(self._accept, sender.agent,
+                               self._order_json(accepted, sender))
+
+        if self._holdings_first:
+            self._send_holdings(touched)
+
+        for account in self._agents:
+            jsons = [self._order_json(event, account) for event in events
+                     if event[8] is None or account is event[1] or
+                     account is event[8]]
+            if jsons:
+                account.context.run(account.agent._on_orders_update, jsons)
+
+        if sender is not None and self._echo_first:
+            sender.context.run(self._accept, sender.agent,
+                               self._order_json(accepted, sender))
+
+        if not self._holdings_first:
+            self._send_holdings(touched)
+
+    def _send_holdings(self, touched):
+        for account in touched:
+            if account.agent is not None:
+                account.context.run(account.agent._on_holding_update,
+                                    account.holding_json())
+
+    @staticmethod
+    def _order_json(event, viewer):
+        fm_id, account, market_id, side, order_type, price, units, ref, \
+            target, original, consumer = event
+        json = {"id": fm_id, "type": order_type.name, "side": side.name,
+                "units": units, "price": price, "marketId": market_id,
+                "mine": account is viewer, "original": original,
+                "consumer": consumer, "clientDescription": ref,
+                "ownerTarget": None}
+        if target is not None:
+            json["ownerTarget"] = target.code if account is viewer \
+                else account.code
+        return json
+
+    @staticmethod
+    def _accept(agent, json):
+        agent._safely_call_method(functools.partial(
+            agent.order_accepted, Order(json["id"], json)))
+
+    @staticmethod
+    def _reject(agent, error, order):
+        agent._safely_call_method(functools.partial(
+            agent.order_rejected, {"status": 400, "error": error}, order))
@@ -0,0 +1,177 @@
+"""
+Tick to trade latency of a bot
+
+A bot marks four points with a LatencyTracker:
+
+    tick()              Agent._on_orders_update delivers an order update
+    enter(strategy)     a strategy starts, and exit() when it returns
+    sent(ref)           an order is handed to send_order
+    acknowledged(ref)   order_accepted or order_rejected for that order
+
+Each strategy run is attributed to the latest update delivered before it
+began, unless an earlier run of the same strategy already reacted to it, and
+orders are matched to their acknowledgement by ref. The tracker keeps the
+last `window` samples of each stage, per strategy:
+
+    tick_to_entry   update delivered -> strategy entered
+    strategy        strategy entered -> strategy returned
+    tick_to_send    update delivered -> order sent
+    send_to_ack     order sent -> accepted or rejected
+
+Marking a point costs a clock read and a few dictionary operations, and
+nothing but an attribute check while the tracker is disabled. Tracking can
+be switched on and off at any time through `enabled`.
+"""
+import time
+from collections import deque
+
+import numpy as np
+
+STAGES = ("tick_to_entry", "strategy", "tick_to_send", "send_to_ack")
+
+# strategy of orders sent outside any strategy run
+NO_STRATEGY = "NONE"
+
+_now = time.perf_counter_ns
+
+
+class LatencyTracker:
+
+    def __init__(self, enabled=True, window=4096):
+        """
+        :param enabled: False to start switched off
+        :param window : samples kept per strategy and stage
+        """
+        self.enabled = enabled
+        self._window = window
+
+        # strategy -> one deque of nanoseconds per stage, in STAGES order
+        self._samples = {}
+
+        self._tick = None
+        self._reacted = {}
+        self._series = None
+        self._strategy_tick = None
+        self._entered = None
+
+        # ref -> (series of the strategy that sent it, time sent), and
+        # acknowledgements by outcome
+        self._in_flight = {}
+        self.num_accepted = 0
+        self.num_rejected = 0
+
+    def tick(self):
+        if self.enabled:
+            self._tick = _now()
+
+    def enter(self, strategy):
+        """
+        :param strategy: name of the strategy, e.g. BotType.REACTIVE.name
+        """
+        if not self.enabled:
+            return
+        now = _now()
+        series = self._samples.get(strategy)
+        if series is None:
+            series = self._add_strategy(strategy)
+        self._series = series
+        self._entered = now
+
+        tick = self._tick
+        if tick is None or self._reacted.get(strategy) == tick:
+            self._strategy_tick = None
+            return
+        self._reacted[strategy] = tick
+        self._strategy_tick = tick
+        series[0].append(now - tick)
+
+    def exit(self):
+        if not self.enabled or self._series is None:
+            return
+        self._series[1].append(_now() - self._entered)
+        self._series = None
+        self._strategy_tick = None
+
+    def sent(self, ref):
+        """
+        :param ref: ref of the order about to be sent
+        """
+        if not self.enabled:
+            return
+        now = _now()
+        series = self._series
+        if series is None:
+            series = self._samples.get(NO_STRATEGY) or \
+                self._add_strategy(NO_STRATEGY)
+        elif self._strategy_tick is not None:
+            series[2].append(now - self._strategy_tick)
+
+        # an acknowledgement lost for good shouldn't grow this forever
+        in_flight = self._in_flight
+        if len(in_flight) >= self._window:
+            del in_flight[next(iter(in_flight))]
+        in_flight[ref] = (series, now)
+
+    def acknowledged(self, ref, accepted=True):
+        """
+        :param ref     : ref of the accepted or rejected order
+        :param accepted: False if it was rejected
+        """
+        if not self.enabled:
+            return
+        sent = self._in_flight.pop(ref, None)
+        if sent is None:
+            return
+        series, when = sent
+        series[3].append(_now() - when)
+        if accepted:
+            self.num_accepted += 1
+        else:
+            self.num_rejected += 1
+
+    def reset(self):
+        """
+        Forgets the last update and the orders in flight, e.g. when the
+        session changes. The samples are kept
+        """
+        self._tick = None
+        self._reacted = {}
+        self._series = None
+        self._strategy_tick = None
+        self._in_flight = {}
+
+    def _add_strategy(self, strategy):
+        series = self._samples[strategy] = \
+            [deque(maxlen=self._window) for _ in STAGES]
+        return series
+
+    def summary(self):
+        """
+        :return: dictionary of strategy to stage to count, and p50, p99 and
+                    max in microseconds, of the samples in the window
+        """
+        summary = {}
+        for strategy, series in sorted(self._samples.items()):
+            for stage, samples in zip(STAGES, series):
+                if not samples:
+                    continue
+                micros = np.fromiter(samples, dtype=np.int64) / 1000
+                p50, p99 = np.percentile(micros, [50, 99])
+                summary.setdefault(strategy, {})[stage] = {
+                    "count": len(micros), "p50_us": float(p50),
+                    "p99_us": float(p99), "max_us": float(micros.max())}
+        return summary
+
+    def report(self):
+        """
+        :return: list of lines, one per strategy and stage
+        """
+        lines = []
+        for strategy, stages in self.summary().items():
+            for stage, stats in stages.items():
+                lines.append(f"{strategy:<12} {stage:<13} "
+                             f"n={stats['count']:<5} "
+                             f"p50={stats['p50_us']:.0f}us "
+                             f"p99={stats['p99_us']:.0f}us "
+                             f"max={stats['max_us']:.0f}us")
+        return lines
@@ -0,0 +1,202 @@
+"""
+Cash and units a bot has committed to orders FlexeMarkets may not know about
+yet
+
+received_holdings gives the cash and units available after the orders the
+server has accepted, but it arrives some time after each order is sent, so a
+bot checking a second order against it can commit the same cash twice and
+have the order rejected. The Ledger reserves the cash of a buy and the units
+of a sell the moment the order is sent, and releases them when it is
+rejected or cancelled. Units that trade stay reserved until the next
+received_holdings, which accounts for the trade.
+
+An order that isn't acknowledged in time may still reach FlexeMarkets, so it
+stays reserved until it is done, or until the OrderManager gives it up as
+lost. Releasing it at the first timeout could spend its cash or units twice
+if it trades after all, while keeping it for good would lock them for the
+rest of the session if it never arrives. Past the lost timeout the second is
+taken as much the likelier: should it still trade, the next holdings show it,
+and at worst an order sent in between is rejected.
+
+What is available is the lower of the two views, the server's and the
+holdings less every reservation of ours, so neither a reservation the server
+has not made yet nor one it has not released yet is spent twice.
+
+Markets are positions in the arrays given to set_markets, and a batch of
+orders is checked with one pass over its orders and one over the markets:
+
+    ledger.fits(indices, is_buy, prices, units)
+"""
+import numpy as np
+
+
+class Ledger:
+
+    def __init__(self, market_ids=()):
+        """
+        :param market_ids: fm_id of each market, in the order of the arrays
+        """
+        self._index = {}
+        self._cash = 0
+        self._server_cash_available = 0
+        self._units = None
+        self._server_units_available = None
+        self._short_limits = None
+        self.set_markets(market_ids)
+
+        # order key -> [index, is_buy, price, units not traded]
+        self._reservations = {}
+        self._reserved_cash = 0
+        self._reserved_units = None
+
+        # traded, but the holdings don't show it yet
+        self._settling_cash = 0
+        self._settling_units = None
+        self.release_all()
+
+    def set_markets(self, market_ids):
+        """
+        :param market_ids: fm_id of each market, in the order of the arrays
+        """
+        self._index = {market_id: i for i, market_id in enumerate(market_ids)}
+        num_markets = len(self._index)
+        self._units = np.zeros(num_markets, dtype=int)
+        self._server_units_available = np.zeros(num_markets, dtype=int)
+        self._short_limits = np.zeros(num_markets, dtype=int)
+        self.release_all()
+
+    def release_all(self):
+        """
+        Forgets every reservation, e.g. when the session changes
+        """
+        self._reservations = {}
+        self._reserved_cash = 0
+        self._reserved_units = np.zeros(len(self._index), dtype=int)
+        self._settling_cash = 0
+        self._settling_units = np.zeros(len(self._index), dtype=int)
+
+    def index(self, market_id):
+        """
+        :return: position of the market in the arrays, None if not tracked
+        """
+        return self._index.get(market_id)
+
+    # ---- HOLDINGS ----
+    def update_holdings(self, holdings):
+        """
+        :param holdings: Holdings object sent by FlexeMarkets
+        """
+        self._cash = holdings.cash
+        self._server_cash_available = holdings.cash_available
+        for market, asset in holdings.assets.items():
+            index = self._index.get(market.fm_id)
+            if index is None:
+                continue
+            self._units[index] = asset.units
+            self._server_units_available[index] = asset.units_available
+            self._short_limits[index] = -asset.units_granted_short
+
+        # the trades that were settling are in these holdings
+        self._settling_cash = 0
+        self._settling_units[:] = 0
+
+    @property
+    def cash_available(self):
+        """
+        :return: cash that may still be spent on buys
+        """
+        return min(self._server_cash_available,
+                   self._cash - self._reserved_cash - self._settling_cash)
+
+    @property
+    def units_available(self):
+        """
+        :return: array of the units held and not committed to sells
+        """
+        return np.minimum(self._server_units_available,
+                          self._units - self._reserved_units -
+                          self._settling_units)
+
+    @property
+    def sellable(self):
+        """
+        :return: array of the units that may still be sold, short selling
+                    included
+        """
+        return self.units_available - self._short_limits
+
+    def fits(self, indices, is_buy, prices, units):
+        """
+        Checks a batch of orders against what is available, all together
+        :param indices: array of market positions
+        :param is_buy : boolean array, True for buys
+        :param prices : array of prices in cents
+        :param units  : array of units
+        :return       : True if every order of the batch can be sent
+        """
+        indices = np.asarray(indices, dtype=int)
+        is_buy = np.asarray(is_buy, dtype=bool)
+        units = np.asarray(units, dtype=int)
+        to_spend = np.dot(np.asarray(prices, dtype=int) * units, is_buy)
+        if to_spend > self.cash_available:
+            return False
+        sells = ~is_buy
+        to_sell = np.bincount(indices[sells], weights=units[sells],
+                              minlength=len(self._index))
+        return bool(np.all(to_sell <= self.sellable))
+
+    # ---- RESERVATIONS ----
+    def reserve(self, key, market_id, is_buy, price, units):
+        """
+        :param key      : object the order is known by until it is done
+        :param market_id: fm_id of the order's market
+        :param is_buy   : True for a buy, which reserves cash, else units
+        :param price    : price in cents
+        :param units    : units of the order
+        """
+        index = self._index.get(market_id)
+        if index is None or key in self._reservations:
+            return
+        self._reservations[key] = [index, is_buy, price, units]
+        self._add(index, is_buy, price, units, 1)
+
+    def traded(self, key, units):
+        """
+        Units of an order traded, they settle with the next holdings
+        """
+        reservation = self._reservations.get(key)
+        if reservation is None:
+            return
+        index, is_buy, price, left = reservation
+        units = min(units, left)
+        reservation[3] -= units
+        self._add(index, is_buy, price, units, -1)
+        if is_buy:
+            self._settling_cash += price * units
+        else:
+            self._settling_units[index] += units
+        if reservation[3] <= 0:
+            del self._reservations[key]
+
+    def release(self, key):
+        """
+        The order is done without trading the rest of its units, they are
+        available again
+        """
+        reservation = self._reservations.pop(key, None)
+        if reservation is not None:
+            self._add(*reservation, -1)
+
+    def _add(self, index, is_buy, price, units, sign):
+        if is_buy:
+            self._reserved_cash += sign * price * units
+        else:
+            self._reserved_units[index] += sign * units
+
+    def __len__(self):
+        return len(self._reservations)
+
+    def __str__(self):
+        return f"Ledger(cash {self.cash_available}, " \
+               f"units {self.units_available.tolist()}, " \
+               f"{len(self._reservations)} orders)"
@@ -0,0 +1,340 @@
+"""
+Columnar, memory mapped store of the messages parsed from a bot log
+
+Re-parsing a whole -bot.log with regular expressions every time a session is
+analysed gets slower as the logs grow. convert_log() parses a log once into a
+directory of column files, one raw little endian NumPy array per column, for
+each of three tables:
+
+    orders  : time, run, fm_id, mine, side, units, price, market_id,
+              order_type, ref, owner_target
+    assets  : time, run, market_id, units, units_available, units_initial,
+              units_initial_short, can_buy, can_sell
+    sessions: time, run, session_id, state
+
+time is milliseconds since the epoch, as logged (local time), and run counts
+the times the bot was started in the log. Each table is kept sorted by time,
+lines logged at the same time in the order they were logged, as the time
+range queries binary search it: a clock set back, by daylight saving or
+between runs, sorts the lines it logged before the later ones. Sides, order types and session
+states are stored as their index in SIDES, ORDER_TYPES and SESSION_STATES,
+and refs and owners/targets as their index in LogStore.strings, or -1.
+
+    store = convert_log("logs/s.mann4@student.unimelb.edu.au-897-bot.log")
+    orders = store.select("orders", "2020-09-04 13:44", "2020-09-04 13:45",
+                          market_id=1570)
+
+Conversion is incremental: meta.json records how far into the log has been
+converted, and the next call only parses the lines appended since, unless
+they were logged before the last time stored, when the whole log is
+converted again. Readers
+memory map the columns, binary search the time column and only read the
+rows they select.
+"""
+import json
+import os
+
+import numpy as np
+
+from common.replay import ASSET_LINE, LOG_LINE, ORDER_LINE, SESSION_LINE
+
+SIDES = ("BUY", "SELL")
+ORDER_TYPES = ("LIMIT", "CANCEL")
+SESSION_STATES = ("INIT", "OPEN", "PAUSED", "CLOSED")
+
+TABLES = {
+    "orders": [("time", "<i8"), ("run", "<i4"), ("fm_id", "<i8"),
+               ("mine", "?"), ("side", "i1"), ("units", "<i4"),
+               ("price", "<i4"), ("market_id", "<i4"), ("order_type", "i1"),
+               ("ref", "<i4"), ("owner_target", "<i4")],
+    "assets": [("time", "<i8"), ("run", "<i4"), ("market_id", "<i4"),
+               ("units", "<i4"), ("units_available", "<i4"),
+               ("units_initial", "<i4"), ("units_initial_short", "<i4"),
+               ("can_buy", "?"), ("can_sell", "?")],
+    "sessions": [("time", "<i8"), ("run", "<i4"), ("session_id", "<i8"),
+                 ("state", "i1")],
+}
+
+_META = "meta.json"
+_VERSION = 2
+
+
+class LogStore:
+
+    def __init__(self, directory):
+        """
+        Opens a store, which is empty until a log is converted into it
+        :param directory: directory of the column files
+        """
+        self._directory = directory
+        self._meta = self._read_meta()
+        self._columns = {}
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @property
+    def strings(self):
+        """
+        :return: list of every ref and owner/target code, by index
+        """
+        return self._meta["strings"]
+
+    def __len__(self):
+        return sum(self._meta["rows"].values())
+
+    def num_rows(self, table):
+        return self._meta["rows"][table]
+
+    def column(self, table, name):
+        """
+        :return: read only, memory mapped array of every value of a column
+        """
+        key = (table, name)
+        rows = self._meta["rows"][table]
+        cached = self._columns.get(key)
+        if cached is not None and len(cached) == rows:
+            return cached
+
+        dtype = np.dtype(dict(TABLES[table])[name])
+        if rows == 0:
+            array = np.empty(0, dtype)
+        else:
+            array = np.memmap(self._path(table, name), dtype=dtype, mode="r",
+                              shape=(rows,))
+        self._columns[key] = array
+        return array
+
+    def time_slice(self, table, start=None, end=None):
+        """
+        :param start: first time to include, as a datetime, numpy datetime64
+                        or string, or None from the beginning
+        :param end  : time to stop before, or None to the end
+        :return     : slice of the rows logged in [start, end)
+        """
+        times = self.column(table, "time")
+        first = 0 if start is None else \
+            int(np.searchsorted(times, _to_ms(start), side="left"))
+        last = len(times) if end is None else \
+            int(np.searchsorted(times, _to_ms(end), side="left"))
+        return slice(first, max(first, last))
+
+    def select(self, table, start=None, end=None, market_id=None,
+               columns=None):
+        """
+        Rows of a table in a time range, and optionally of one market
+        :param table    : "orders", "assets" or "sessions"
+        :param start    : see time_slice
+        :param end      : see time_slice
+        :param market_id: market fm_id, or None for every market
+        :param columns  : names of the columns wanted, or None for all
+        :return         : dictionary of column name to array
+        """
+        names = columns or [name for name, _ in TABLES[table]]
+        rows = self.time_slice(table, start, end)
+        if market_id is not None:
+            markets = self.column(table, "market_id")[rows]
+            rows = rows.start + np.flatnonzero(markets == market_id)
+        return {name: np.asarray(self.column(table, name)[rows])
+                for name in names}
+
+    def update(self, log_path):
+        """
+        Converts the lines appended to a log since the last update. The
+        store is rebuilt if it was converted from a different log, the log
+        was rewritten since, or the new lines were logged before the last
+        time stored
+        :param log_path: path to the -bot.log file
+        :return        : number of lines read
+        """
+        with open(log_path, "rb") as log:
+            head = log.readline().decode("utf-8", "replace")
+            log.seek(0, os.SEEK_END)
+            size = log.tell()
+
+            if self._meta["head"] != head or self._meta["offset"] > size:
+                self._clear(head)
+            lines, complete = self._read_lines(log, size)
+            parsed = self._parse(lines)
+            if self._goes_back(parsed):
+                self._clear(head)
+                lines, complete = self._read_lines(log, size)
+                parsed = self._parse(lines)
+
+        os.makedirs(self._directory, exist_ok=True)
+        for table, values in parsed.items():
+            self._append(table, values)
+
+        self._meta["offset"] += complete
+        self._write_meta()
+        return len(lines)
+
+    # ---- CONVERSION ----
+    def _read_lines(self, log, size):
+        """
+        :return: (complete lines from the converted offset to size, bytes
+                    they take)
+        """
+        offset = self._meta["offset"]
+        log.seek(offset)
+        data = log.read(size - offset)
+
+        # leave a line still being written for the next update
+        complete = data.rfind(b"\n") + 1
+        return data[:complete].decode("utf-8", "replace").splitlines(), \
+            complete
+
+    def _goes_back(self, parsed):
+        """
+        :return: True if a table's new rows start before its last stored
+                    time, so can't be appended keeping it sorted
+        """
+        for table, values in parsed.items():
+            rows = self._meta["rows"][table]
+            if rows == 0:
+                continue
+            # read without memory mapping, the files may be removed next
+            last = np.fromfile(self._path(table, "time"), dtype="<i8",
+                               count=1, offset=(rows - 1) * 8)[0]
+            if values[0][0] < last:
+                return True
+        return False
+
+    def _parse(self, lines):
+        meta = self._meta
+        strings = {string: i for i, string in enumerate(meta["strings"])}
+
+        def code(string):
+            if not string:
+                return -1
+            if string not in strings:
+                strings[string] = len(meta["strings"])
+                meta["strings"].append(string)
+            return strings[string]
+
+        rows = {table: [] for table in TABLES}
+        times = {table: [] for table in TABLES}
+        for line in lines:
+            if "Log Started" in line:
+                meta["runs"] += 1
+                continue
+            match = LOG_LINE.match(line)
+            if match is None:
+                continue
+            timestamp, message = match.groups()
+            run = meta["runs"]
+
+            found = ORDER_LINE.match(message)
+            if found:
+                fm_id, whose, side, units, price, market_id, order_type, \
+                    ref, owner_target = found.groups()
+                rows["orders"].append((
+                    run, int(fm_id), whose == "Mine", SIDES.index(side),
+                    int(units), int(price), int(market_id),
+                    ORDER_TYPES.index(order_type), code(ref),
+                    code(owner_target)))
+                times["orders"].append(timestamp)
+                continue
+
+            found = ASSET_LINE.match(message)
+            if found:
+                market_id, units, available, initial, initial_short, \
+                    can_buy, can_sell = found.groups()
+                rows["assets"].append((
+                    run, int(market_id), int(units), int(available),
+                    int(initial), int(initial_short), can_buy == "True",
+                    can_sell == "True"))
+                times["assets"].append(timestamp)
+                continue
+
+            found = SESSION_LINE.match(message)
+            if found:
+                session_id, state = found.groups()
+                rows["sessions"].append((run, int(session_id),
+                                         SESSION_STATES.index(state)))
+                times["sessions"].append(timestamp)
+
+        # "2020-09-04 13:44:42,059" -> "2020-09-04T13:44:42.059", converted
+        # in one go
+        parsed = {}
+        for table, values in rows.items():
+            if not values:
+                continue
+            stamps = np.array([stamp.replace(" ", "T").replace(",", ".")
+                               for stamp in times[table]],
+                              dtype="datetime64[ms]")
+            columns = [stamps.astype("<i8")]
+            for i, (_, dtype) in enumerate(TABLES[table][1:]):
+                columns.append(np.fromiter((row[i] for row in values),
+                                           dtype=dtype, count=len(values)))
+            if np.any(columns[0][1:] < columns[0][:-1]):
+                order = np.argsort(columns[0], kind="stable")
+                columns = [column[order] for column in columns]
+            parsed[table] = columns
+        return parsed
+
+    def _append(self, table, values):
+        rows = self._meta["rows"][table]
+        for (name, dtype), array in zip(TABLES[table], values):
+            path = self._path(table, name)
+            with open(path, "ab") as column:
+                # drop anything written after the last meta.json update
+                column.truncate(rows * np.dtype(dtype).itemsize)
+                column.write(array.astype(dtype, copy=False).tobytes())
+        self._meta["rows"][table] = rows + len(values[0])
+        self._columns = {key: array for key, array in self._columns.items()
+                         if key[0] != table}
+
+    # ---- FILES ----
+    def _path(self, table, name):
+        return os.path.join(self._directory, f"{table}.{name}.bin")
+
+    def _empty_meta(self):
+        return {"version": _VERSION, "head": None, "offset": 0, "runs": 0,
+                "strings": [], "rows": {table: 0 for table in TABLES}}
+
+    def _read_meta(self):
+        try:
+            with open(os.path.join(self._directory, _META)) as meta:
+                meta = json.load(meta)
+        except FileNotFoundError:
+            return self._empty_meta()
+        if meta.get("version") != _VERSION:
+            return self._empty_meta()
+        return meta
+
+    def _write_meta(self):
+        # written whole then renamed, so a reader never sees half of it
+        path = os.path.join(self._directory, _META)
+        with open(path + ".tmp", "w") as meta:
+            json.dump(self._meta, meta)
+        os.replace(path + ".tmp", path)
+
+    def _clear(self, head):
+        self._meta = self._empty_meta()
+        self._meta["head"] = head
+        self._columns = {}
+        for table, columns in TABLES.items():
+            for name, _ in columns:
+                if os.path.exists(self._path(table, name)):
+                    os.remove(self._path(table, name))
+
+
+def convert_log(log_path, directory=None):
+    """
+    Converts a bot log into a LogStore, or brings an existing one up to date
+    :param log_path : path to the -bot.log file
+    :param directory: directory of the store, by default next to the log
+                      with the same name and a .columns extension
+    :return         : the LogStore
+    """
+    if directory is None:
+        directory = os.path.splitext(log_path)[0] + ".columns"
+    store = LogStore(directory)
+    store.update(log_path)
+    return store
+
+
+def _to_ms(when):
+    return int(np.datetime64(when, "ms").astype("<i8"))
@@ -0,0 +1,308 @@
+"""
+Private orders the manager has sent a bot, worked in parallel
+
+A manager buy order asks the bot to buy widgets in the public market and sell
+them to the manager at its price, a manager sell order the other way round.
+DSBot used to follow one of them at a time, a single number of units to
+trade and the role of the latest one. The ManagerQueue keeps every resting
+manager order as a request, by the id it was first filed under so the
+balance left after a partial trade stays the same request, and ranks each
+side by price: the highest manager buy and the lowest manager sell leave the
+most margin against the public book.
+
+Widgets are the same whichever request they were bought for, and a private
+order trades with the manager's best order on its side whatever its own
+price, so each side pools the units of the orders sent for it (legs):
+
+    public leg sent: working -> traded: to_hedge -> private leg sent:
+        hedging -> traded with the manager
+
+The units claimed by a side's legs cover its requests best first. The first
+request they don't fully cover is the marginal one, which the next public leg
+is priced against, and the first request not covered by the private legs in
+flight is the one the next private leg trades with.
+"""
+import bisect
+import itertools
+
+from fmclient import OrderSide
+
+
+class ManagerRequest:
+    __slots__ = ("key", "order", "is_buy", "price", "units")
+
+    def __init__(self, key, order):
+        self.key = key
+        self.order = order
+        self.is_buy = order.order_side == OrderSide.BUY
+        self.price = order.price
+        self.units = order.units
+
+    def __repr__(self):
+        side = "BUY" if self.is_buy else "SELL"
+        return f"ManagerRequest({self.key}, {side}, {self.units}@{self.price})"
+
+
+class ManagerSide:
+    """
+    The manager's requests on one side, and the units of the legs worked for
+    them
+    """
+
+    def __init__(self, is_buy):
+        self.is_buy = is_buy
+
+        # (rank, seq, key) best first, and the request of each key
+        self._ranks = []
+        self._entries = {}
+        self._requests = {}
+
+        # units every request asks for
+        self.units = 0
+
+        # public legs sent but not traded, traded but not sent to the
+        # manager yet, and private legs sent but not traded
+        self.working = 0
+        self.to_hedge = 0
+        self.hedging = 0
+
+    def __len__(self):
+        return len(self._requests)
+
+    def add(self, request, seq):
+        entry = (-request.price if self.is_buy else request.price, seq,
+                 request.key)
+        bisect.insort(self._ranks, entry)
+        self._entries[request.key] = entry
+        self._requests[request.key] = request
+        self.units += request.units
+
+    def remove(self, key):
+        request = self._requests.pop(key)
+        entry = self._entries.pop(key)
+        del self._ranks[bisect.bisect_left(self._ranks, entry)]
+        self.units -= request.units
+        return request
+
+    def resize(self, request, units):
+        self.units += units - request.units
+        request.units = units
+
+    @property
+    def claimed(self):
+        return self.working + self.to_hedge + self.hedging
+
+    @property
+    def open(self):
+        """
+        :return: units no leg was sent for yet, negative when the requests
+                    shrank below what the legs claimed
+        """
+        return self.units - self.claimed
+
+    @property
+    def committed(self):
+        """
+        :return: units to be traded with the manager that no private leg was
+                    sent for yet
+        """
+        return self.working + self.to_hedge
+
+    def requests(self):
+        """
+        :return: list of the side's requests, best first
+        """
+        return [self._requests[key] for _, _, key in self._ranks]
+
+    def covering(self, start):
+        """
+        :param start: units covered already, from the best request down
+        :return     : (first request not fully covered, its units left), or
+                        (None, 0)
+        """
+        for _, _, key in self._ranks:
+            request = self._requests[key]
+            if start < request.units:
+                return request, request.units - start
+            start -= request.units
+        return None, 0
+
+    def marginal(self):
+        """
+        :return: (request the next public leg is for, its units left), or
+                    (None, 0)
+        """
+        return self.covering(self.claimed)
+
+    def hedge_target(self):
+        """
+        :return: (request the next private leg trades with, its units left),
+                    or (None, 0)
+        """
+        return self.covering(self.hedging)
+
+    def value(self, start, units):
+        """
+        :return: cash the manager's orders pay or ask for units of theirs,
+                    best first after the first start units
+        """
+        total = 0
+        for _, _, key in self._ranks:
+            if units <= 0:
+                break
+            request = self._requests[key]
+            skipped = min(start, request.units)
+            start -= skipped
+            taken = min(units, request.units - skipped)
+            total += taken * request.price
+            units -= taken
+        return total
+
+
+class ManagerQueue:
+
+    def __init__(self):
+        self._sides = {True: ManagerSide(True), False: ManagerSide(False)}
+        self._requests = {}
+
+        # ref -> [is_buy, is_private, price, units not traded]
+        self._legs = {}
+        self._seqs = itertools.count()
+
+    def reset(self, orders=()):
+        """
+        Forgets every request and leg and starts from the given orders,
+        called when the session changes
+        :param orders: resting manager orders, e.g. OrderBook.manager_orders()
+        """
+        self._sides = {True: ManagerSide(True), False: ManagerSide(False)}
+        self._requests = {}
+        self._legs = {}
+        for order in orders:
+            self.update(order)
+
+    def __len__(self):
+        return len(self._requests)
+
+    def side(self, is_buy):
+        """
+        :param is_buy: True for the manager's buy requests
+        :return      : ManagerSide
+        """
+        return self._sides[is_buy]
+
+    def requests(self):
+        """
+        :return: list of every request, buys then sells, best first
+        """
+        return self._sides[True].requests() + self._sides[False].requests()
+
+    # ---- MANAGER ORDERS ----
+    def update(self, order):
+        """
+        :param order: resting manager order, a new one or the balance of one
+        :return     : its ManagerRequest
+        """
+        key = getattr(order, "original_id", None) or order.fm_id
+        request = self._requests.get(key)
+        if request is None:
+            request = self._requests[key] = ManagerRequest(key, order)
+            self._sides[request.is_buy].add(request, next(self._seqs))
+        else:
+            request.order = order
+            self._sides[request.is_buy].resize(request, order.units)
+        return request
+
+    def remove(self, order):
+        """
+        The manager order left the book. Its request goes too, unless a
+        balance of it was filed since
+        :return: the ManagerRequest removed, or None
+        """
+        key = getattr(order, "original_id", None) or order.fm_id
+        request = self._requests.get(key)
+        if request is None or request.order.fm_id != order.fm_id:
+            return None
+        del self._requests[key]
+        return self._sides[request.is_buy].remove(key)
+
+    # ---- LEGS ----
+    def sent(self, ref, is_buy, is_private, price, units):
+        """
+        :param ref       : ref of the order sent
+        :param is_buy    : True if it works the manager's buy requests
+        :param is_private: True for a private leg, traded with the manager
+        """
+        side = self._sides[is_buy]
+        if is_private:
+            side.to_hedge -= units
+            side.hedging += units
+        else:
+            side.working += units
+        self._legs[ref] = [is_buy, is_private, price, units]
+
+    def filled(self, ref, units):
+        """
+        Units of a leg traded
+        :return: ManagerSide with units to hedge, if it was a public leg
+        """
+        leg = self._legs.get(ref)
+        if leg is None:
+            return None
+        is_buy, is_private, price, left = leg
+        side = self._sides[is_buy]
+        traded = min(units, left)
+        leg[3] -= traded
+        if is_private:
+            side.hedging -= traded
+        else:
+            # a leg that timed out still traded what it traded
+            side.working -= traded
+            side.to_hedge += units
+        if leg[3] <= 0:
+            del self._legs[ref]
+        return None if is_private else side
+
+    def released(self, ref, timed_out=False):
+        """
+        A leg was rejected, cancelled, timed out or lost without trading the
+        rest of its units. A private leg that timed out stays hedging until
+        it turns up done, or is lost, and its units are to hedge again
+        """
+        leg = self._legs.get(ref)
+        if leg is None:
+            return
+        is_buy, is_private, price, left = leg
+        side = self._sides[is_buy]
+        if is_private:
+            if timed_out:
+                # it may still trade, hedging again could trade twice, until
+                # it is released again as lost
+                return
+            side.hedging -= left
+            side.to_hedge += left
+        else:
+            side.working -= left
+        leg[3] = 0
+        if not timed_out:
+            del self._legs[ref]
+
+    def worst_leg(self, is_buy):
+        """
+        :return: ref of the side's public leg with the least margin, the
+                    highest priced buy or lowest priced sell, or None
+        """
+        worst = None
+        for ref, (leg_is_buy, is_private, price, left) in self._legs.items():
+            if leg_is_buy != is_buy or is_private or left <= 0:
+                continue
+            if worst is None or (price > worst[1] if is_buy else
+                                 price < worst[1]):
+                worst = (ref, price)
+        return worst and worst[0]
+
+    def __str__(self):
+        return "ManagerQueue(" + ", ".join(
+            f"{'buy' if side.is_buy else 'sell'} {len(side)} requests "
+            f"{side.units} units {side.working}/{side.to_hedge}/"
+            f"{side.hedging} legs" for side in self._sides.values()) + ")"
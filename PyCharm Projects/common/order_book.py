@@ -0,0 +1,298 @@
+"""
+Incrementally maintained index of the current order book
+
+Order.current() filters every order seen in the session, so walking it each
+strategy tick costs O(total orders ever). The OrderBook is instead fed the
+order deltas a bot receives in received_orders and keeps, per market, the
+bid and ask price levels sorted by price and then time, along with our own
+resting orders and the private (manager) orders sent to us. Each of those is
+kept in the order it was filed, so the latest one and the number resting are
+found without walking them.
+"""
+import bisect
+
+from fmclient import OrderSide
+
+
+class _PriceLevel:
+
+    def __init__(self):
+        # orders at this price in time priority, keyed by fm_id
+        self.orders = {}
+        self.units = 0
+        self.my_units = 0
+
+    def add(self, order):
+        self.orders[order.fm_id] = order
+        self.units += order.units
+        if getattr(order, "mine", False):
+            self.my_units += order.units
+
+    def remove(self, order, units):
+        del self.orders[order.fm_id]
+        self.units -= units
+        if getattr(order, "mine", False):
+            self.my_units -= units
+
+    def refresh(self, order, units):
+        # replacing the value of a key keeps its place in the dict
+        self.orders[order.fm_id] = order
+        self.units += order.units - units
+        if getattr(order, "mine", False):
+            self.my_units += order.units - units
+
+
+class _BookSide:
+
+    def __init__(self, is_bid):
+        self._is_bid = is_bid
+
+        # prices in ascending order, and the level at each price
+        self._prices = []
+        self._levels = {}
+
+    def __len__(self):
+        return len(self._prices)
+
+    def add(self, order):
+        level = self._levels.get(order.price)
+        if level is None:
+            level = self._levels[order.price] = _PriceLevel()
+            bisect.insort(self._prices, order.price)
+        level.add(order)
+
+    def remove(self, order, price, units):
+        level = self._levels[price]
+        level.remove(order, units)
+        if not level.orders:
+            del self._levels[price]
+            del self._prices[bisect.bisect_left(self._prices, price)]
+
+    def refresh(self, order, price, units):
+        self._levels[price].refresh(order, units)
+
+    def level(self, depth):
+        """
+        :param depth: 0 for the best price, 1 for the next best and so on
+        :return     : (price, level) or None if the book isn't that deep
+        """
+        if depth >= len(self._prices):
+            return None
+        price = self._prices[-1 - depth] if self._is_bid else \
+            self._prices[depth]
+        return price, self._levels[price]
+
+    def levels(self):
+        """
+        :return: (price, level) pairs, best price first
+        """
+        prices = reversed(self._prices) if self._is_bid else self._prices
+        return [(price, self._levels[price]) for price in prices]
+
+
+class OrderBook:
+
+    def __init__(self):
+        # market fm_id -> {OrderSide: _BookSide}, public orders only
+        self._markets = {}
+
+        # every resting order by fm_id, with where it was filed in the book
+        self._orders = {}
+
+        self._my_orders = {}
+        self._my_public_orders = {}
+        self._manager_orders = {}
+
+    def reset(self, orders=()):
+        """
+        Forgets every order and rebuilds the book from the given orders,
+        called when the session changes and FlexeMarkets may clear its orders
+        :param orders: orders to start from, e.g. Order.current().values()
+        """
+        self._markets = {}
+        self._orders = {}
+        self._my_orders = {}
+        self._my_public_orders = {}
+        self._manager_orders = {}
+        self.update(orders)
+
+    def update(self, orders):
+        """
+        Applies a delta of orders received from FlexeMarkets. Pending orders
+        are added, or refreshed in place, keeping their time priority, unless
+        their side or price changed. Anything else has been traded, split or
+        cancelled and leaves the book
+        :param orders: orders received in received_orders
+        """
+        for order in orders:
+            filed = self._orders.get(order.fm_id)
+            if filed is not None and order.is_pending and \
+                    filed[2] == order.order_side and filed[3] == order.price:
+                self._refresh(order, filed)
+                continue
+            self._remove(order.fm_id)
+            if order.is_pending:
+                self._add(order)
+
+    def _add(self, order):
+        fm_id = order.fm_id
+        is_private = order.is_private
+        mine = bool(getattr(order, "mine", False))
+
+        market_id = None
+        if not is_private:
+            market_id = order.market.fm_id
+            self._book_side(market_id, order.order_side).add(order)
+        self._orders[fm_id] = (order, market_id, order.order_side,
+                               order.price, order.units)
+
+        if mine:
+            self._my_orders[fm_id] = order
+            if not is_private:
+                self._my_public_orders[fm_id] = order
+        elif is_private:
+            self._manager_orders[fm_id] = order
+
+    def _refresh(self, order, filed):
+        fm_id = order.fm_id
+        _, market_id, side, price, units = filed
+        if market_id is not None:
+            self._markets[market_id][side].refresh(order, price, units)
+        self._orders[fm_id] = (order, market_id, side, price, order.units)
+        for filed_orders in (self._my_orders, self._my_public_orders,
+                             self._manager_orders):
+            if fm_id in filed_orders:
+                filed_orders[fm_id] = order
+
+    def _remove(self, fm_id):
+        filed = self._orders.pop(fm_id, None)
+        if filed is None:
+            return
+
+        order, market_id, side, price, units = filed
+        if market_id is not None:
+            self._markets[market_id][side].remove(order, price, units)
+        self._my_orders.pop(fm_id, None)
+        self._my_public_orders.pop(fm_id, None)
+        self._manager_orders.pop(fm_id, None)
+
+    def _book_side(self, market_id, side):
+        sides = self._markets.get(market_id)
+        if sides is None:
+            sides = self._markets[market_id] = {
+                OrderSide.BUY: _BookSide(is_bid=True),
+                OrderSide.SELL: _BookSide(is_bid=False),
+            }
+        return sides[side]
+
+    def _first_order(self, market_id, side, include_mine):
+        if market_id not in self._markets:
+            return None
+        book_side = self._markets[market_id][side]
+        for depth in range(len(book_side)):
+            _, level = book_side.level(depth)
+            if not include_mine and level.units == level.my_units:
+                continue
+            for order in level.orders.values():
+                if include_mine or not getattr(order, "mine", False):
+                    return order
+        return None
+
+    def best_bid(self, market_id, include_mine=True):
+        """
+        :param include_mine: False to skip over our own resting orders
+        :return            : highest priced, earliest public buy order, or
+                                None
+        """
+        return self._first_order(market_id, OrderSide.BUY, include_mine)
+
+    def best_ask(self, market_id, include_mine=True):
+        """
+        :param include_mine: False to skip over our own resting orders
+        :return            : lowest priced, earliest public sell order, or
+                                None
+        """
+        return self._first_order(market_id, OrderSide.SELL, include_mine)
+
+    def depth(self, market_id, side, level=0):
+        """
+        Price and total units resting at a price level
+        :param market_id: market fm_id
+        :param side     : OrderSide of the resting orders
+        :param level    : 0 for the best price, 1 for the next best ...
+        :return         : (price, units), or None if the book isn't that deep
+        """
+        if market_id not in self._markets:
+            return None
+        found = self._markets[market_id][side].level(level)
+        if found is None:
+            return None
+        price, price_level = found
+        return price, price_level.units
+
+    def ladder(self, market_id, side, include_mine=True):
+        """
+        Every price level of one side of a market
+        :param market_id   : market fm_id
+        :param side        : OrderSide of the resting orders
+        :param include_mine: False to leave out our own resting units
+        :return            : list of (price, units), best price first
+        """
+        if market_id not in self._markets:
+            return []
+        ladder = []
+        for price, level in self._markets[market_id][side].levels():
+            units = level.units if include_mine else \
+                level.units - level.my_units
+            if units > 0:
+                ladder.append((price, units))
+        return ladder
+
+    def get(self, fm_id):
+        """
+        :return: the resting order with this fm_id, or None
+        """
+        filed = self._orders.get(fm_id)
+        return filed and filed[0]
+
+    def is_pending(self, fm_id):
+        """
+        :return: True if the order is still resting in the book
+        """
+        return fm_id in self._orders
+
+    def my_orders(self):
+        """
+        :return: list of our own resting orders, public and private
+        """
+        return list(self._my_orders.values())
+
+    def manager_orders(self):
+        """
+        :return: list of resting private orders that are not ours
+        """
+        return list(self._manager_orders.values())
+
+    def is_manager_order(self, fm_id):
+        """
+        :return: True if the order is a resting private order not ours
+        """
+        return fm_id in self._manager_orders
+
+    def num_manager_orders(self):
+        return len(self._manager_orders)
+
+    def last_manager_order(self):
+        """
+        :return: resting private order not ours filed last, or None
+        """
+        return next(reversed(self._manager_orders.values()), None)
+
+    def num_my_public_orders(self):
+        return len(self._my_public_orders)
+
+    def last_my_public_order(self):
+        """
+        :return: our resting public order filed last, or None
+        """
+        return next(reversed(self._my_public_orders.values()), None)
@@ -0,0 +1,352 @@
+"""
+State of every order a bot has sent, keyed by ref and fm_id
+
+A bot used to serialise its trading behind one waiting flag, set when orders
+were sent and cleared once they were all accepted, so only one batch was ever
+in flight and a lost acknowledgement stalled the bot until the session reset.
+The OrderManager instead follows each order through
+
+    SENT -> ACCEPTED -> RESTING -> FILLED or CANCELLED
+         -> REJECTED
+
+from send_order, order_accepted / order_rejected and the order updates
+FlexeMarkets echoes back. An order may also skip states, e.g. one that trades
+on arrival is echoed straight away as FILLED, and the echo of a resting order
+can arrive before it is accepted. A cancel is done once it is accepted, and
+the order it cancels becomes CANCELLED when the update comes in, as does an
+order cancelled by anyone else: only an order consumed by a trade fills.
+
+An order is in flight from SENT until it is accepted or rejected, or its echo
+arrives first, and each market takes new orders while fewer than
+max_in_flight of its orders are in flight. An order in flight for longer than
+timeout seconds is TIMED_OUT, which frees its place, and its state is still
+followed if it turns up later. One that hasn't turned up lost_timeout seconds
+after it was sent is LOST, taken never to have reached FlexeMarkets.
+
+Given a Ledger, the manager reserves the cash or units of every order it is
+sent, and releases them as the order trades, is rejected or cancelled. An
+order that times out may still reach FlexeMarkets and trade, so it stays
+reserved until it is done or LOST. A bot following the units of its orders
+itself is told through on_fill and on_release, which it is also when an order
+times out and again if it is lost.
+"""
+import time
+from enum import Enum
+
+from fmclient import OrderSide, OrderType
+
+MAX_IN_FLIGHT = 1
+ORDER_TIMEOUT = 5
+LOST_TIMEOUT = 30
+
+
+class OrderState(Enum):
+    SENT = 0
+    ACCEPTED = 1
+    REJECTED = 2
+    RESTING = 3
+    FILLED = 4
+    CANCELLED = 5
+    TIMED_OUT = 6
+    LOST = 7
+
+
+# states each state may move to, REJECTED, FILLED, CANCELLED and LOST are
+# final
+_TRANSITIONS = {
+    OrderState.SENT: {OrderState.ACCEPTED, OrderState.REJECTED,
+                      OrderState.RESTING, OrderState.FILLED,
+                      OrderState.CANCELLED, OrderState.TIMED_OUT},
+    OrderState.ACCEPTED: {OrderState.RESTING, OrderState.FILLED,
+                          OrderState.CANCELLED},
+    OrderState.RESTING: {OrderState.FILLED, OrderState.CANCELLED},
+    OrderState.TIMED_OUT: {OrderState.ACCEPTED, OrderState.REJECTED,
+                           OrderState.RESTING, OrderState.FILLED,
+                           OrderState.CANCELLED, OrderState.LOST},
+}
+
+# states in which an order's untraded units are no longer committed
+_RELEASED = {OrderState.REJECTED, OrderState.CANCELLED, OrderState.TIMED_OUT,
+             OrderState.LOST}
+
+
+class ManagedOrder:
+    __slots__ = ("ref", "market_id", "is_cancel", "is_buy", "price", "units",
+                 "filled_units", "fm_id", "state", "sent_time")
+
+    def __init__(self, order, sent_time):
+        self.ref = order.ref
+        self.market_id = order.market.fm_id
+        self.is_cancel = order.order_type == OrderType.CANCEL
+        self.is_buy = order.order_side == OrderSide.BUY
+        self.price = order.price
+        self.units = order.units
+        self.filled_units = 0
+
+        # a cancel keeps the fm_id of the order it cancels
+        self.fm_id = order.fm_id if self.is_cancel else None
+        self.state = OrderState.SENT
+        self.sent_time = sent_time
+
+    def __repr__(self):
+        return f"ManagedOrder({self.ref!r}, M-{self.market_id}, " \
+               f"{self.state.name}, {self.filled_units}/{self.units})"
+
+
+class OrderManager:
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, timeout=ORDER_TIMEOUT,
+                 on_timeout=None, clock=time.monotonic, ledger=None,
+                 on_fill=None, on_release=None, lost_timeout=LOST_TIMEOUT):
+        """
+        :param max_in_flight: orders a market may have in flight before it
+                              takes no new ones
+        :param timeout      : seconds before an order in flight times out
+        :param on_timeout   : function(ManagedOrder) called when one does
+        :param clock        : function returning the time in seconds
+        :param ledger       : Ledger reserving what each order commits, or
+                              None
+        :param on_fill      : function(ManagedOrder, units) called when units
+                              of an order trade
+        :param on_release   : function(ManagedOrder) called when an order is
+                              rejected, cancelled, times out or is lost
+        :param lost_timeout : seconds after it was sent before a timed out
+                              order that never turned up is lost
+        """
+        self._max_in_flight = max_in_flight
+        self._timeout = timeout
+        self._lost_timeout = lost_timeout
+        self._on_timeout = on_timeout
+        self._clock = clock
+        self._ledger = ledger
+        self._on_fill = on_fill
+        self._on_release = on_release
+
+        self._by_ref = {}
+        self._by_fm_id = {}
+
+        # fm_id of an order -> ManagedOrder of the cancel sent for it
+        self._cancels = {}
+
+        # ref -> ManagedOrder in flight, and timed out, oldest first
+        self._in_flight = {}
+        self._timed_out = {}
+        self._counts = {state: 0 for state in OrderState}
+
+        # fm_id of every consumed order whose trade has been counted
+        self._traded = set()
+
+    def reset(self):
+        """
+        Forgets every order, called when the session changes
+        """
+        self._by_ref = {}
+        self._by_fm_id = {}
+        self._cancels = {}
+        self._in_flight = {}
+        self._timed_out = {}
+        self._counts = {state: 0 for state in OrderState}
+        self._traded = set()
+        if self._ledger is not None:
+            self._ledger.release_all()
+
+    @property
+    def max_in_flight(self):
+        return self._max_in_flight
+
+    def get(self, ref):
+        """
+        :return: ManagedOrder of the order sent with this ref, or None
+        """
+        return self._by_ref.get(ref)
+
+    def state(self, ref):
+        """
+        :return: OrderState of the order sent with this ref, or None
+        """
+        managed = self._by_ref.get(ref)
+        return managed and managed.state
+
+    def in_flight(self, market_id=None):
+        """
+        :param market_id: fm_id of a market, or None for every market
+        :return         : number of orders sent but not acknowledged yet
+        """
+        self._expire()
+        if market_id is None:
+            return len(self._in_flight)
+        return sum(1 for managed in self._in_flight.values()
+                   if managed.market_id == market_id)
+
+    def can_send(self, market_id):
+        """
+        :return: True if the market takes new orders
+        """
+        return self.in_flight(market_id) < self._max_in_flight
+
+    def room(self, market_id):
+        """
+        :return: number of orders, cancels included, the market may still
+                    take before it has max_in_flight in flight
+        """
+        return max(0, self._max_in_flight - self.in_flight(market_id))
+
+    def resting(self, market_id=None):
+        """
+        :return: list of our orders resting in the book, of one market or
+                    every market
+        """
+        return [managed for managed in self._by_ref.values()
+                if managed.state == OrderState.RESTING and
+                (market_id is None or managed.market_id == market_id)]
+
+    def summary(self):
+        """
+        :return: dictionary of state name to number of orders ever in it
+                    this session
+        """
+        return {state.name: count for state, count in self._counts.items()
+                if count}
+
+    # ---- EVENTS ----
+    def sent(self, order):
+        """
+        :param order: order about to be sent, with its ref set
+        """
+        managed = ManagedOrder(order, self._clock())
+        self._by_ref[managed.ref] = managed
+        if managed.is_cancel:
+            self._cancels[managed.fm_id] = managed
+        elif self._ledger is not None:
+            self._ledger.reserve(managed, managed.market_id, managed.is_buy,
+                                 managed.price, managed.units)
+
+        # a ref sent again goes to the back, the oldest stay first
+        self._in_flight.pop(managed.ref, None)
+        self._in_flight[managed.ref] = managed
+        self._counts[OrderState.SENT] += 1
+
+    def accepted(self, order):
+        """
+        :param order: order passed to order_accepted
+        """
+        managed = self._by_ref.get(order.ref)
+        if managed is None and order.order_type == OrderType.CANCEL:
+            # a cancel may come back without its ref, consuming the order
+            # it cancels
+            managed = self._cancels.get(getattr(order, "consumer_id", None))
+        if managed is None:
+            return
+
+        # unless its echo, or the balance of a split, came first
+        if not managed.is_cancel and managed.fm_id is None and \
+                order.fm_id is not None:
+            self._filed(managed, order.fm_id)
+        self._move(managed, OrderState.ACCEPTED)
+
+    def rejected(self, order):
+        """
+        :param order: order passed to order_rejected
+        """
+        managed = self._by_ref.get(order.ref)
+        if managed is not None:
+            self._move(managed, OrderState.REJECTED)
+
+    def update(self, orders):
+        """
+        Follows our orders through the order deltas received from
+        FlexeMarkets
+        :param orders: orders received in received_orders
+        """
+        for order in orders:
+            if not getattr(order, "mine", False):
+                continue
+            managed = self._find(order)
+            if managed is None or managed.is_cancel:
+                continue
+
+            if order.is_pending:
+                # a new order, or the balance left after a partial trade
+                self._filed(managed, order.fm_id)
+                self._move(managed, OrderState.RESTING)
+            elif not order.is_consumed:
+                # split, its parts follow
+                continue
+            elif order.is_cancelled:
+                # by our cancel, or by the exchange or the manager, e.g. when
+                # the session closes: nothing traded
+                if order.fm_id == managed.fm_id:
+                    self._move(managed, OrderState.CANCELLED)
+
+                # the echo acknowledges the cancel too
+                cancel = self._cancels.pop(order.fm_id, None)
+                if cancel is not None:
+                    self._move(cancel, OrderState.ACCEPTED)
+            elif order.has_traded and order.fm_id not in self._traded:
+                # a trade echoed again, e.g. with the orders of a session
+                # update, was counted the first time
+                self._traded.add(order.fm_id)
+                self._filed(managed, managed.fm_id or order.fm_id)
+                managed.filled_units += order.units
+                if self._ledger is not None:
+                    self._ledger.traded(managed, order.units)
+                if self._on_fill is not None:
+                    self._on_fill(managed, order.units)
+                if managed.filled_units >= managed.units:
+                    self._move(managed, OrderState.FILLED)
+
+    # ---- BOOKKEEPING ----
+    def _find(self, order):
+        managed = self._by_fm_id.get(order.fm_id)
+        if managed is None:
+            # the parts of a split order keep the fm_id it had
+            managed = self._by_fm_id.get(getattr(order, "original_id", None))
+        ref = getattr(order, "ref", None)
+        if managed is None and ref is not None:
+            managed = self._by_ref.get(ref)
+        return managed
+
+    def _filed(self, managed, fm_id):
+        managed.fm_id = fm_id
+        self._by_fm_id[fm_id] = managed
+
+    def _move(self, managed, state):
+        if state not in _TRANSITIONS.get(managed.state, ()):
+            return
+        managed.state = state
+        self._counts[state] += 1
+        if state in _RELEASED:
+            # a timed out order may still turn up, and rest or trade, until
+            # it is lost
+            if self._ledger is not None and state != OrderState.TIMED_OUT:
+                self._ledger.release(managed)
+            if self._on_release is not None:
+                self._on_release(managed)
+        # an older order sent with the same ref mustn't free the newer one
+        if self._in_flight.get(managed.ref) is managed:
+            del self._in_flight[managed.ref]
+        if self._timed_out.get(managed.ref) is managed:
+            del self._timed_out[managed.ref]
+        if state == OrderState.TIMED_OUT:
+            self._timed_out[managed.ref] = managed
+
+    def _expire(self):
+        in_flight = self._in_flight
+        timed_out = self._timed_out
+        if not in_flight and not timed_out:
+            return
+        now = self._clock()
+        expired = now - self._timeout
+        for managed in list(in_flight.values()):
+            if managed.sent_time > expired:
+                break
+            self._move(managed, OrderState.TIMED_OUT)
+            if self._on_timeout is not None:
+                self._on_timeout(managed)
+
+        # its reservation goes, if it trades after all the holdings show it
+        lost = now - self._lost_timeout
+        for managed in list(timed_out.values()):
+            if managed.sent_time > lost:
+                break
+            self._move(managed, OrderState.LOST)
@@ -0,0 +1,170 @@
+"""
+Converges our resting orders onto a desired set of quotes
+
+Cancelling every order and re-sending every quote each cycle doubles the
+message traffic and throws away our time priority in the queue. Instead the
+desired quotes are compared against our resting orders in the OrderBook, and
+only the cancels and new orders needed to get from one to the other are sent.
+Orders we have sent that FlexeMarkets hasn't echoed back yet count towards the
+quotes, so they are not sent twice, until they are rejected or given up on.
+"""
+import copy
+
+from fmclient import Order, OrderType
+
+
+class QuoteManager:
+
+    def __init__(self, order_book, ref_prefix="Quote"):
+        """
+        :param order_book: OrderBook the bot keeps up to date
+        :param ref_prefix: start of the ref given to every new quote
+        """
+        self._book = order_book
+        self._ref_prefix = ref_prefix
+        self._next_ref = 0
+
+        # new quotes not echoed back yet, ref -> (key, units), and fm_id of
+        # resting orders a cancel has been sent for
+        self._sending = {}
+        self._cancelling = set()
+
+        # messages sent, and those cancel-all/replace would have sent
+        self._messages_sent = 0
+        self._messages_replace_all = 0
+
+    def reset(self):
+        """
+        Forgets orders in flight and the message counts, called when the
+        session changes
+        """
+        self._sending = {}
+        self._cancelling = set()
+        self._messages_sent = 0
+        self._messages_replace_all = 0
+
+    @property
+    def messages_sent(self):
+        return self._messages_sent
+
+    @property
+    def messages_saved(self):
+        """
+        :return: messages saved this session against cancelling every resting
+                    order and re-sending every quote on each converge
+        """
+        return self._messages_replace_all - self._messages_sent
+
+    def update(self, orders):
+        """
+        Resolves orders in flight from the order deltas received from
+        FlexeMarkets, call after OrderBook.update
+        :param orders: orders received in received_orders
+        """
+        for order in orders:
+            if getattr(order, "mine", False) and order.ref in self._sending:
+                del self._sending[order.ref]
+        self._cancelling = {fm_id for fm_id in self._cancelling
+                            if self._book.is_pending(fm_id)}
+
+    def rejected(self, order):
+        """
+        A quote was rejected and will never rest in the book
+        :param order: order passed to order_rejected
+        """
+        self._sending.pop(order.ref, None)
+
+    def released(self, ref):
+        """
+        A quote wasn't acknowledged in time and may never be echoed back, it
+        no longer counts towards its quote
+        :param ref: ref the quote was sent with
+        """
+        self._sending.pop(ref, None)
+
+    def converge(self, quotes, send_order, room=None):
+        """
+        Sends the cancels and new orders that turn our resting orders into
+        the given quotes. Resting orders that fit a quote are kept, oldest
+        first, so they keep their place in the queue
+        :param quotes    : dictionary of (Market, OrderSide, price) to units
+        :param send_order: function that sends an order, e.g. Agent.send_order
+        :param room      : dictionary of Market to the number of orders,
+                           cancels first, that may be sent in it. Our orders
+                           and quotes in any other market are left alone, and
+                           what doesn't fit waits for the next converge. None
+                           for every market, without limit
+        :return          : number of new (non cancel) orders sent
+        """
+        if room is not None:
+            room = dict(room)
+            quotes = {key: units for key, units in quotes.items()
+                      if key[0] in room}
+
+        def take(market):
+            # one more order in the market, if it has room for it
+            if room is None:
+                return True
+            if room[market] <= 0:
+                return False
+            room[market] -= 1
+            return True
+
+        resting = {}
+        for order in self._book.my_orders():
+            if room is not None and order.market not in room:
+                continue
+            if order.fm_id not in self._cancelling:
+                key = (order.market, order.order_side, order.price)
+                resting.setdefault(key, []).append(order)
+
+        in_flight = {}
+        for key, units in self._sending.values():
+            in_flight[key] = in_flight.get(key, 0) + units
+
+        self._messages_replace_all += \
+            sum(len(orders) for orders in resting.values()) + \
+            sum(1 for units in quotes.values() if units > 0)
+
+        # cancel whatever doesn't fit a quote
+        kept = {}
+        for key, orders in resting.items():
+            wanted = quotes.get(key, 0) - in_flight.get(key, 0)
+            kept[key] = 0
+            for order in orders:
+                if kept[key] + order.units <= wanted:
+                    kept[key] += order.units
+                    continue
+                if not take(order.market):
+                    continue
+
+                cancel_order = copy.copy(order)
+                cancel_order.order_type = OrderType.CANCEL
+                cancel_order.ref = f"Cancel - {order.ref} - SM"
+                self._cancelling.add(order.fm_id)
+                self._messages_sent += 1
+                send_order(cancel_order)
+
+        # top up every quote that is short of units
+        num_new_orders = 0
+        for key, units in quotes.items():
+            missing = units - kept.get(key, 0) - in_flight.get(key, 0)
+            market, side, price = key
+            if missing <= 0 or not take(market):
+                continue
+
+            new_order = Order.create_new()
+            new_order.market = market
+            new_order.order_side = side
+            new_order.order_type = OrderType.LIMIT
+            new_order.price = price
+            new_order.units = missing
+            new_order.ref = f"{self._ref_prefix} {self._next_ref} - SM"
+            self._next_ref += 1
+
+            self._sending[new_order.ref] = (key, missing)
+            self._messages_sent += 1
+            num_new_orders += 1
+            send_order(new_order)
+
+        return num_new_orders
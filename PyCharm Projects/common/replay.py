@@ -0,0 +1,445 @@
+"""
+Replays recorded bot logs into a bot, for backtesting strategy code offline
+
+Every bot logs, through Agent.inform, the orders it receives in
+received_orders, the assets it holds in received_holdings and each session
+update, with millisecond timestamps:
+
+    [2020-09-04 13:44:42,059:  agent.DSBot]:  INFO - Order(11219901,Mine,
+        BUY,1@300,M-1570,LIMIT,REF:'SM - OrderSide.BUY-0')
+    [2020-08-29 21:05:56,010:  agent.FirstBot]:  INFO - Asset(Market(1572,
+        widget,Widget,False),15,15,15,0,True,True)
+    [2020-09-04 13:44:41,540:  agent.DSBot]:  INFO - Session: SID:14438:
+        SessionState.CLOSED
+
+read_log() turns each run of the bot in a log file into a LogRecording, a
+stream of the order, holding and session messages FlexeMarkets sent, and
+LogReplay feeds a recording to an unmodified bot through its Agent handlers.
+
+    recording = max(read_log(path, cash=10000), key=len)
+    replay = LogReplay(recording)
+    replay.connect(bot)
+    replay.run()
+
+By default the replay runs on virtual time, as fast as the bot can process
+it, and the bot's periodic tasks keep their cadence relative to the
+recording. Given a speed it runs on the wall clock instead, `speed` times
+faster than recorded.
+
+The logs only hold what the bot printed, so some of the state is inferred:
+ - consecutive Order lines are one received_orders call, and consecutive
+   Asset lines one received_holdings call
+ - an order seen for the first time is pending, and a pending order seen
+   again has been consumed: by a CANCEL line for the same order if there is
+   one, otherwise by a trade
+ - the orders printed right after a session update are FlexeMarkets
+   re-sending the session's orders, which change nothing already seen.
+   Orders in them that had already traded before the bot started show as
+   pending, as the log doesn't say otherwise
+ - cash is never logged, so holdings carry the cash given to read_log()
+The recorded market does not react to the replayed bot: the orders it sends
+are kept in LogReplay.sent, accepted and echoed back to rest in the book
+until the bot cancels them, but never trade.
+"""
+import asyncio
+import datetime
+import functools
+import itertools
+import os
+import re
+
+from fmclient import Market, Order, OrderType
+
+from common.agent_context import clear_registries, user_tasks
+from common.exchange import VirtualTimeLoop
+
+# consecutive lines further apart than this are separate messages
+BATCH_GAP = 0.05
+
+# the lines of a -bot.log that recordings are read from, also parsed by
+# common.log_store: the time and message of an INFO line, and the messages
+# logging an order, holding, market and session
+LOG_LINE = re.compile(r"^\[(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}):[^\]]*\]:"
+                      r"\s*INFO - (.*)$")
+ORDER_LINE = re.compile(r"^Order\((\d+),(Mine|Others),(BUY|SELL),(\d+)@"
+                        r"(-?\d+),M-(\d+),(LIMIT|CANCEL)(?:,REF:'(.*)')?"
+                        r"(?:,PVT_(?:TO|FROM):(\w+))?\)$")
+ASSET_LINE = re.compile(r"^Asset\(Market\((\d+),[^)]*\),(-?\d+),(-?\d+),"
+                        r"(-?\d+),(-?\d+),(True|False),(True|False)\)$")
+MARKET_LINE = re.compile(r"^Market\((\d+),([^,]+),(.*),(True|False)\)$")
+SESSION_LINE = re.compile(r"^Session: SID:(\d+):SessionState\.(\w+)$")
+
+
+class LogRecording:
+    """
+    One run of a bot: the markets it traded and the messages it received,
+    as (seconds since the run started, kind, json) with kind one of
+    "orders", "holdings" and "session"
+    """
+
+    def __init__(self, name, started):
+        self.name = name
+        self.started = started
+        self.markets = {}
+        self.events = []
+
+    def __len__(self):
+        return len(self.events)
+
+    def __str__(self):
+        return f"{self.name} ({len(self)} events, {self.duration:.1f} s)"
+
+    @property
+    def duration(self):
+        return self.events[-1][0] if self.events else 0.0
+
+    @property
+    def num_orders(self):
+        return sum(len(json) for _, kind, json in self.events
+                   if kind == "orders")
+
+
+class _RecordingParser:
+
+    def __init__(self, name, cash):
+        self._name = name
+        self._cash = cash
+        self._recording = None
+
+        # latest json of every order seen, and pending orders by fm_id
+        self._orders = {}
+        self._pending = {}
+
+        # lines of the message being read, its kind and time
+        self._batch = []
+        self._kind = None
+        self._batch_time = None
+        self._after_session = False
+
+    def feed(self, time, message):
+        """
+        :param time   : datetime the line was logged
+        :param message: text after "INFO - "
+        """
+        for kind, pattern in (("orders", ORDER_LINE),
+                              ("holdings", ASSET_LINE),
+                              ("session", SESSION_LINE),
+                              ("market", MARKET_LINE)):
+            match = pattern.match(message)
+            if match:
+                break
+        else:
+            self._flush()
+            return
+
+        if self._recording is None:
+            self._recording = LogRecording(self._name, time)
+        seconds = (time - self._recording.started).total_seconds()
+
+        if kind == "market":
+            self._flush()
+            fm_id, item, name, private = match.groups()
+            self._recording.markets[int(fm_id)] = (item, name,
+                                                   private == "True")
+            return
+
+        if kind != self._kind or kind == "session" or \
+                seconds - self._batch_time > BATCH_GAP:
+            self._flush()
+            self._kind = kind
+            self._batch_time = seconds
+        self._batch.append(match.groups())
+        self._batch_time = seconds
+
+    def finish(self):
+        """
+        :return: the LogRecording of the run, or None if it had no messages
+        """
+        self._flush()
+        recording = self._recording
+        if recording is not None and not recording.events:
+            recording = None
+        return recording
+
+    def _flush(self):
+        if not self._batch:
+            return
+        batch, kind, seconds = self._batch, self._kind, self._batch_time
+        self._batch, self._kind = [], None
+
+        if kind == "orders":
+            json = self._orders_json(batch)
+            self._after_session = False
+            if not json:
+                return
+        elif kind == "holdings":
+            json = self._holding_json(batch)
+        else:
+            fm_id, state = batch[-1]
+            json = {"id": int(fm_id), "state": state}
+            self._after_session = True
+        self._recording.events.append((seconds, kind, json))
+
+    def _orders_json(self, batch):
+        jsons = []
+        consumed = []
+        for fm_id, whose, side, units, price, market_id, order_type, ref, \
+                owner_target in batch:
+            fm_id = int(fm_id)
+            self._add_market(int(market_id))
+            if order_type == "CANCEL":
+                if fm_id in self._orders:
+                    continue
+                cancelled = self._cancelled_order(whose, side, units, price,
+                                                  market_id)
+                if cancelled is not None:
+                    json = self._consume(cancelled, fm_id)
+                    jsons.append(json)
+                jsons.append(self._order_json(
+                    fm_id, whose, side, units, price, market_id, order_type,
+                    ref, owner_target, consumer=cancelled or fm_id))
+                continue
+
+            if fm_id not in self._orders:
+                json = self._order_json(fm_id, whose, side, units, price,
+                                        market_id, order_type, ref,
+                                        owner_target)
+                self._pending[fm_id] = json
+                jsons.append(json)
+            elif fm_id in self._pending and not self._after_session:
+                consumed.append(self._pending[fm_id])
+
+        # pair up orders that traded with each other where we can, anything
+        # else traded with an order the bot never printed
+        for json in consumed:
+            if json["id"] not in self._pending:
+                continue
+            counterpart = next(
+                (other for other in consumed
+                 if other["id"] in self._pending and
+                 other["marketId"] == json["marketId"] and
+                 other["side"] != json["side"]), None)
+            consumer = json["id"] if counterpart is None else \
+                counterpart["id"]
+            jsons.append(self._consume(json["id"], consumer))
+            if counterpart is not None:
+                jsons.append(self._consume(counterpart["id"], json["id"]))
+        return jsons
+
+    def _order_json(self, fm_id, whose, side, units, price, market_id,
+                    order_type, ref, owner_target, consumer=None):
+        json = {"id": fm_id, "type": order_type, "side": side,
+                "units": int(units), "price": int(price),
+                "marketId": int(market_id), "mine": whose == "Mine",
+                "original": consumer or fm_id, "consumer": consumer,
+                "clientDescription": ref, "ownerTarget": owner_target}
+        self._orders[fm_id] = json
+        return json
+
+    def _cancelled_order(self, whose, side, units, price, market_id):
+        """
+        :return: fm_id of the latest pending order a cancel with these
+                    fields was sent for, or None
+        """
+        key = (whose == "Mine", side, int(units), int(price), int(market_id))
+        for fm_id in reversed(self._pending):
+            json = self._pending[fm_id]
+            if (json["mine"], json["side"], json["units"], json["price"],
+                    json["marketId"]) == key:
+                return fm_id
+        return None
+
+    def _consume(self, fm_id, consumer):
+        json = dict(self._pending.pop(fm_id), consumer=consumer)
+        self._orders[fm_id] = json
+        return json
+
+    def _holding_json(self, batch):
+        assets = []
+        for market_id, units, available, initial, initial_short, can_buy, \
+                can_sell in batch:
+            self._add_market(int(market_id))
+            assets.append({
+                "units": int(units), "availableUnits": int(available),
+                "initialUnits": int(initial),
+                "initialShortUnits": int(initial_short),
+                "market": {"id": int(market_id)},
+                "grant": {"canBuy": can_buy == "True",
+                          "canSell": can_sell == "True",
+                          "units": 0, "shortUnits": 0},
+            })
+        return {"cash": self._cash, "availableCash": self._cash,
+                "initialCash": self._cash, "assets": assets}
+
+    def _add_market(self, market_id):
+        # markets the bot didn't print are named after their id
+        if market_id not in self._recording.markets:
+            self._recording.markets[market_id] = (f"market{market_id}",
+                                                  f"Market {market_id}",
+                                                  False)
+
+
+def read_log(path, cash=0):
+    """
+    Parses a bot log file
+    :param path: path to a logs/*.log file
+    :param cash: cash in cents the holdings are given, as it isn't logged
+    :return    : list of LogRecording, one per run of the bot that received
+                    any messages, in the order they were logged
+    """
+    recordings = []
+    name = os.path.basename(path)
+    parser = None
+    with open(path, encoding="utf-8", errors="replace") as log:
+        for line in log:
+            if "Log Started" in line:
+                recording = parser.finish() if parser else None
+                if recording is not None:
+                    recordings.append(recording)
+                parser = _RecordingParser(f"{name} #{len(recordings) + 1}",
+                                          cash)
+                continue
+
+            match = LOG_LINE.match(line.rstrip("\n"))
+            if match is None or parser is None:
+                continue
+            time = datetime.datetime.strptime(match.group(1),
+                                              "%Y-%m-%d %H:%M:%S,%f")
+            parser.feed(time, match.group(2))
+
+    recording = parser.finish() if parser else None
+    if recording is not None:
+        recordings.append(recording)
+    return recordings
+
+
+class LogReplay:
+
+    def __init__(self, recording, speed=None, min_price=0, max_price=1000,
+                 price_tick=1):
+        """
+        Sets up the recorded markets. Markets, orders and sessions are
+        process wide singletons, so any previous ones are forgotten
+        :param recording : LogRecording to replay
+        :param speed     : None to run as fast as possible on virtual time,
+                           otherwise how many times faster than recorded to
+                           run on the wall clock
+        :param min_price : price range and tick of the recorded markets,
+        :param max_price   which the logs don't hold
+        :param price_tick:
+        """
+        self._recording = recording
+        self._speed = speed
+        self._loop = VirtualTimeLoop() if speed is None else \
+            asyncio.new_event_loop()
+        self._agent = None
+        self._tasks = []
+        self._start = self._loop.time()
+
+        # the bot's orders get ids after every recorded one
+        self._order_ids = itertools.count(1 + max(
+            (json["id"] for _, kind, jsons in recording.events
+             if kind == "orders" for json in jsons), default=0))
+
+        clear_registries(("Market", "MarketByItem", "Session"))
+        Order.clear_all()
+        for market_id, (item, name, private) in recording.markets.items():
+            Market(market_id, {
+                "id": market_id, "item": item, "name": name,
+                "description": "", "minimumPrice": min_price,
+                "maximumPrice": max_price, "priceTick": price_tick,
+                "minimumUnit": 1, "maximumUnit": 100, "unitTick": 1,
+                "privateMarket": private,
+            })
+
+        # orders the bot sent, as (seconds into the recording, order)
+        self.sent = []
+        self.num_events = 0
+
+    @property
+    def loop(self):
+        return self._loop
+
+    @property
+    def time(self):
+        """
+        :return: seconds into the recording
+        """
+        return (self._loop.time() - self._start) * (self._speed or 1)
+
+    def connect(self, agent):
+        """
+        Connects an fmclient Agent in place of the hosted service. The
+        recorded orders are `mine` as the recorded bot saw them, so only one
+        bot can be replayed into at a time
+        :param agent: the bot, not yet initialised
+        """
+        agent._enable_ws_comm = False
+        agent._loop = self._loop
+        agent.send_order = self._send_order
+        self._agent = agent
+
+    def run(self, tail=1.0):
+        """
+        Initialises the bot, replays every message of the recording to it
+        and stops its periodic tasks
+        :param tail: seconds to keep running after the last message
+        """
+        agent = self._agent
+        agent._safely_call_method(agent.initialised)
+        agent._safely_call_method(agent.pre_start_tasks)
+
+        self._start = self._loop.time()
+        scale = 1 / (self._speed or 1)
+        handlers = {"orders": agent._on_orders_update,
+                    "holdings": agent._on_holding_update,
+                    "session": agent._on_session_update}
+        for seconds, kind, json in self._recording.events:
+            self._loop.call_at(self._start + seconds * scale, self._dispatch,
+                               handlers[kind], _copy_json(json))
+
+        self._tasks = [self._loop.create_task(task)
+                       for task in user_tasks(agent)]
+        self._loop.run_until_complete(
+            asyncio.sleep((self._recording.duration + tail) * scale))
+
+        agent._stop = True
+        if self._tasks:
+            self._loop.run_until_complete(asyncio.gather(*self._tasks))
+        self._loop.close()
+
+    def _dispatch(self, handler, json):
+        self.num_events += len(json) if isinstance(json, list) else 1
+        handler(json)
+
+    def _send_order(self, order):
+        """
+        Every order the bot sends is accepted and echoed back, to rest until
+        the bot cancels it. Nothing trades with it
+        """
+        self.sent.append((self.time, order))
+        self._loop.call_soon(self._accept, order)
+
+    def _accept(self, order):
+        fm_id = next(self._order_ids)
+        json = {"id": fm_id, "type": order.order_type.name,
+                "side": order.order_side.name, "units": order.units,
+                "price": order.price, "marketId": order.market.fm_id,
+                "mine": True, "original": fm_id, "consumer": None,
+                "clientDescription": order.ref,
+                "ownerTarget": order.owner_or_target}
+        jsons = [json]
+        if order.order_type is OrderType.CANCEL:
+            json["original"] = json["consumer"] = order.fm_id
+            jsons.insert(0, {"id": order.fm_id, "consumer": fm_id})
+
+        agent = self._agent
+        agent._safely_call_method(functools.partial(
+            agent.order_accepted, Order(fm_id, json)))
+        self._dispatch(agent._on_orders_update, jsons)
+
+
+def _copy_json(json):
+    if isinstance(json, list):
+        return [dict(item) for item in json]
+    return dict(json)
@@ -0,0 +1,236 @@
+"""
+Runs many fmclient Agents in one process, on one shared event loop
+
+Agent.run() logs in, connects the bot's websockets and then takes the process
+over with an event loop of its own until the bot stops, so running DSBot and
+CAPMBot across several marketplaces has meant one process per bot, each with
+its own login, HTTP session and order registry. A BotRunner initialises its
+bots one after the other on a single loop, then runs the order and message
+tasks of all of them on it together:
+
+    runner = BotRunner()
+    runner.add(DSBot(ACCOUNT, EMAIL, PASSWORD, 915, BotType.REACTIVE))
+    runner.add(CAPMBot(ACCOUNT, EMAIL, PASSWORD, 1054, risk_penalty=0.007))
+    runner.run()
+
+What is shared is what fmclient allows to be:
+ - the login. FMAuth is a process wide singleton, logged in by the first bot
+   initialised, so every bot of a runner must trade for the same account
+ - the aiohttp session, and its connection pool, behind every REST request
+   and every order sent, also a process wide singleton
+ - the event loop and its default thread pool
+The FlexeMarkets websocket subscribes to a single marketplace, so each bot
+keeps its own. Each bot also gets its own view of the Order, Session and
+Market registries, as on the LocalExchange, so one marketplace opening a
+session doesn't clear another's orders and a bot's markets are its own. The
+fmclient internals that takes, and those of Agent.run() the runner calls in
+its place, are in common.agent_context.
+
+Agent._initialise gives the loop a thread pool of its own for each bot, which
+would leave all but the last one's running for good. The runner's loop keeps
+the first and shuts each later one down, and the one kept is shut down with
+the loop.
+
+run_sharded() spreads bots over processes, a BotRunner in each, keeping the
+bots of an account together:
+
+    if __name__ == "__main__":
+        run_sharded([BotSpec(DSBot, ACCOUNT, EMAIL, PASSWORD, 915,
+                             BotType.REACTIVE),
+                     BotSpec(CAPMBot, ACCOUNT, EMAIL, PASSWORD, 1054)],
+                    num_processes=2)
+
+Processes are spawned rather than forked, so the bots' factories must be
+importable, and the calling script guarded by `if __name__ == "__main__"`.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+
+from common.agent_context import agent_coroutines, bot_context, initialise
+
+# registries every bot of a runner keeps to itself
+REGISTRIES = ("Order", "Session", "Market", "MarketByItem")
+
+
+class _SharedExecutorLoop(asyncio.SelectorEventLoop):
+    """
+    Event loop keeping one default executor for every bot run on it
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._has_executor = False
+
+    def set_default_executor(self, executor):
+        if self._has_executor:
+            executor.shutdown(wait=False)
+            return
+        super().set_default_executor(executor)
+        self._has_executor = True
+
+
+class BotRunner:
+
+    def __init__(self):
+        self._loop = _SharedExecutorLoop()
+        self._account = None
+
+        # (agent, its context) of every bot added
+        self._bots = []
+
+    @property
+    def loop(self):
+        return self._loop
+
+    def __len__(self):
+        return len(self._bots)
+
+    def add(self, agent):
+        """
+        :param agent: the bot, not yet run
+        :return     : the bot
+        """
+        if self._account is None:
+            self._account = agent._account
+        elif agent._account != self._account:
+            raise ValueError(f"{agent.name} trades for {agent._account}, fmclient "
+                             f"logs in once per process and this runner is "
+                             f"logged in for {self._account}")
+        self._bots.append((agent, bot_context(REGISTRIES)))
+        return agent
+
+    def run(self):
+        """
+        Initialises every bot and runs them until all of them stop
+        """
+        asyncio.set_event_loop(self._loop)
+        running = [(agent, context) for agent, context in self._bots
+                   if context.run(self._initialise, agent)]
+
+        tasks = []
+        for agent, context in running:
+            tasks += [context.run(self._loop.create_task, coroutine)
+                      for coroutine in self._coroutines(agent)]
+        gathered = asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            self._loop.run_until_complete(gathered)
+        except KeyboardInterrupt:
+            for agent, context in running:
+                context.run(agent.error, "Oops. Keyboard Interrupt received from user.")
+        finally:
+            for agent, context in running:
+                context.run(agent.inform, "Shutting Down")
+                context.run(setattr, agent, "stop", True)
+
+            # every task checks stop at least once a second
+            if not gathered.done():
+                self._loop.run_until_complete(gathered)
+            self._loop.run_until_complete(self._loop.shutdown_default_executor())
+            logging.shutdown()
+            self._loop.close()
+
+    def _initialise(self, agent):
+        """
+        Logs the bot in and connects it, as Agent.run() does before it starts
+        :return: True if the bot is to be run
+        """
+        try:
+            initialise(agent)
+        except SystemExit:
+            # fmclient exits when a bot can't connect, the others carry on
+            return False
+        agent._safely_call_method(agent.pre_start_tasks)
+        return True
+
+    @staticmethod
+    def _coroutines(agent):
+        """
+        :return: the bot's periodic tasks and the order and message tasks that
+                    Agent.run() would run
+        """
+        return agent_coroutines(agent)
+
+
+class BotSpec:
+    """
+    How to build a bot in a runner process, factory(*args, **kwargs), where the
+    factory is importable there, e.g. the bot's class
+    """
+
+    def __init__(self, factory, *args, **kwargs):
+        self.factory = factory
+        self.args = args
+        self.kwargs = kwargs
+
+    @property
+    def account(self):
+        """
+        :return: FM account the bot trades for, its first argument as in Agent
+        """
+        return self.kwargs.get("account", self.args[0] if self.args else None)
+
+    def build(self):
+        return self.factory(*self.args, **self.kwargs)
+
+
+def shard(specs, num_processes):
+    """
+    Splits bots into at most num_processes shards, or one per account if there
+    are more accounts, never mixing two accounts in a shard
+    :param specs: list of BotSpec
+    :return     : list of lists of BotSpec
+    """
+    by_account = {}
+    for spec in specs:
+        by_account.setdefault(spec.account, []).append(spec)
+
+    shards = []
+    per_account = max(1, num_processes // max(len(by_account), 1))
+    for account_specs in by_account.values():
+        num_shards = min(per_account, len(account_specs))
+        shards += [account_specs[i::num_shards] for i in range(num_shards)]
+    return shards
+
+
+def start_shards(specs, num_processes=None, runner=BotRunner):
+    """
+    Starts a process for each shard of the bots, running them in a runner
+    :param specs        : list of BotSpec
+    :param num_processes: processes to spread the bots over, the number of CPUs
+                            by default
+    :param runner       : BotRunner class to run each shard in
+    :return             : list of the started multiprocessing.Process
+    """
+    context = multiprocessing.get_context("spawn")
+    processes = []
+    for i, specs_of_shard in enumerate(shard(specs, num_processes or os.cpu_count())):
+        process = context.Process(target=_run_shard, args=(runner, specs_of_shard),
+                                  name=f"BotRunner-{i}")
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def run_sharded(specs, num_processes=None, runner=BotRunner):
+    """
+    Runs the bots sharded over processes, until every process ends
+    :return: exit codes of the processes
+    """
+    processes = start_shards(specs, num_processes, runner)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # the processes got the interrupt too, let them shut down
+        for process in processes:
+            process.join()
+    return [process.exitcode for process in processes]
+
+
+def _run_shard(runner, specs):
+    bot_runner = runner()
+    for spec in specs:
+        bot_runner.add(spec.build())
+    bot_runner.run()